@@ -1,19 +1,62 @@
 import datetime
 import json
-import hashlib
+import re
+import time
+from contextlib import aclosing
+from functools import lru_cache
 from astrbot.core.provider.entities import LLMResponse
 from astrbot.core.provider.provider import Provider
 from astrbot.api import logger
 from .prompt import *
-from .enums import DeepResearchWorkStage
+from .enums import DeepResearchWorkStage, LLMPriority
+from .compaction import ContextCompactor, content_to_text, estimate_tokens, messages_tokens
+from .session_store import DeepResearchSessionStore
+from .streaming import IncrementalJSONParser, StreamForwarder
+from .json_repair import parse_action
+from .exceptions import ActionParseError
+from .llm_client import ResilientLLMCaller
+from .todo import TodoStore
+from .tool_executor import tool_call_name
+from .trajectory import TrajectoryRecorder
+from .usage import SessionUsage, response_usage
 
 from jinja2 import Template
 
+
+# 系统提示词中的日期时间占位符，阶段提示词缓存后再替换为当前时间
+DATETIME_PLACEHOLDER = "\x00current_datetime\x00"
+
+_ACTION_STAGE_RE = re.compile(r'"stage":\s*\[([^\]]*)\]')
+
+
+@lru_cache(maxsize=None)
+def compile_template(source: str) -> Template:
+    """
+    编译Jinja模板，同一模板在进程内只编译一次
+    """
+    return Template(source)
+
+
+@lru_cache(maxsize=None)
+def stage_actions(stage: DeepResearchWorkStage) -> str:
+    """
+    获取指定阶段可用的actions
+    """
+    actions = []
+    for item in DEEPRESEARCH_ACTION_ITEMS:
+        match = _ACTION_STAGE_RE.search(item)
+        if match is None or stage.name in re.findall(r'"(\w+)"', match.group(1)):
+            actions.append(item.strip("\n"))
+    return "\n".join(actions)
+
+
 class DeepResearchAgent:
     """
     深度研究上下文
     """    
-    def __init__(self, session_id: str, provider: Provider, tools: list):        
+    def __init__(self, session_id: str, provider: Provider, tools: list, compactor: ContextCompactor = None,
+                 store: DeepResearchSessionStore = None, max_parse_retries: int = 2, llm_caller: ResilientLLMCaller = None,
+                 recorder: TrajectoryRecorder = None):        
         # 深度研究会话ID
         self._session_id: str = session_id
         
@@ -34,17 +77,57 @@ class DeepResearchAgent:
             DeepResearchWorkStage.FINISHED: []
         }
         
-        # 外部工具
+        # 外部工具，会话创建后不再变化，工具列表的提示词只序列化一次
         self._tools = tools
+        self._tools_prompt = "\n".join([json.dumps(tool.get("function"), ensure_ascii=False, indent=4) for tool in self._tools])
         
         # 系统指令
         self._system_prompt_template = DEEPRESEARCH_PROMPT + DEEPRESEARCH_ACTIONS + DEEPRESEARCH_TOOLS + DEEPRESEARCH_NOTICE
         
+        # 各阶段渲染后的系统指令缓存 阶段 -> 系统指令
+        self._stage_prompt_cache = {}
+        
         # 当前任务的研究主题
         self._research_topic = None
         
         # 当前任务的TODO list
-        self._todo_list = []
+        self._todo_list = TodoStore()
+        
+        # 上下文压缩
+        self._compactor = compactor
+        
+        # 上下文压缩累计节省的token数量
+        self._tokens_saved = 0
+        
+        # 对话历史占用的内存(字节，估算值)
+        self._history_org_bytes = 0
+        self._history_bytes = 0
+        
+        # 内存中的完整对话历史是否只保留了最近部分，完整内容需从存储中读取
+        self._history_org_trimmed = False
+        
+        # 带超时、重试和熔断的模型调用，为None时直接调用Provider
+        self._llm_caller = llm_caller
+        
+        # 模型输出无法解析时，最多要求模型重新生成的次数
+        self._max_parse_retries = max(0, max_parse_retries)
+        
+        # 模型调用用量
+        self._usage = SessionUsage()
+        
+        # 会话轨迹录制，为None时不录制
+        self._recorder = recorder
+        
+        # 当前执行研究的用户，用于模型调用调度
+        self._user_id: str = None
+        
+        # 发起研究的用户，只有该用户可以恢复会话
+        self._owner_id: str = None
+        
+        # 会话持久化存储
+        self._store = store
+        if self._store is not None:
+            self._store.create_session(session_id)
         
     @property
     def provider(self):
@@ -54,6 +137,24 @@ class DeepResearchAgent:
     def session_id(self) -> str:
         return self._session_id
 
+    @property
+    def user_id(self) -> str:
+        return self._user_id
+    
+    @user_id.setter
+    def user_id(self, user_id: str):
+        self._user_id = user_id
+
+    @property
+    def owner_id(self) -> str:
+        return self._owner_id
+    
+    @owner_id.setter
+    def owner_id(self, owner_id: str):
+        self._owner_id = owner_id
+        if self._store is not None:
+            self._store.set_owner(self._session_id, owner_id)
+
     @property
     def stage(self) -> DeepResearchWorkStage:
         return self._stage
@@ -61,6 +162,8 @@ class DeepResearchAgent:
     @stage.setter
     def stage(self, stage: DeepResearchWorkStage):
         self._stage = stage
+        if self._store is not None:
+            self._store.set_stage(self._session_id, stage.value)
     
     @property
     def research_topic(self) -> str:
@@ -69,10 +172,20 @@ class DeepResearchAgent:
     @research_topic.setter
     def research_topic(self, research_topic: str):
         self._research_topic = research_topic
+        if self._store is not None:
+            self._store.set_research_topic(self._session_id, research_topic)
     
     @property
     def todo_list(self) -> list:
-        return self._todo_list
+        return self._todo_list.to_list()
+    
+    @property
+    def usage(self) -> SessionUsage:
+        return self._usage
+    
+    @property
+    def tokens_saved(self) -> int:
+        return self._tokens_saved
     
     @property
     def history(self) -> list:
@@ -82,38 +195,136 @@ class DeepResearchAgent:
     def history(self) -> list:
         return self._history[self.stage]
     
+    @property
+    def tools(self) -> list:
+        return self._tools
+    
     @property
     def system_prompt(self) -> str:
-        # TODO 按阶段添加可用actions
-        prompt = Template(self._system_prompt_template).render(
-            current_datetime=datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            stage=self.stage,
-            tools="\n".join([json.dumps(tool.get("function"), ensure_ascii=False, indent=4) for tool in self._tools]),
-            actions=""
-        )
+        # 除当前时间外，同一阶段的系统指令不变，只渲染一次
+        prompt = self._stage_prompt_cache.get(self.stage)
+        if prompt is None:
+            prompt = compile_template(self._system_prompt_template).render(
+                current_datetime=DATETIME_PLACEHOLDER,
+                stage=self.stage,
+                tools=self._tools_prompt,
+                actions=stage_actions(self.stage) if self.stage is not None else ""
+            )
+            self._stage_prompt_cache[self.stage] = prompt
         
-        return prompt
+        return prompt.replace(DATETIME_PLACEHOLDER, datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
     
-    def add_todo_list(self, step: str, status: str = "队列中", reason: str = ""):
-        self._todo_list.append({
-            "id": hashlib.md5(step.encode("utf-8")).hexdigest()[:6],
-            "step": step,
-            "status": status,
-            "reason": reason
-        })
+    @staticmethod
+    def _message_bytes(content) -> int:
+        return len(content_to_text(content).encode("utf-8"))
+    
+    @property
+    def memory_usage(self) -> int:
+        """
+        对话历史占用的内存(字节，估算值)
+        """
+        return self._history_org_bytes + self._history_bytes
+    
+    @property
+    def history_size(self) -> dict:
+        """
+        各部分对话历史的消息数量
+        """
+        size = {"original": len(self._history_org)}
+        for stage, history in self._history.items():
+            size[stage.value] = len(history)
+        return size
+    
+    def load_state(self, state: dict):
+        """
+        从持久化存储读取的状态恢复会话，不会重新写入存储
+
+        state 中没有完整对话历史时，需要时再从存储中读取
+        """
+        self._stage = DeepResearchWorkStage(state["stage"]) if state.get("stage") else None
+        self._research_topic = state.get("research_topic")
+        self._owner_id = state.get("owner_id")
+        history_org = state.get("history_org")
+        self._history_org = history_org or []
+        self._history_org_trimmed = history_org is None
+        for stage in self._history:
+            self._history[stage] = state.get("history", {}).get(stage.value, [])
+        self._todo_list.load(state.get("todo_list", []))
+        self._usage.load(state.get("usage", {}))
+        
+        self._history_org_bytes = sum(self._message_bytes(message["content"]) for message in self._history_org)
+        self._history_bytes = sum(self._message_bytes(message["content"]) for history in self._history.values() for message in history)
+    
+    def trim_memory(self, max_bytes: int) -> int:
+        """
+        内存占用超过 max_bytes 时，丢弃内存中较早的完整对话历史(已保存在存储中)，返回释放的字节数
+        """
+        if self._store is None or self.memory_usage <= max_bytes:
+            return 0
+        
+        released = 0
+        while self._history_org and self.memory_usage > max_bytes:
+            message = self._history_org.pop(0)
+            size = self._message_bytes(message["content"])
+            self._history_org_bytes -= size
+            released += size
+        
+        if released:
+            self._history_org_trimmed = True
+        return released
+    
+    def add_todo_list(self, step: str, status: str = "队列中", reason: str = "", depends_on: list = None) -> dict:
+        """
+        添加Todo项，depends_on 为依赖的Todo项ID列表，返回新添加的Todo项
+        """
+        todo = self._todo_list.add(step, status, reason, depends_on)
+        if self._store is not None:
+            self._store.add_todo(self._session_id, todo)
+        return todo
+    
+    def set_todo_list(self, todo_list: list) -> list:
+        """
+        按模型给出的Todo list添加Todo项，每一项为步骤内容，或 {"step", "depends_on": [依赖步骤的序号]}
+        
+        序号从1开始，只能依赖排在前面的步骤，返回新添加的Todo项
+        """
+        added = []
+        for item in todo_list:
+            if isinstance(item, dict):
+                step = str(item.get("step", ""))
+                depends_on = [
+                    added[index - 1]["id"] for index in item.get("depends_on") or []
+                    if isinstance(index, int) and 0 < index <= len(added)
+                ]
+            else:
+                step = str(item)
+                depends_on = []
+            if step:
+                added.append(self.add_todo_list(step, depends_on=depends_on))
+        return added
         
     def set_todo_status(self, todo_id: str, status: str, reason: str):
-        for todo in self._todo_list:
-            if todo.get("id") == todo_id:
-                todo["status"] = status
-                todo["reason"] = reason
-                break
-        else:
+        if not self._todo_list.set_status(todo_id, status, reason):
             logger.error(f"未找到Todo项: {todo_id}")
             return False
         
+        if self._store is not None:
+            self._store.set_todo_status(self._session_id, todo_id, status, reason or "")
         return True
     
+    def set_todo_statuses(self, updates: list) -> dict:
+        """
+        批量修改Todo项状态，updates 为 [{"id", "status", "reason"}]
+        
+        返回 {"updated": [已修改的项], "not_found": [不存在的ID], "invalid": [状态无效的ID]}
+        """
+        result = self._todo_list.set_statuses(updates)
+        if result["not_found"]:
+            logger.error(f"未找到Todo项: {', '.join(str(todo_id) for todo_id in result['not_found'])}")
+        if self._store is not None:
+            self._store.set_todo_statuses(self._session_id, result["updated"])
+        return result
+    
     def add_history_org(self, role, content):
         if not content:
             return False
@@ -122,6 +333,9 @@ class DeepResearchAgent:
             "role": role,
             "content": content
         })
+        self._history_org_bytes += self._message_bytes(content)
+        if self._store is not None:
+            self._store.append_history(self._session_id, DeepResearchSessionStore.ORIGINAL_HISTORY, role, content)
         
         if role == "assistant":
             action = content.get("action")
@@ -140,7 +354,30 @@ class DeepResearchAgent:
                 assistant_content = content.get("research_topic")
                 
             elif action == "set_todo_list":
-                assistant_content = "\n".join(content.get("todo_list"))
+                assistant_content = "\n".join(
+                    str(item.get("step")) if isinstance(item, dict) else str(item) for item in content.get("todo_list") or []
+                )
+                
+            elif action == "set_todo_status":
+                updates = content.get("updates") or [content]
+                assistant_content = "设置Todo项状态: " + ", ".join(f"{update.get('id')} -> {update.get('status')}" for update in updates)
+                
+            elif action in ("get_todo_list", "get_research_topic"):
+                assistant_content = action
+                
+            elif action == "finished":
+                assistant_content = content.get("result")
+                
+            elif action == "tool_use":
+                tool_names = [tool_call_name(tool_call) for tool_call in content.get("tool_use") or []]
+                assistant_content = f"调用工具: {', '.join(tool_names)}"
+                
+            elif action == "search":
+                assistant_content = f"搜索: {', '.join(str(keyword) for keyword in content.get('search_request') or [])}"
+                
+            elif action == "visit":
+                urls = content.get("urls") or [content.get("url")]
+                assistant_content = f"访问: {', '.join(str(url) for url in urls)}"
                 
             else:
                 logger.error(f"未知动作: {action}")
@@ -152,6 +389,8 @@ class DeepResearchAgent:
         return True
         
     def get_history_org(self):
+        if self._history_org_trimmed and self._store is not None:
+            return self._store.load_original_history(self._session_id)
         return self._history_org
     
     def add_history(self, role, content):
@@ -159,39 +398,140 @@ class DeepResearchAgent:
             "role": role,
             "content": content
         })
+        self._history_bytes += self._message_bytes(content)
+        if self._store is not None:
+            self._store.append_history(self._session_id, self.stage.value, role, content)
+    
+    async def _complete(self, prompt: str, contexts: list, system_prompt: str, forwarder: StreamForwarder = None,
+                        priority: LLMPriority = LLMPriority.BACKGROUND, regeneration: int = 0) -> tuple:
+        """
+        调用模型生成回复，提供 forwarder 且 Provider 支持流式输出时，边生成边转发内容；
+        action 的参数(搜索关键词、URL等)生成完毕后才能执行，因此完整回复解析后再执行action
+
+        返回 (回复文本, 最终的LLMResponse, 调用信息)，流式输出没有完整回复时 LLMResponse 为None，
+        调用信息包括尝试次数 attempts 和调度器排队耗时 queue_wait
+        """
+        call_info = {"attempts": 1}
+        if self._llm_caller is not None:
+            schedule = {"call_info": call_info, "priority": priority, "user_id": self._user_id, "session_id": self._session_id}
+            text_chat = lambda **kwargs: self._llm_caller.text_chat(self._provider, **schedule, **kwargs)
+            text_chat_stream = lambda **kwargs: self._llm_caller.text_chat_stream(self._provider, **schedule, **kwargs)
+        else:
+            text_chat = self._provider.text_chat
+            text_chat_stream = getattr(self._provider, "text_chat_stream", None)
+        
+        if forwarder is not None and text_chat_stream is not None:
+            if regeneration:
+                forwarder.regenerate()
+            else:
+                forwarder.reset()
+            parser = IncrementalJSONParser()
+            chunks = []
+            final_response = None
+            try:
+                # 提前退出时立即关闭流，归还调度器名额
+                async with aclosing(text_chat_stream(prompt=prompt, contexts=contexts, system_prompt=system_prompt)) as stream:
+                    async for response in stream:
+                        if not getattr(response, "is_chunk", True):
+                            # 最后一个响应为完整回复
+                            final_response = response
+                            continue
+                        chunk = response.completion_text or ""
+                        chunks.append(chunk)
+                        for event in parser.feed(chunk):
+                            await forwarder.handle(event)
+                completion_text = final_response.completion_text if final_response is not None else None
+                return completion_text or "".join(chunks), final_response, call_info
+            except NotImplementedError:
+                logger.debug("当前Provider不支持流式输出，使用普通请求")
+        
+        response: LLMResponse = await text_chat(
+            prompt=prompt,
+            contexts=contexts,
+            system_prompt=system_prompt
+        )
+        return response.completion_text, response, call_info
+    
+    def _record_usage(self, prompt: str, contexts: list, system_prompt: str, completion_text: str, response: LLMResponse,
+                      latency: float, attempts: int, regeneration: int):
+        """
+        记录一次模型调用的用量，上游没有返回token用量时按文本长度估算
+        """
+        usage = response_usage(response)
+        estimated = usage is None
+        if estimated:
+            usage = (
+                estimate_tokens(system_prompt) + messages_tokens(contexts) + estimate_tokens(prompt),
+                estimate_tokens(completion_text),
+            )
+        record = self._usage.record(
+            self.stage.value if self.stage is not None else None, usage[0], usage[1], latency,
+            attempts=attempts, regeneration=regeneration, estimated=estimated,
+        )
+        logger.debug(
+            f"深度研究模型调用: 输入 {usage[0]} token, 输出 {usage[1]} token{'(估算)' if estimated else ''}, "
+            f"耗时 {latency:.2f}s, 尝试 {attempts} 次"
+        )
+        if self._store is not None:
+            self._store.append_llm_call(self._session_id, record)
     
-    async def call_llm(self, content, system_message: bool = False) -> dict:
+    async def call_llm(self, content, system_message: bool = False, forwarder: StreamForwarder = None) -> dict:
         org_prompt = content if not system_message else f"<system>{content}</system>"
         current_prompt = org_prompt
         
         accumulated_contexts_for_llm = self.history.copy()
+        system_prompt = self.system_prompt
+        
+        # 压缩上下文，较早的对话以摘要形式附加到系统提示词中
+        if self._compactor is not None:
+            compaction = self._compactor.compact(accumulated_contexts_for_llm, self.stage)
+            accumulated_contexts_for_llm = compaction.contexts
+            self._tokens_saved += compaction.saved_tokens
+            if compaction.digest:
+                system_prompt += f"\n<history_digest>\n以下是较早对话的摘要，部分内容已省略:\n{compaction.digest}\n</history_digest>\n"
+        
+        # 用户输入后的回复由用户等待，其余为研究过程中的后台调用
+        priority = LLMPriority.BACKGROUND if system_message else LLMPriority.INTERACTIVE
         
         response_json = None
+        retries = 0
         
         while True:
             logger.warning(f"调试 - 发送消息:\n{current_prompt}")
             
-            response: LLMResponse = await self._provider.text_chat(
-                prompt=current_prompt,
-                contexts=accumulated_contexts_for_llm,
-                system_prompt=self.system_prompt
+            started_at = time.monotonic()
+            raw_response_text, response, call_info = await self._complete(
+                current_prompt, accumulated_contexts_for_llm, system_prompt, forwarder, priority, retries
             )
-            
-            raw_response_text: str = response.completion_text
-            if raw_response_text.startswith("```json"):
-                raw_response_text = raw_response_text.strip("```json").strip("```")
+            # 不计入在调度器中排队的时间
+            latency = time.monotonic() - started_at - call_info.get("queue_wait", 0)
+            self._record_usage(
+                current_prompt, accumulated_contexts_for_llm, system_prompt, raw_response_text, response,
+                latency, call_info["attempts"], retries,
+            )
+            if self._recorder is not None:
+                self._recorder.record(
+                    self._session_id, self.stage.value if self.stage is not None else None,
+                    current_prompt, accumulated_contexts_for_llm, system_prompt, raw_response_text,
+                    source="system" if system_message or retries else "user", regeneration=retries, latency=latency,
+                )
             
             logger.warning(f"调试 - 模型输出: {raw_response_text}")
             
             try:
-                response_json = json.loads(raw_response_text)
+                # 先在本地修复常见的格式问题，无法修复时再要求模型重新生成
+                response_json = parse_action(raw_response_text)
                 self.add_history_org("user", org_prompt)
                 self.add_history_org("assistant", response_json)
                 break
-            except Exception as e:
+            except ActionParseError as e:
                 logger.error(f"解析结果失败: {e}")
                 logger.error(f"原始输出: {raw_response_text}")
                 
+                retries += 1
+                if retries > self._max_parse_retries:
+                    raise ActionParseError(f"模型连续 {retries} 次回复无法解析: {e}", raw_response_text)
+                
                 accumulated_contexts_for_llm.append({
                     "role": "user",
                     "content": current_prompt
@@ -201,7 +541,7 @@ class DeepResearchAgent:
                     "content": raw_response_text
                 })
                 
-                current_prompt = f"<system>你上一次的回复 (已包含在上面的对话历史中) 无法被正确解析为JSON。解析时遇到的具体错误是: {e}\n请仔细检查对话历史，并严格按照JSON格式重新生成你的回复。注意一次只能执行一个action。</system>"
+                current_prompt = f"<system>你上一次的回复 (已包含在上面的对话历史中) 无法被正确解析为有效的action。解析时遇到的具体错误是: {e}\n请仔细检查对话历史，并严格按照JSON格式重新生成你的回复。注意一次只能执行一个action。</system>"
         
         return response_json
     
\ No newline at end of file
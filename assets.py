@@ -0,0 +1,215 @@
+import asyncio
+import os
+from urllib.parse import urlsplit
+
+from playwright.async_api import Playwright, Route
+from astrbot.api import logger
+
+
+# Markdown 渲染模板依赖的外部资源
+TEMPLATE_ASSETS = [
+    "https://cdn.jsdelivr.net/npm/katex@0.16.10/dist/katex.min.css",
+    "https://cdn.jsdelivr.net/npm/katex@0.16.10/dist/katex.min.js",
+    "https://cdn.jsdelivr.net/npm/katex@0.16.10/dist/contrib/auto-render.min.js",
+    "https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.9.0/styles/github.min.css",
+    "https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.9.0/highlight.min.js",
+    "https://cdn.jsdelivr.net/npm/mermaid@10.6.1/dist/mermaid.min.js",
+    "https://cdn.jsdelivr.net/npm/marked/marked.min.js",
+] + [
+    f"https://cdn.jsdelivr.net/npm/katex@0.16.10/dist/fonts/KaTeX_{font}.woff2"
+    for font in (
+        "AMS-Regular", "Main-Regular", "Main-Bold", "Main-Italic", "Main-BoldItalic",
+        "Math-Italic", "Math-BoldItalic", "Size1-Regular", "Size2-Regular",
+        "Size3-Regular", "Size4-Regular", "Caligraphic-Regular", "Fraktur-Regular",
+        "SansSerif-Regular", "Script-Regular", "Typewriter-Regular",
+    )
+]
+
+# 资源所在的CDN域名，只有这些域名下未命中的资源会被下载缓存
+ASSET_HOSTS = {urlsplit(url).netloc for url in TEMPLATE_ASSETS}
+
+CONTENT_TYPES = {
+    ".js": "application/javascript; charset=utf-8",
+    ".css": "text/css; charset=utf-8",
+    ".woff2": "font/woff2",
+    ".woff": "font/woff",
+    ".ttf": "font/ttf",
+}
+
+
+class AssetBundle:
+    """
+    Markdown 渲染模板的本地资源包
+
+    资源按 `域名/路径` 保存在本地目录中，渲染时通过路由拦截直接从内存返回，
+    渲染过程中不访问网络。本地缺少的资源会在后台下载并缓存，供之后的渲染使用。
+    """
+    def __init__(self, asset_dirs: list, cache_dir: str, allow_download: bool = True, allow_external: bool = False):
+        # 资源查找目录，按顺序查找，cache_dir 同时用于保存下载的资源
+        self._asset_dirs = [d for d in asset_dirs if d] + [cache_dir]
+        self._cache_dir = cache_dir
+
+        # 是否允许在渲染之外下载缺失的资源
+        self._allow_download = allow_download
+
+        # 是否允许渲染时访问资源包以外的网络资源(如Markdown中引用的图片)
+        self._allow_external = allow_external
+
+        # url -> (内容, Content-Type)
+        self._assets: dict = {}
+
+        # 渲染时未命中的资源url
+        self._missing: set = set()
+
+        # 下载失败的模板资源url，不会再自动下载
+        self._failed: set = set()
+        self._download_task: asyncio.Task = None
+
+    @staticmethod
+    def relative_path(url: str) -> str:
+        parts = urlsplit(url)
+        return os.path.join(parts.netloc, *[p for p in parts.path.split("/") if p])
+
+    @staticmethod
+    def content_type(url: str) -> str:
+        ext = os.path.splitext(urlsplit(url).path)[1].lower()
+        return CONTENT_TYPES.get(ext, "application/octet-stream")
+
+    @property
+    def complete(self) -> bool:
+        """
+        模板资源是否已经齐全，或者缺少的资源已无法通过下载补全
+
+        资源仍在下载中时渲染效果不完整，渲染结果不应写入缓存
+        """
+        if not self._allow_download:
+            return True
+        return all(url in self._assets or url in self._failed for url in TEMPLATE_ASSETS)
+
+    def get(self, url: str) -> tuple:
+        """
+        获取资源内容，返回 (内容, Content-Type)，本地不存在时返回None
+        """
+        asset = self._assets.get(url)
+        if asset is not None:
+            return asset
+
+        relative_path = self.relative_path(url)
+        for asset_dir in self._asset_dirs:
+            path = os.path.join(asset_dir, relative_path)
+            if os.path.isfile(path):
+                with open(path, "rb") as f:
+                    asset = (f.read(), self.content_type(url))
+                self._assets[url] = asset
+                return asset
+
+        return None
+
+    def preload(self) -> list:
+        """
+        将本地已有的模板资源载入内存，返回缺失的资源url
+        """
+        missing = [url for url in TEMPLATE_ASSETS if self.get(url) is None]
+        logger.debug(f"载入Markdown渲染资源: {len(TEMPLATE_ASSETS) - len(missing)}/{len(TEMPLATE_ASSETS)}")
+        return missing
+
+    async def download(self, playwright: Playwright, urls: list):
+        """
+        下载资源到本地缓存目录
+        """
+        if not urls or not self._allow_download:
+            return
+
+        request_context = await playwright.request.new_context()
+        try:
+            for url in urls:
+                # 无论成功与否都不再重复尝试，避免失效的资源在每次渲染后反复下载
+                self._missing.discard(url)
+                try:
+                    response = await request_context.get(url, timeout=30000)
+                    if not response.ok:
+                        logger.warning(f"下载Markdown渲染资源失败: {url}, HTTP {response.status}")
+                        self._failed.add(url)
+                        continue
+                    body = await response.body()
+                except Exception as e:
+                    logger.warning(f"下载Markdown渲染资源失败: {url}, {e}")
+                    self._failed.add(url)
+                    continue
+
+                path = os.path.join(self._cache_dir, self.relative_path(url))
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "wb") as f:
+                    f.write(body)
+                self._assets[url] = (body, self.content_type(url))
+                logger.info(f"已缓存Markdown渲染资源: {url}")
+        finally:
+            await request_context.dispose()
+
+    def prepare(self, playwright: Playwright):
+        """
+        载入本地资源，并在后台下载缺失的模板资源，下载完成前的渲染效果可能不完整
+        """
+        missing = self.preload()
+        if not missing:
+            return
+        if not self._allow_download:
+            logger.warning(f"缺少 {len(missing)} 个Markdown渲染资源，且未允许下载，渲染效果可能不完整")
+            return
+        logger.info(f"缺少 {len(missing)} 个Markdown渲染资源，开始在后台下载")
+        self._download_task = asyncio.create_task(self.download(playwright, missing))
+
+    def schedule_download_missing(self, playwright: Playwright):
+        """
+        在后台下载渲染时未命中的资源
+        """
+        if not self._missing or not self._allow_download or playwright is None:
+            return
+        if self._download_task is not None and not self._download_task.done():
+            return
+
+        self._download_task = asyncio.create_task(self.download(playwright, list(self._missing)))
+
+    async def close(self):
+        """
+        取消正在进行的后台下载，在停止 Playwright 前调用
+        """
+        task, self._download_task = self._download_task, None
+        if task is None or task.done():
+            return
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.warning(f"取消下载Markdown渲染资源时出错: {e}")
+
+    async def handle_route(self, route: Route):
+        """
+        页面请求路由，资源包中存在的资源直接从内存返回
+        """
+        url = route.request.url
+        if url.startswith("data:"):
+            await route.continue_()
+            return
+
+        asset = self.get(url)
+        if asset is not None:
+            body, content_type = asset
+            await route.fulfill(
+                status=200,
+                body=body,
+                content_type=content_type,
+                headers={"Access-Control-Allow-Origin": "*"},
+            )
+            return
+
+        if self._allow_external:
+            await route.continue_()
+            return
+
+        if urlsplit(url).netloc in ASSET_HOSTS:
+            self._missing.add(url)
+        logger.debug(f"渲染时拦截未缓存资源: {url}")
+        await route.abort()
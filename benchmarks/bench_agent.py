@@ -0,0 +1,113 @@
+import hashlib
+import json
+import uuid
+
+from ..enums import DeepResearchWorkStage
+from ..fetcher import PageCache
+from .harness import measure
+from .stubs import StubEvent, StubProvider
+
+
+TODO_STEPS = ["收集相关资料", "对比各方案的优缺点", "整理结论并撰写报告"]
+
+VISIT_URLS = [f"https://bench.invalid/page/{index}" for index in range(3)]
+
+SEARCH_RESULT = "\n".join(
+    f"{index}. 示例搜索结果标题 {index} - https://bench.invalid/result/{index}\n"
+    f"这是一段用于测试的搜索结果摘要，包含若干关键词和描述性文字，用于模拟真实搜索工具返回的内容长度。"
+    for index in range(1, 9)
+)
+
+PAGE_CONTENT = "\n\n".join(
+    f"第{index}段。这是用于测试的网页正文，模拟真实网页提取后的文本内容。" * 6
+    for index in range(1, 21)
+)
+
+
+def research_script() -> list:
+    """
+    完整研究流程的预设模型回复，不包含需要等待用户输入的 ask/answer
+    """
+    todo_ids = [hashlib.md5(step.encode("utf-8")).hexdigest()[:6] for step in TODO_STEPS]
+    return [
+        {"action": "set_research_topic", "research_topic": "# 测试研究主题\n对比几种常见方案的性能、成本和可维护性。"},
+        {"action": "set_stage", "stage": "PLANNING"},
+        {"action": "set_todo_list", "todo_list": [TODO_STEPS[0], TODO_STEPS[1], {"step": TODO_STEPS[2], "depends_on": [1, 2]}]},
+        {"action": "set_stage", "stage": "EXECUTE"},
+        {"action": "search", "think": "先搜索相关资料", "search_request": ["方案A 性能", "方案B 性能", "方案对比"]},
+        {"action": "tool_use", "think": "调用工具获取补充信息", "tool_use": [
+            {"tool_name": "bench_tool", "args": {"query": "补充信息"}},
+            {"tool_name": "bench_tool", "args": {"query": "更多信息"}},
+        ]},
+        {"action": "visit", "think": "访问搜索结果中的网页", "urls": VISIT_URLS},
+        {"action": "set_todo_status", "updates": [
+            {"id": todo_ids[0], "status": "已完成", "reason": "已收集资料"},
+            {"id": todo_ids[1], "status": "已完成", "reason": "已完成对比"},
+            {"id": todo_ids[2], "status": "进行中", "reason": ""},
+        ]},
+        {"action": "get_todo_list"},
+        {"action": "set_stage", "stage": "FINISHED"},
+        {"action": "finished", "think": "研究完成", "result": "# 研究结果\n方案A在性能上更优，方案B在成本上更优。", "success": True},
+    ]
+
+
+def seed_pages(cache_dir: str):
+    """
+    预先写入 visit 使用的网页缓存，测试时不访问网络
+    """
+    cache = PageCache(cache_dir, ttl=365 * 24 * 3600)
+    for url in VISIT_URLS:
+        cache.put(url, {"title": f"测试网页 {url}", "content": PAGE_CONTENT})
+
+
+def _history_message(index: int) -> tuple:
+    if index % 2 == 0:
+        return "user", f"<system>{json.dumps([{'keyword': f'关键词{index}', 'result': SEARCH_RESULT}], ensure_ascii=False)}</system>"
+    return "assistant", {"action": "search", "think": f"继续搜索第{index}组资料", "search_request": [f"关键词{index}"]}
+
+
+def _new_agent(plugin, context, provider: StubProvider):
+    # 创建Agent时使用上下文当前的Provider，两者之间没有await，并发创建时不会混用
+    context.provider = provider
+    tools = plugin.context.get_llm_tool_manager().get_func_desc_openai_style()
+    return plugin._create_deepresearch_agent(str(uuid.uuid4()), tools)
+
+
+async def bench_call_llm(plugin, context, iterations: int, concurrency: int, latency: float = 0,
+                         history_turns: int = 20, stream: bool = False) -> dict:
+    """
+    已有 history_turns 轮对话历史的会话中，单次 call_llm 的耗时(包括提示词构建、上下文压缩、解析和持久化)
+    """
+    response = {"action": "search", "think": "继续搜索", "search_request": ["关键词"]}
+    agents = {}
+    for index in range(-1, iterations):
+        agent = _new_agent(plugin, context, StubProvider([response], latency=latency, stream=stream))
+        agent.stage = DeepResearchWorkStage.EXECUTE
+        for turn in range(history_turns * 2):
+            agent.add_history_org(*_history_message(turn))
+        agents[index] = agent
+
+    forwarder = plugin._create_stream_forwarder(StubEvent()) if stream else None
+
+    async def run(index: int):
+        await agents[index].call_llm("<system>[]</system>", forwarder=forwarder)
+
+    return await measure(run, iterations=iterations, concurrency=concurrency)
+
+
+async def bench_research_loop(plugin, context, iterations: int, concurrency: int, latency: float = 0,
+                              stream: bool = False) -> dict:
+    """
+    完整研究流程(从设置研究主题到 finished)经过 _run_deepresearch 动作循环的耗时
+    """
+    script = research_script()
+
+    async def run(index: int):
+        agent = _new_agent(plugin, context, StubProvider(script, latency=latency, stream=stream))
+        agent.stage = DeepResearchWorkStage.ASK
+        event = StubEvent()
+        outputs = [output async for output in plugin._run_deepresearch(event, agent, "测试研究主题")]
+        if agent.stage != DeepResearchWorkStage.FINISHED:
+            raise RuntimeError(f"研究流程未完成: {outputs[-3:]}")
+
+    return await measure(run, iterations=iterations, concurrency=concurrency)
@@ -0,0 +1,35 @@
+import os
+
+from .harness import measure
+
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+
+
+def load_corpus(names: list = None) -> dict:
+    """
+    读取 corpus 目录中的 Markdown 文档，返回 {名称: 内容}
+    """
+    corpus = {}
+    for filename in sorted(os.listdir(CORPUS_DIR)):
+        name, extension = os.path.splitext(filename)
+        if extension != ".md" or (names and name not in names):
+            continue
+        with open(os.path.join(CORPUS_DIR, filename), "r", encoding="utf-8") as f:
+            corpus[name] = f.read()
+    return corpus
+
+
+async def bench_render(plugin, text: str, iterations: int, concurrency: int, cache: str = "cold") -> dict:
+    """
+    通过 _text_to_markdown_image 渲染文档的耗时
+
+    cold 模式下每次使用不同的标题，渲染缓存不会命中；warm 模式下使用相同的标题，预热后全部命中缓存。
+    """
+    async def run(index: int):
+        title = "Benchmark" if cache == "warm" else f"Benchmark {index}"
+        image_paths = await plugin._text_to_markdown_image(text, False, title)
+        if not image_paths:
+            raise RuntimeError("渲染失败或因过载被放弃")
+
+    return await measure(run, iterations=iterations, concurrency=concurrency)
@@ -0,0 +1,135 @@
+import asyncio
+import json
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+# 指标 -> 数值越大越好
+METRIC_DIRECTIONS = {
+    "p50_ms": False,
+    "p95_ms": False,
+    "mean_ms": False,
+    "throughput": True,
+    "peak_rss_mb": False,
+}
+
+
+def percentile(values: list, q: float) -> float:
+    """
+    线性插值计算分位数
+    """
+    if not values:
+        return 0.0
+    values = sorted(values)
+    position = (len(values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def peak_rss_mb(children: bool = False) -> float:
+    """
+    当前进程(或已结束的子进程，如 Chromium)的内存峰值(MB)，不支持的平台返回None
+    """
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # macOS 单位为字节，Linux 为KB
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return usage.ru_maxrss / divisor
+
+
+async def measure(func, iterations: int = 20, concurrency: int = 1, warmup: int = 1) -> dict:
+    """
+    执行 iterations 次 func(序号)，同时最多执行 concurrency 个，返回延迟分位数和吞吐量
+
+    func 为协程函数，预热的调用不计入结果
+    """
+    for index in range(warmup):
+        await func(-index - 1)
+
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run(index: int):
+        nonlocal errors
+        async with semaphore:
+            started_at = time.perf_counter()
+            try:
+                await func(index)
+            except Exception as e:
+                errors += 1
+                print(f"  第{index}次执行失败: {e!r}", file=sys.stderr)
+                return
+            latencies.append(time.perf_counter() - started_at)
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*[run(index) for index in range(iterations)])
+    elapsed = time.perf_counter() - started_at
+
+    return {
+        "iterations": iterations,
+        "concurrency": concurrency,
+        "errors": errors,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "mean_ms": sum(latencies) / len(latencies) * 1000 if latencies else 0.0,
+        "throughput": len(latencies) / elapsed if elapsed > 0 else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float = 0.1) -> list:
+    """
+    与基准结果比较，返回 [(场景, 指标, 基准值, 当前值, 变化比例, 是否退化)]
+
+    变化超过 threshold 且方向变差时视为退化
+    """
+    rows = []
+    for scenario, metrics in results.items():
+        base_metrics = baseline.get(scenario)
+        if not base_metrics:
+            continue
+        for metric, higher_is_better in METRIC_DIRECTIONS.items():
+            current, base = metrics.get(metric), base_metrics.get(metric)
+            if current is None or not base:
+                continue
+            change = (current - base) / base
+            regressed = (change < -threshold) if higher_is_better else (change > threshold)
+            rows.append((scenario, metric, base, current, change, regressed))
+    return rows
+
+
+def format_results(results: dict) -> str:
+    lines = [f"{'场景':<28}{'p50(ms)':>10}{'p95(ms)':>10}{'平均(ms)':>10}{'吞吐(次/s)':>12}{'RSS峰值(MB)':>13}{'失败':>6}"]
+    for scenario, metrics in results.items():
+        rss = metrics.get("peak_rss_mb")
+        lines.append(
+            f"{scenario:<28}{metrics['p50_ms']:>10.2f}{metrics['p95_ms']:>10.2f}{metrics['mean_ms']:>10.2f}"
+            f"{metrics['throughput']:>12.2f}{rss if rss is not None else float('nan'):>13.1f}{metrics['errors']:>6}"
+        )
+    return "\n".join(lines)
+
+
+def format_comparison(rows: list) -> str:
+    lines = []
+    for scenario, metric, base, current, change, regressed in rows:
+        mark = "退化" if regressed else ""
+        lines.append(f"{scenario:<28}{metric:<14}{base:>12.2f} -> {current:<12.2f}{change * 100:>+8.1f}%  {mark}")
+    return "\n".join(lines)
+
+
+def load_json(path: str) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_json(path: str, data: dict):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
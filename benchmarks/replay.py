@@ -0,0 +1,465 @@
+"""
+深度研究会话轨迹回放压测
+
+开启 deepresearch.record_trajectories 后，插件会将每个 /deepresearch 会话中 call_llm 的提示词、上下文、
+系统提示词和模型输出录制到 data/plugin_data/knbot_enhance/trajectories/<会话ID>.jsonl。
+在 AstrBot 根目录下运行:
+
+    python -m data.plugins.knbot_enhance.benchmarks.replay data/plugin_data/knbot_enhance/trajectories --copies 8 --concurrency 8
+
+每条轨迹复制 --copies 份，最多 --concurrency 个会话同时经过 _run_deepresearch 回放:
+模型按录制顺序返回录制的输出，搜索、工具调用和网页访问返回录制时的结果，不访问网络；
+ask/answer 等待用户回复时，通过 session_waiter 发送录制的用户消息。
+
+回放结束后按轮比较发送给模型的token数量(按文本长度估算)与录制时的差异，
+总量增加超过 --token-threshold 时返回非0退出码。
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import shutil
+import sys
+from types import SimpleNamespace
+
+from astrbot.api import logger
+from astrbot.core.provider.entities import LLMResponse
+from astrbot.core.utils.session_waiter import USER_SESSIONS, SessionWaiter
+
+from ..enums import DeepResearchWorkStage
+from ..exceptions import ActionParseError
+from ..json_repair import parse_action
+from ..trajectory import load_trajectory, request_tokens
+from .bench_agent import _new_agent
+from .harness import compare, format_comparison, format_results, load_json, measure, percentile, save_json
+from .run import create_plugin, prepare_workdir
+from .stubs import StubEvent
+
+
+# 回放的模型输出用完时返回的动作，结束研究循环
+EXHAUSTED_OUTPUT = json.dumps({"action": "finished", "think": "回放轨迹已结束", "result": "回放轨迹已结束", "success": False}, ensure_ascii=False)
+
+MISSING_RESULT = "回放轨迹中没有该调用的结果"
+
+
+def parse_args(argv: list = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="KNBot Enhance 深度研究会话轨迹回放")
+    parser.add_argument("paths", nargs="+", help="轨迹文件(.jsonl)或包含轨迹文件的目录")
+    parser.add_argument("--copies", type=int, default=4, help="每条轨迹回放的份数")
+    parser.add_argument("--concurrency", type=int, default=4, help="同时回放的会话数量")
+    parser.add_argument("--speed", type=float, default=1.0, help="模型延迟的加速倍数，按录制时的延迟除以该值等待")
+    parser.add_argument("--latency", type=float, help="使用固定的模型延迟(秒)，不使用录制时的延迟")
+    parser.add_argument("--tool-latency", type=float, default=0.0, help="搜索、工具调用和网页访问的延迟(秒)")
+    parser.add_argument("--stream", action="store_true", help="使用流式输出")
+    parser.add_argument("--token-threshold", type=float, default=0.05, help="发送的token总量相比录制时增加超过该比例时视为退化")
+    parser.add_argument("--output", help="将结果保存为JSON文件")
+    parser.add_argument("--baseline", help="与基准结果(JSON文件)比较")
+    parser.add_argument("--save-baseline", help="将结果保存为基准")
+    parser.add_argument("--threshold", type=float, default=0.1, help="延迟、吞吐量等指标视为退化的变化比例")
+    parser.add_argument("--keep-workdir", action="store_true", help="保留临时目录")
+    parser.add_argument("--verbose", action="store_true", help="输出插件日志")
+    return parser.parse_args(argv)
+
+
+def load_trajectories(paths: list) -> dict:
+    """
+    读取轨迹文件，返回 {名称: [记录]}，目录中读取全部 .jsonl 文件
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith(".jsonl"))
+        else:
+            files.append(path)
+
+    trajectories = {}
+    for file in files:
+        entries = load_trajectory(file)
+        if entries:
+            trajectories[os.path.splitext(os.path.basename(file))[0]] = entries
+    return trajectories
+
+
+def unwrap_prompt(prompt: str) -> tuple:
+    """
+    将录制的提示词还原为 call_llm 的参数 (content, system_message)
+    """
+    if prompt.startswith("<system>") and prompt.endswith("</system>"):
+        return prompt[len("<system>"):-len("</system>")], True
+    return prompt, False
+
+
+def _tool_key(tool_name, args) -> str:
+    return f"{tool_name}\x00{json.dumps(args, ensure_ascii=False, sort_keys=True)}"
+
+
+def _tool_result_keys(tool_calls: list) -> list:
+    """
+    与 ToolExecutor.run_tool_use 相同的结果key，同一工具被调用多次时为 `工具名称#序号`
+    """
+    keys = []
+    for tool_call in tool_calls:
+        tool_name = tool_call.get("tool_name")
+        key = tool_name
+        index = 2
+        while key in keys:
+            key = f"{tool_name}#{index}"
+            index += 1
+        keys.append(key)
+    return keys
+
+
+class RecordedResults:
+    """
+    从轨迹中提取的搜索、工具调用和网页访问结果
+
+    动作的结果是下一次 call_llm 的提示词，按关键词、工具调用参数和URL索引，并发回放的会话可以共用
+    """
+    def __init__(self):
+        self.search = {}
+        self.tool_use = {}
+        self.visit = {}
+        self.misses = 0
+
+    @classmethod
+    def from_trajectories(cls, trajectories: dict) -> "RecordedResults":
+        results = cls()
+        for entries in trajectories.values():
+            for entry, next_entry in zip(entries, entries[1:]):
+                # 下一条记录是重新生成时，这次的输出无法解析
+                if next_entry.get("regeneration"):
+                    continue
+                try:
+                    action = parse_action(entry["output"])
+                    content, system_message = unwrap_prompt(next_entry["prompt"])
+                    result = json.loads(content) if system_message else None
+                except (ActionParseError, ValueError):
+                    continue
+                results._add(action, result)
+        return results
+
+    def _add(self, action: dict, result):
+        name = action.get("action")
+        if name == "search" and isinstance(result, list):
+            for item in result:
+                if isinstance(item, dict) and "keyword" in item:
+                    self.search[item["keyword"]] = item.get("result")
+        elif name == "tool_use" and isinstance(result, dict):
+            tool_calls = action.get("tool_use") or []
+            for key, tool_call in zip(_tool_result_keys(tool_calls), tool_calls):
+                if key in result:
+                    self.tool_use[_tool_key(tool_call.get("tool_name"), tool_call.get("args"))] = result[key]
+        elif name == "visit" and isinstance(result, list):
+            for item in result:
+                if isinstance(item, dict) and "url" in item:
+                    self.visit[item["url"]] = item
+
+    def get(self, table: dict, key, default):
+        if key in table:
+            return table[key]
+        self.misses += 1
+        return default
+
+
+class ReplayToolExecutor:
+    """
+    返回录制结果的工具调用，接口与 ToolExecutor 相同
+    """
+    def __init__(self, results: RecordedResults, latency: float = 0):
+        self._results = results
+        self._latency = latency
+
+    async def _wait(self):
+        if self._latency > 0:
+            await asyncio.sleep(self._latency)
+
+    async def run_tool_use(self, event, tool_calls: list) -> dict:
+        await self._wait()
+        return {
+            key: self._results.get(self._results.tool_use, _tool_key(tool_call.get("tool_name"), tool_call.get("args")), MISSING_RESULT)
+            for key, tool_call in zip(_tool_result_keys(tool_calls), tool_calls)
+        }
+
+    async def run_search(self, event, keywords: list) -> list:
+        await self._wait()
+        return [{"keyword": keyword, "result": self._results.get(self._results.search, keyword, MISSING_RESULT)}
+                for keyword in keywords]
+
+
+class ReplayFetcher:
+    """
+    返回录制结果的网页获取，接口与 WebFetcher 相同
+    """
+    def __init__(self, results: RecordedResults, latency: float = 0):
+        self._results = results
+        self._latency = latency
+
+    async def fetch_many(self, urls: list) -> list:
+        if self._latency > 0:
+            await asyncio.sleep(self._latency)
+        return [self._results.get(self._results.visit, url, {"url": url, "error": MISSING_RESULT}) for url in urls]
+
+    async def close(self):
+        pass
+
+
+class ReplayProvider:
+    """
+    按录制顺序返回模型输出的Provider，每个回放会话使用一个
+
+    记录每次调用实际发送的token数量，与录制时的数量对应，输出用完后返回 finished 结束研究。
+    """
+    def __init__(self, entries: list, speed: float = 1.0, latency: float = None, stream: bool = False, chunk_chars: int = 32):
+        self._entries = entries
+        self._cursor = 0
+        self._speed = max(speed, 1e-6)
+        self._latency = latency
+        self._stream = stream
+        self._chunk_chars = max(1, chunk_chars)
+
+        # [(录制时发送的token数量, 回放时发送的token数量)]，超出录制范围的调用录制值为None
+        self.sent_tokens = []
+        self.exhausted = 0
+
+    def meta(self):
+        return SimpleNamespace(id="replay", model="replay", type="replay")
+
+    def peek(self) -> dict:
+        """
+        下一条要回放的记录，已经全部回放时返回None
+        """
+        return self._entries[self._cursor] if self._cursor < len(self._entries) else None
+
+    async def _next_output(self, prompt: str, contexts: list, system_prompt: str) -> str:
+        tokens = request_tokens(prompt, contexts, system_prompt)
+        entry = self.peek()
+        if entry is None:
+            self.exhausted += 1
+            self.sent_tokens.append((None, tokens))
+            return EXHAUSTED_OUTPUT
+
+        self._cursor += 1
+        self.sent_tokens.append((entry.get("prompt_tokens"), tokens))
+        latency = self._latency if self._latency is not None else entry.get("latency", 0) / self._speed
+        if latency > 0:
+            await asyncio.sleep(latency)
+        return entry["output"]
+
+    async def text_chat(self, prompt: str = None, contexts: list = None, system_prompt: str = None, **kwargs) -> LLMResponse:
+        return LLMResponse("assistant", completion_text=await self._next_output(prompt, contexts, system_prompt))
+
+    async def text_chat_stream(self, prompt: str = None, contexts: list = None, system_prompt: str = None, **kwargs):
+        if not self._stream:
+            raise NotImplementedError()
+
+        text = await self._next_output(prompt, contexts, system_prompt)
+        for index in range(0, len(text), self._chunk_chars):
+            yield LLMResponse("assistant", completion_text=text[index:index + self._chunk_chars], is_chunk=True)
+            await asyncio.sleep(0)
+        yield LLMResponse("assistant", completion_text=text, is_chunk=False)
+
+
+async def _simulate_user(event: StubEvent, provider: ReplayProvider, run_task: asyncio.Task, poll_interval: float = 0.005):
+    """
+    模拟用户回复: 会话在 ask/answer 等待回复时，下一条录制记录是用户消息则发送该消息，否则结束等待
+    """
+    origin = event.unified_msg_origin
+    while not run_task.done():
+        waiter = USER_SESSIONS.get(origin)
+        if waiter is None or waiter.session_controller.future.done():
+            await asyncio.sleep(poll_interval)
+            continue
+
+        entry = provider.peek()
+        if entry is not None and entry.get("source") == "user" and not entry.get("regeneration"):
+            await SessionWaiter.trigger(origin, StubEvent(entry["prompt"], event.get_sender_id(), origin))
+        else:
+            # 录制时用户没有再回复，按等待超时处理
+            waiter.session_controller.stop(TimeoutError("回放轨迹已结束"))
+
+
+async def replay_session(plugin, context, entries: list, index: int, args: argparse.Namespace) -> dict:
+    """
+    回放一条轨迹，录制中途暂停后恢复的会话，在研究循环结束后使用下一条记录继续回放
+    """
+    provider = ReplayProvider(entries, speed=args.speed, latency=args.latency, stream=args.stream)
+    agent = _new_agent(plugin, context, provider)
+    agent.stage = DeepResearchWorkStage(entries[0].get("stage") or DeepResearchWorkStage.ASK.value)
+    event = StubEvent(sender_id=f"replay-{index}", unified_msg_origin=f"replay:FriendMessage:{index}")
+
+    runs = 0
+    while True:
+        entry = provider.peek()
+        if entry is None or (runs and entry.get("regeneration")):
+            break
+        content, system_message = unwrap_prompt(entry["prompt"])
+
+        async def run():
+            async for _ in plugin._run_deepresearch(event, agent, content, system_message=system_message):
+                pass
+
+        run_task = asyncio.create_task(run())
+        simulator = asyncio.create_task(_simulate_user(event, provider, run_task))
+        try:
+            await run_task
+        finally:
+            simulator.cancel()
+        runs += 1
+
+    return {
+        "agent": agent,
+        "provider": provider,
+        "runs": runs,
+    }
+
+
+def token_report(sessions: list, threshold: float) -> dict:
+    """
+    比较回放与录制时每轮发送的token数量
+    """
+    recorded, replayed, increases = [], [], []
+    extra_calls = 0
+    for session in sessions:
+        for recorded_tokens, replayed_tokens in session["provider"].sent_tokens:
+            if recorded_tokens is None:
+                extra_calls += 1
+                continue
+            recorded.append(recorded_tokens)
+            replayed.append(replayed_tokens)
+            if recorded_tokens:
+                increases.append((replayed_tokens - recorded_tokens) / recorded_tokens)
+
+    recorded_total, replayed_total = sum(recorded), sum(replayed)
+    change = (replayed_total - recorded_total) / recorded_total if recorded_total else 0.0
+    return {
+        "turns": len(recorded),
+        "recorded_total": recorded_total,
+        "replayed_total": replayed_total,
+        "recorded_per_turn": recorded_total / len(recorded) if recorded else 0.0,
+        "replayed_per_turn": replayed_total / len(replayed) if replayed else 0.0,
+        "change": change,
+        "max_turn_increase": max(increases, default=0.0),
+        "p95_turn_increase": percentile(increases, 0.95),
+        "turns_over_threshold": sum(1 for increase in increases if increase > threshold),
+        "extra_calls": extra_calls,
+        "regressed": change > threshold,
+    }
+
+
+def history_report(sessions: list) -> dict:
+    """
+    回放结束时各会话的对话历史规模
+    """
+    memory = [session["agent"].memory_usage for session in sessions]
+    messages = [session["agent"].history_size.get("original", 0) for session in sessions]
+    return {
+        "sessions": len(sessions),
+        "memory_mean_kb": sum(memory) / len(memory) / 1024 if memory else 0.0,
+        "memory_max_kb": max(memory, default=0) / 1024,
+        "messages_mean": sum(messages) / len(messages) if messages else 0.0,
+        "messages_max": max(messages, default=0),
+    }
+
+
+async def run_replay(args: argparse.Namespace, trajectories: dict) -> tuple:
+    plugin, context = create_plugin(stream=args.stream, capacity=args.concurrency)
+    results = RecordedResults.from_trajectories(trajectories)
+    plugin.tool_executor = ReplayToolExecutor(results, latency=args.tool_latency)
+    plugin.web_fetcher = ReplayFetcher(results, latency=args.tool_latency)
+
+    names = list(trajectories)
+    sessions = []
+
+    async def run(index: int):
+        entries = trajectories[names[index % len(names)]]
+        sessions.append(await replay_session(plugin, context, entries, index, args))
+
+    try:
+        metrics = await measure(run, iterations=args.copies * len(names), concurrency=args.concurrency, warmup=0)
+        registry = plugin.deepresearch_sessions.stats()
+        scheduler = plugin.llm_scheduler.stats()
+    finally:
+        await plugin.terminate()
+
+    report = {
+        "tokens": token_report(sessions, args.token_threshold),
+        "history": history_report(sessions),
+        "registry": {key: registry[key] for key in ("count", "memory", "max_sessions", "loads", "evictions")},
+        "scheduler": {key: scheduler[key] for key in ("max_concurrency", "submitted", "aged", "wait_avg", "wait_p95", "wait_max")},
+        "missing_results": results.misses,
+        "exhausted_sessions": sum(1 for session in sessions if session["provider"].exhausted),
+    }
+    return {"replay": metrics}, report
+
+
+def format_report(report: dict) -> str:
+    tokens = report["tokens"]
+    history = report["history"]
+    registry = report["registry"]
+    scheduler = report["scheduler"]
+    return "\n".join([
+        f"发送token(估算): 录制 {tokens['recorded_total']} -> 回放 {tokens['replayed_total']} ({tokens['change'] * 100:+.1f}%), "
+        f"共 {tokens['turns']} 轮, 每轮 {tokens['recorded_per_turn']:.0f} -> {tokens['replayed_per_turn']:.0f}",
+        f"单轮增幅: 最大 {tokens['max_turn_increase'] * 100:+.1f}%, p95 {tokens['p95_turn_increase'] * 100:+.1f}%, "
+        f"超出阈值 {tokens['turns_over_threshold']} 轮, 超出录制范围的调用 {tokens['extra_calls']} 次",
+        f"对话历史: 平均 {history['messages_mean']:.1f} 条/{history['memory_mean_kb']:.1f}KB, "
+        f"最大 {history['messages_max']} 条/{history['memory_max_kb']:.1f}KB",
+        f"会话管理: 内存中 {registry['count']}/{registry['max_sessions']} 个会话, {registry['memory'] / 1024:.1f}KB, "
+        f"载入 {registry['loads']} 次, 淘汰 {registry['evictions']} 次",
+        f"模型调用调度: 并发上限 {scheduler['max_concurrency']}, 共 {scheduler['submitted']} 次, "
+        f"排队 平均 {scheduler['wait_avg'] * 1000:.1f}ms/p95 {scheduler['wait_p95'] * 1000:.1f}ms/最大 {scheduler['wait_max'] * 1000:.1f}ms",
+        f"缺少录制结果的调用: {report['missing_results']} 次, 输出提前用完的会话: {report['exhausted_sessions']} 个",
+    ])
+
+
+def main(argv: list = None) -> int:
+    args = parse_args(argv)
+    if not args.verbose:
+        logger.setLevel(logging.ERROR)
+
+    trajectories = load_trajectories(args.paths)
+    if not trajectories:
+        print("没有找到可回放的轨迹文件", file=sys.stderr)
+        return 2
+    print(f"回放 {len(trajectories)} 条轨迹，每条 {args.copies} 份，并发 {args.concurrency}")
+
+    cwd = os.getcwd()
+    workdir = prepare_workdir()
+    os.chdir(workdir)
+    try:
+        results, report = asyncio.run(run_replay(args, trajectories))
+    finally:
+        os.chdir(cwd)
+        if args.keep_workdir:
+            print(f"临时目录: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print()
+    print(format_results(results))
+    print()
+    print(format_report(report))
+
+    results["replay"]["report"] = report
+    if args.output:
+        save_json(args.output, results)
+    if args.save_baseline:
+        save_json(args.save_baseline, results)
+        print(f"\n已保存基准: {args.save_baseline}")
+
+    exit_code = 0
+    if args.baseline:
+        rows = compare(results, load_json(args.baseline), args.threshold)
+        print(f"\n与基准比较 (阈值 {args.threshold * 100:.0f}%):")
+        print(format_comparison(rows))
+        if any(row[-1] for row in rows):
+            exit_code = 1
+    if report["tokens"]["regressed"]:
+        print(f"\n发送的token总量相比录制时增加 {report['tokens']['change'] * 100:.1f}%，超过阈值 {args.token_threshold * 100:.0f}%")
+        exit_code = 1
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,166 @@
+"""
+离线性能测试
+
+在 AstrBot 根目录下运行(插件位于 data/plugins/knbot_enhance):
+
+    python -m data.plugins.knbot_enhance.benchmarks.run --scenarios agent_call_llm,agent_loop,render
+
+模型和工具使用本地的 Stub 实现，不访问网络；插件在临时目录中运行，不会读写实际的插件数据。
+浏览器渲染需要已安装 Playwright 的 Chromium。
+
+使用 --save-baseline 保存结果作为基准，之后使用 --baseline 与基准比较，
+有指标退化超过 --threshold 时返回非0退出码。
+"""
+import argparse
+import asyncio
+import logging
+import os
+import shutil
+import sys
+import tempfile
+
+from astrbot.api import logger
+
+from ..main import KNBotEnhance
+from .bench_agent import bench_call_llm, bench_research_loop, seed_pages
+from .bench_render import bench_render, load_corpus
+from .harness import compare, format_comparison, format_results, load_json, peak_rss_mb, save_json
+from .stubs import PLUGIN_DIR, StubContext, StubProvider, StubToolManager, default_config
+
+
+SCENARIOS = ("agent_call_llm", "agent_loop", "render")
+
+
+def parse_args(argv: list = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="KNBot Enhance 离线性能测试")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"测试场景，逗号分隔: {', '.join(SCENARIOS)}")
+    parser.add_argument("--iterations", type=int, default=20, help="每个场景的执行次数")
+    parser.add_argument("--concurrency", type=int, default=4, help="同时执行的数量")
+    parser.add_argument("--latency", type=float, default=0.05, help="Stub 模型每次调用的延迟(秒)")
+    parser.add_argument("--tool-latency", type=float, default=0.02, help="Stub 工具每次调用的延迟(秒)")
+    parser.add_argument("--history-turns", type=int, default=20, help="agent_call_llm 场景中已有的对话轮数")
+    parser.add_argument("--stream", action="store_true", help="使用流式输出")
+    parser.add_argument("--renderer", choices=("auto", "light", "browser"), default="auto", help="Markdown 渲染器")
+    parser.add_argument("--cache", choices=("cold", "warm"), default="cold", help="渲染缓存是否命中")
+    parser.add_argument("--corpus", default="", help="只测试指定的文档，逗号分隔，默认为 corpus 目录中的全部文档")
+    parser.add_argument("--output", help="将结果保存为JSON文件")
+    parser.add_argument("--baseline", help="与基准结果(JSON文件)比较")
+    parser.add_argument("--save-baseline", help="将结果保存为基准")
+    parser.add_argument("--threshold", type=float, default=0.1, help="视为退化的变化比例")
+    parser.add_argument("--keep-workdir", action="store_true", help="保留临时目录")
+    parser.add_argument("--verbose", action="store_true", help="输出插件日志")
+    return parser.parse_args(argv)
+
+
+def prepare_workdir() -> str:
+    """
+    创建临时运行目录，复制插件的渲染模板和资源
+    """
+    workdir = tempfile.mkdtemp(prefix="knbot_bench_")
+    shutil.copytree(os.path.join(PLUGIN_DIR, "resource"), os.path.join(workdir, "data", "plugins", "knbot_enhance", "resource"))
+    return workdir
+
+
+def create_plugin(renderer: str = "auto", stream: bool = False, latency: float = 0, tool_latency: float = 0,
+                  capacity: int = 16, overrides: dict = None):
+    """
+    使用 Stub 上下文创建插件，capacity 为同时执行的最大数量，用于设置渲染队列和内存中会话数量的上限
+    """
+    config = default_config({
+        "markdown_image_generate": {
+            "enable": True,
+            "renderer": renderer,
+            "generate_topic_summary": False,
+            "browser_preload": False,
+            "assets_download": False,
+            "max_render_queue": max(16, capacity),
+            "render_timeout": 5,
+        },
+        "llm_call": {"fallback_providers": []},
+        "deepresearch": {
+            "stream_response": stream,
+            "search_tool": "web_search",
+            "max_live_sessions": max(32, capacity * 2),
+        },
+    })
+    for group, values in (overrides or {}).items():
+        config.setdefault(group, {}).update(values)
+    tool_manager = StubToolManager({
+        "web_search": "1. 示例搜索结果 - https://bench.invalid/result/1\n这是一段测试用的搜索结果摘要。",
+        "bench_tool": "测试工具的返回内容。",
+    }, latency=tool_latency)
+    context = StubContext(StubProvider(['{"action": "answer", "answer": "stub"}'], latency=latency), tool_manager)
+    return KNBotEnhance(context, config), context
+
+
+async def run_benchmarks(args: argparse.Namespace) -> dict:
+    scenarios = [scenario.strip() for scenario in args.scenarios.split(",") if scenario.strip()]
+    plugin, context = create_plugin(args.renderer, args.stream, args.latency, args.tool_latency, capacity=args.iterations)
+    seed_pages(os.path.join(os.getcwd(), "data", "plugin_data", "knbot_enhance", "pages"))
+
+    results = {}
+    try:
+        if "agent_call_llm" in scenarios:
+            print("运行 agent_call_llm ...")
+            results["agent_call_llm"] = await bench_call_llm(
+                plugin, context, args.iterations, args.concurrency, latency=args.latency,
+                history_turns=args.history_turns, stream=args.stream,
+            )
+        if "agent_loop" in scenarios:
+            print("运行 agent_loop ...")
+            results["agent_loop"] = await bench_research_loop(
+                plugin, context, args.iterations, args.concurrency, latency=args.latency, stream=args.stream,
+            )
+        if "render" in scenarios:
+            names = [name.strip() for name in args.corpus.split(",") if name.strip()]
+            for name, text in load_corpus(names).items():
+                scenario = f"render:{name}:{args.renderer}:{args.cache}"
+                print(f"运行 {scenario} ...")
+                results[scenario] = await bench_render(plugin, text, args.iterations, args.concurrency, cache=args.cache)
+    finally:
+        await plugin.terminate()
+
+    # 浏览器进程关闭后才能获取子进程的内存峰值
+    children_rss = peak_rss_mb(children=True)
+    if children_rss:
+        print(f"子进程(Chromium)内存峰值: {children_rss:.1f}MB")
+    return results
+
+
+def main(argv: list = None) -> int:
+    args = parse_args(argv)
+    if not args.verbose:
+        logger.setLevel(logging.ERROR)
+
+    cwd = os.getcwd()
+    workdir = prepare_workdir()
+    os.chdir(workdir)
+    try:
+        results = asyncio.run(run_benchmarks(args))
+    finally:
+        os.chdir(cwd)
+        if args.keep_workdir:
+            print(f"临时目录: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print()
+    print(format_results(results))
+
+    if args.output:
+        save_json(args.output, results)
+    if args.save_baseline:
+        save_json(args.save_baseline, results)
+        print(f"\n已保存基准: {args.save_baseline}")
+
+    if args.baseline:
+        rows = compare(results, load_json(args.baseline), args.threshold)
+        print(f"\n与基准比较 (阈值 {args.threshold * 100:.0f}%):")
+        print(format_comparison(rows))
+        if any(row[-1] for row in rows):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,178 @@
+import asyncio
+import itertools
+import json
+import os
+import random
+from types import SimpleNamespace
+
+from astrbot.core.provider.entities import LLMResponse
+
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class StubProvider:
+    """
+    离线测试用的模型Provider
+
+    按顺序循环返回预设的回复，每次调用等待 latency 秒(加上 ±jitter 的随机抖动)，
+    stream 为 True 时支持 text_chat_stream，按 chunk_chars 切分回复逐块返回。
+    """
+    def __init__(self, responses: list, latency: float = 0, jitter: float = 0, stream: bool = False,
+                 chunk_chars: int = 32, provider_id: str = "stub", seed: int = 0):
+        self._responses = [response if isinstance(response, str) else json.dumps(response, ensure_ascii=False)
+                           for response in responses]
+        self._cycle = itertools.cycle(self._responses)
+        self._latency = latency
+        self._jitter = jitter
+        self._stream = stream
+        self._chunk_chars = max(1, chunk_chars)
+        self._provider_id = provider_id
+        self._random = random.Random(seed)
+
+        self.calls = 0
+
+    def meta(self):
+        return SimpleNamespace(id=self._provider_id, model="stub", type="stub")
+
+    def reset(self):
+        self._cycle = itertools.cycle(self._responses)
+        self.calls = 0
+
+    async def _wait(self, latency: float):
+        if self._jitter:
+            latency += self._random.uniform(-self._jitter, self._jitter)
+        if latency > 0:
+            await asyncio.sleep(latency)
+
+    async def text_chat(self, prompt: str = None, contexts: list = None, system_prompt: str = None, **kwargs) -> LLMResponse:
+        self.calls += 1
+        await self._wait(self._latency)
+        return LLMResponse("assistant", completion_text=next(self._cycle))
+
+    async def text_chat_stream(self, prompt: str = None, contexts: list = None, system_prompt: str = None, **kwargs):
+        if not self._stream:
+            raise NotImplementedError()
+
+        self.calls += 1
+        text = next(self._cycle)
+        chunks = [text[index:index + self._chunk_chars] for index in range(0, len(text), self._chunk_chars)]
+        for chunk in chunks:
+            await self._wait(self._latency / max(1, len(chunks)))
+            yield LLMResponse("assistant", completion_text=chunk, is_chunk=True)
+        yield LLMResponse("assistant", completion_text=text, is_chunk=False)
+
+
+class StubToolManager:
+    """
+    离线测试用的函数工具管理器，工具返回固定内容
+    """
+    def __init__(self, tools: dict, latency: float = 0):
+        # 工具名称 -> 返回内容
+        self._tools = tools
+        self._latency = latency
+
+    def _handler(self, name: str):
+        async def handler(event, **kwargs):
+            if self._latency > 0:
+                await asyncio.sleep(self._latency)
+            return f"{self._tools[name]}\n参数: {json.dumps(kwargs, ensure_ascii=False)}"
+        return handler
+
+    def get_func(self, name: str):
+        if name not in self._tools:
+            return None
+        return SimpleNamespace(name=name, origin="plugin", handler=self._handler(name), mcp_client=None)
+
+    def get_func_desc_openai_style(self) -> list:
+        return [
+            {
+                "type": "function",
+                "function": {
+                    "name": name,
+                    "description": f"测试工具 {name}",
+                    "parameters": {"type": "object", "properties": {"query": {"type": "string"}}},
+                },
+            }
+            for name in self._tools
+        ]
+
+
+class StubContext:
+    """
+    离线测试用的插件上下文
+    """
+    def __init__(self, provider: StubProvider, tool_manager: StubToolManager):
+        # 当前使用的Provider，可以在创建会话前替换
+        self.provider = provider
+        self._tool_manager = tool_manager
+
+    def get_using_provider(self, *args, **kwargs):
+        return self.provider
+
+    def get_all_providers(self) -> list:
+        return [self.provider]
+
+    def get_llm_tool_manager(self):
+        return self._tool_manager
+
+
+class StubEvent:
+    """
+    离线测试用的消息事件，记录插件发送的消息
+
+    unified_msg_origin 用于 session_waiter 区分会话，默认由 sender_id 生成
+    """
+    def __init__(self, message_str: str = "", sender_id: str = "benchmark", unified_msg_origin: str = None):
+        self.message_str = message_str
+        self._sender_id = sender_id
+        self.unified_msg_origin = unified_msg_origin or f"benchmark:FriendMessage:{sender_id}"
+        self.sent = []
+
+    def get_sender_id(self) -> str:
+        return self._sender_id
+
+    def get_session_id(self) -> str:
+        return self._sender_id
+
+    def get_messages(self) -> list:
+        return []
+
+    def plain_result(self, text: str) -> str:
+        return text
+
+    def chain_result(self, chain: list) -> list:
+        return chain
+
+    async def send(self, message):
+        self.sent.append(message)
+
+
+class BenchConfig(dict):
+    """
+    插件配置，save 不写入文件
+    """
+    def save(self):
+        pass
+
+
+def default_config(overrides: dict = None) -> BenchConfig:
+    """
+    使用 _conf_schema.json 中的默认值生成插件配置，overrides 按配置分组覆盖
+    """
+    with open(os.path.join(PLUGIN_DIR, "_conf_schema.json"), "r", encoding="utf-8") as f:
+        schema = json.load(f)
+
+    config = BenchConfig()
+    for group, group_schema in schema.items():
+        if group_schema.get("type") == "object":
+            config[group] = {key: item.get("default") for key, item in group_schema.get("items", {}).items()}
+        else:
+            config[group] = group_schema.get("default")
+
+    for group, values in (overrides or {}).items():
+        if isinstance(values, dict):
+            config.setdefault(group, {}).update(values)
+        else:
+            config[group] = values
+    return config
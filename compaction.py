@@ -0,0 +1,164 @@
+import json
+import re
+
+from astrbot.api import logger
+
+from .enums import DeepResearchWorkStage
+
+
+SNIP_MARK = "--snip--"
+
+_CJK_RE = re.compile(r"[　-〿㐀-䶿一-鿿＀-￯]")
+
+
+def content_to_text(content) -> str:
+    if content is None:
+        return ""
+    if isinstance(content, str):
+        return content
+    return json.dumps(content, ensure_ascii=False)
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估算token数量: 中日韩字符约1个token，其他字符约4个字符1个token
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def messages_tokens(messages: list) -> int:
+    # 每条消息额外计入少量格式开销
+    return sum(estimate_tokens(content_to_text(message.get("content"))) + 4 for message in messages)
+
+
+def elide_text(text: str, max_tokens: int) -> str:
+    """
+    保留文本的开头和结尾，中间部分使用 --snip-- 省略
+    """
+    tokens = estimate_tokens(text)
+    if tokens <= max_tokens:
+        return text
+
+    # 按比例换算保留的字符数
+    keep_chars = max(1, int(len(text) * max_tokens / tokens))
+    head = keep_chars * 2 // 3
+    tail = keep_chars - head
+    return f"{text[:head]}\n{SNIP_MARK} (省略约{tokens - max_tokens}个token)\n{text[len(text) - tail:]}"
+
+
+class ContextCompaction:
+    """
+    单次压缩结果
+    """
+    def __init__(self, contexts: list, digest: str, original_tokens: int, compacted_tokens: int):
+        self.contexts = contexts
+        self.digest = digest
+        self.original_tokens = original_tokens
+        self.compacted_tokens = compacted_tokens
+
+    @property
+    def saved_tokens(self) -> int:
+        return max(0, self.original_tokens - self.compacted_tokens)
+
+
+class ContextCompactor:
+    """
+    深度研究对话历史压缩
+
+    按阶段限制发送给模型的上下文token数量：
+    1. 较早的超长消息(如搜索结果、网页内容)只保留开头和结尾
+    2. 仍超出预算时只保留最近的若干条消息，更早的消息压缩为滚动摘要，随系统提示词发送
+    """
+    def __init__(self, stage_budgets: dict = None, default_budget: int = 12000, keep_recent: int = 8,
+                 max_message_tokens: int = 2000, digest_tokens: int = 1000):
+        # 阶段 -> token预算
+        self._stage_budgets = stage_budgets or {}
+        self._default_budget = default_budget
+
+        # 滑动窗口保留的最近消息数量
+        self._keep_recent = max(2, keep_recent)
+
+        # 较早消息的最大token数量
+        self._max_message_tokens = max(64, max_message_tokens)
+
+        # 滚动摘要的最大token数量
+        self._digest_tokens = max(64, digest_tokens)
+
+        # 阶段 -> (已摘要的消息数量, 摘要行列表)，新消息移出窗口时只追加新的摘要行
+        self._digest_cache: dict = {}
+
+    def budget(self, stage: DeepResearchWorkStage) -> int:
+        return self._stage_budgets.get(stage, self._default_budget)
+
+    @staticmethod
+    def _digest_line(message: dict) -> str:
+        text = content_to_text(message.get("content")).strip().replace("\n", " ")
+        if len(text) > 80:
+            text = text[:80] + "…"
+        return f"[{message.get('role')}] {text}"
+
+    def _build_digest(self, stage: DeepResearchWorkStage, history: list, count: int) -> str:
+        cached_count, lines = self._digest_cache.get(stage, (0, []))
+        if cached_count > count:
+            # 窗口起点前移或历史被替换(如恢复会话)，重新生成
+            cached_count, lines = 0, []
+        lines = lines + [self._digest_line(message) for message in history[cached_count:count]]
+        self._digest_cache[stage] = (count, lines)
+
+        # 摘要过长时丢弃最早的部分
+        selected = []
+        tokens = 0
+        for line in reversed(lines):
+            tokens += estimate_tokens(line)
+            if tokens > self._digest_tokens:
+                selected.append(SNIP_MARK)
+                break
+            selected.append(line)
+        return "\n".join(reversed(selected))
+
+    def compact(self, history: list, stage: DeepResearchWorkStage) -> ContextCompaction:
+        """
+        压缩对话历史，返回压缩结果，原历史不会被修改
+        """
+        budget = self.budget(stage)
+        original_tokens = messages_tokens(history)
+        if original_tokens <= budget:
+            return ContextCompaction(list(history), "", original_tokens, original_tokens)
+
+        # 1. 省略较早消息中的超长内容，最近两条保持完整
+        contexts = []
+        for index, message in enumerate(history):
+            text = content_to_text(message.get("content"))
+            if index < len(history) - 2 and estimate_tokens(text) > self._max_message_tokens:
+                message = {**message, "content": elide_text(text, self._max_message_tokens)}
+            contexts.append(message)
+
+        digest = ""
+        tokens = messages_tokens(contexts)
+        if tokens > budget:
+            # 2. 滑动窗口，窗口从 user 消息开始，保证消息角色交替
+            keep = min(self._keep_recent, len(contexts))
+            while keep > 2 and messages_tokens(contexts[-keep:]) > budget:
+                keep -= 1
+            start = len(contexts) - keep
+            while start < len(contexts) - 1 and contexts[start].get("role") != "user":
+                start += 1
+
+            digest = self._build_digest(stage, history, start)
+            contexts = contexts[start:]
+
+            # 3. 窗口内仍然超出预算时，进一步压缩窗口内除最后一条外的消息
+            if messages_tokens(contexts) + estimate_tokens(digest) > budget and len(contexts) > 1:
+                per_message = max(64, (budget - estimate_tokens(digest)) // len(contexts))
+                contexts = [
+                    {**message, "content": elide_text(content_to_text(message.get("content")), per_message)}
+                    if index < len(contexts) - 1 else message
+                    for index, message in enumerate(contexts)
+                ]
+
+        compacted_tokens = messages_tokens(contexts) + estimate_tokens(digest)
+        logger.info(f"压缩深度研究上下文({stage}): {original_tokens} -> {compacted_tokens} tokens, 节省 {max(0, original_tokens - compacted_tokens)}")
+        return ContextCompaction(contexts, digest, original_tokens, compacted_tokens)
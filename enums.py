@@ -25,3 +25,21 @@ class DeepResearchWorkStage(Enum):
         else:
             raise ValueError(f"无效的研究阶段: {stage}")
 
+
+
+class RenderMode(Enum):
+    """
+    长文本渲染方式
+    """
+    PLAIN = "plain"             # 直接发送原文本
+    LIGHT = "light"             # 轻量渲染
+    BROWSER = "browser"         # 浏览器完整渲染
+
+
+class LLMPriority(Enum):
+    """
+    模型调用优先级，数值越小越优先
+    """
+    INTERACTIVE = 0             # 用户正在等待的回复
+    SUMMARY = 1                 # 话题总结
+    BACKGROUND = 2              # 深度研究后台执行的调用
@@ -0,0 +1,25 @@
+class DeepResearchError(Exception):
+    """
+    深度研究相关错误
+    """
+
+
+class ActionParseError(DeepResearchError):
+    """
+    模型输出无法解析为有效的action
+    """
+    def __init__(self, message: str, raw_text: str = ""):
+        super().__init__(message)
+        self.raw_text = raw_text
+
+
+class LLMCallError(DeepResearchError):
+    """
+    模型调用失败(超时、限流、熔断或上游错误)，重试及备用Provider均已用尽
+    """
+    def __init__(self, message: str, kind: str = "error", provider_id: str = None, attempts: int = 0):
+        super().__init__(message)
+        # 失败类型: timeout, rate_limit, auth, fatal, circuit_open, error
+        self.kind = kind
+        self.provider_id = provider_id
+        self.attempts = attempts
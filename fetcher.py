@@ -0,0 +1,540 @@
+import asyncio
+import hashlib
+import ipaddress
+import json
+import os
+import re
+import socket
+import time
+from collections import OrderedDict
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlsplit
+
+import aiohttp
+from aiohttp.abc import AbstractResolver
+from astrbot.api import logger
+
+from .compaction import elide_text
+from .render_cache import TEMP_FILE_MARK, write_atomic
+
+
+# 不包含正文内容的标签
+SKIP_TAGS = {"script", "style", "noscript", "svg", "canvas", "template", "iframe", "head", "nav", "footer", "button", "select"}
+
+# 需要换行的块级标签
+BLOCK_TAGS = {
+    "p", "div", "br", "hr", "li", "ul", "ol", "tr", "table", "section", "article", "main", "aside", "header",
+    "h1", "h2", "h3", "h4", "h5", "h6", "pre", "blockquote", "dd", "dt", "dl", "figure", "figcaption",
+}
+
+# 跟随重定向的最大次数
+MAX_REDIRECTS = 5
+
+REDIRECT_STATUS = {301, 302, 303, 307, 308}
+
+DEFAULT_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36"
+
+
+class _TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.title = ""
+        self._parts = []
+        self._skip_depth = 0
+        self._in_title = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "title":
+            self._in_title = True
+        elif tag in SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag in BLOCK_TAGS:
+            self._parts.append("\n")
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in BLOCK_TAGS:
+            self._parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag == "title":
+            self._in_title = False
+        elif tag in SKIP_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+        elif tag in BLOCK_TAGS:
+            self._parts.append("\n")
+
+    def handle_data(self, data):
+        if self._in_title:
+            self.title += data
+        elif not self._skip_depth:
+            self._parts.append(data)
+
+    def text(self) -> str:
+        text = "".join(self._parts)
+        # 合并空白，最多保留一个空行
+        text = re.sub(r"[ \t\r\f\v ]+", " ", text)
+        text = re.sub(r" *\n *", "\n", text)
+        text = re.sub(r"\n{3,}", "\n\n", text)
+        return text.strip()
+
+
+def html_to_text(html: str) -> tuple:
+    """
+    提取HTML中的标题和正文文本，返回 (标题, 正文)
+    """
+    parser = _TextExtractor()
+    try:
+        parser.feed(html)
+        parser.close()
+    except Exception as e:
+        logger.debug(f"解析HTML时出错: {e}")
+    return parser.title.strip(), parser.text()
+
+
+class UrlBlockedError(ValueError):
+    """
+    URL不符合访问策略
+    """
+
+
+def is_public_address(address: str) -> bool:
+    """
+    是否为公网地址，内网、回环、链路本地(包括云服务元数据地址 169.254.169.254)、保留及组播地址均不是
+    """
+    try:
+        ip = ipaddress.ip_address(address.split("%", 1)[0])
+    except ValueError:
+        return False
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+class UrlPolicy:
+    """
+    visit action 允许访问的URL
+
+    只允许 http/https，默认拒绝解析到非公网地址的主机，防止模型被网页内容诱导访问内部服务(SSRF)。
+    allowed_hosts 中的主机不受地址限制。
+    """
+    def __init__(self, allow_private: bool = False, allowed_hosts: list = None):
+        self._allow_private = allow_private
+        self._allowed_hosts = {host.strip().lower().rstrip(".") for host in allowed_hosts or [] if host and host.strip()}
+
+    def host_exempt(self, host: str) -> bool:
+        return self._allow_private or (host or "").lower().rstrip(".") in self._allowed_hosts
+
+    async def check(self, url: str):
+        """
+        检查URL，不允许访问时抛出 UrlBlockedError
+        """
+        try:
+            parsed = urlsplit(url)
+            port = parsed.port
+        except ValueError as e:
+            raise UrlBlockedError(f"无效的URL: {e}")
+        if parsed.scheme not in ("http", "https"):
+            raise UrlBlockedError(f"只允许访问 http/https 网址: {url}")
+        host = parsed.hostname
+        if not host:
+            raise UrlBlockedError(f"URL缺少主机名: {url}")
+        if self.host_exempt(host):
+            return
+
+        try:
+            ipaddress.ip_address(host)
+            addresses = [host]
+        except ValueError:
+            try:
+                infos = await asyncio.get_running_loop().getaddrinfo(
+                    host, port or (443 if parsed.scheme == "https" else 80), type=socket.SOCK_STREAM
+                )
+            except OSError as e:
+                raise UrlBlockedError(f"无法解析主机: {host}, {e}")
+            addresses = [info[4][0] for info in infos]
+
+        blocked = [address for address in addresses if not is_public_address(address)]
+        if blocked or not addresses:
+            raise UrlBlockedError(f"拒绝访问非公网地址: {host} ({', '.join(blocked)})")
+
+
+class _PolicyResolver(AbstractResolver):
+    """
+    连接时再次过滤DNS解析结果，避免检查后解析结果发生变化(DNS rebinding)
+    """
+    def __init__(self, policy: UrlPolicy):
+        self._policy = policy
+        self._resolver = aiohttp.DefaultResolver()
+
+    async def resolve(self, host: str, port: int = 0, family: int = socket.AF_INET) -> list:
+        hosts = await self._resolver.resolve(host, port, family)
+        if self._policy.host_exempt(host):
+            return hosts
+        hosts = [item for item in hosts if is_public_address(item["host"])]
+        if not hosts:
+            raise OSError(f"拒绝访问非公网地址: {host}")
+        return hosts
+
+    async def close(self):
+        await self._resolver.close()
+
+
+class PageCache:
+    """
+    网页内容磁盘缓存
+
+    以URL的哈希为文件名保存提取后的网页文本及 ETag/Last-Modified，过期后通过条件请求重新验证。
+    按最近使用时间进行 LRU 淘汰，限制缓存项数量、总大小和保存时长，过期的缓存项由定时清理删除。
+    """
+    def __init__(self, cache_dir: str, ttl: float = 24 * 3600, max_entries: int = 5000, max_size_mb: int = 100,
+                 max_age_hours: float = 7 * 24):
+        self._cache_dir = cache_dir
+        self._ttl = ttl
+        self._max_entries = max(1, max_entries)
+        self._max_size = max(1, max_size_mb) * 1024 * 1024
+
+        # 缓存项最长保留时间(秒)，超过后不再用于条件请求，0为不限制
+        self._max_age = max(0, max_age_hours) * 3600
+
+        # 文件路径 -> (文件大小, 最近使用时间)，按最近使用顺序排列
+        self._index: OrderedDict = OrderedDict()
+        self._total_size = 0
+
+        self._sweeper_task: asyncio.Task = None
+
+        os.makedirs(self._cache_dir, exist_ok=True)
+        self._load_index()
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    @property
+    def total_size(self) -> int:
+        return self._total_size
+
+    def _path(self, url: str) -> str:
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self._cache_dir, key[:2], f"{key}.json")
+
+    def _load_index(self):
+        entries = []
+        for shard_name in os.listdir(self._cache_dir):
+            shard_dir = os.path.join(self._cache_dir, shard_name)
+            if not os.path.isdir(shard_dir):
+                continue
+            for file_name in os.listdir(shard_dir):
+                path = os.path.join(shard_dir, file_name)
+                if TEMP_FILE_MARK in file_name:
+                    # 上次运行时未完成写入的临时文件
+                    self._remove_file(path)
+                    continue
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, path, stat.st_size))
+
+        for mtime, path, size in sorted(entries):
+            self._index[path] = (size, mtime)
+            self._total_size += size
+
+        logger.debug(f"载入网页缓存: {len(self._index)} 项, {self._total_size / 1024 / 1024:.2f}MB")
+        self._evict()
+
+    def get(self, url: str) -> dict:
+        """
+        读取缓存项，不存在时返回None
+        """
+        path = self._path(url)
+        if path not in self._index:
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            # 文件已被外部删除
+            self._total_size -= self._index.pop(path)[0]
+            return None
+        except Exception as e:
+            logger.warning(f"读取网页缓存失败: {url}, {e}")
+            return None
+        if entry.get("url") != url:
+            return None
+
+        now = time.time()
+        self._index[path] = (self._index[path][0], now)
+        self._index.move_to_end(path)
+        try:
+            # 更新修改时间，使重启后仍能保持 LRU 顺序
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+        return entry
+
+    def is_fresh(self, entry: dict) -> bool:
+        return entry.get("fetched_at", 0) + self._ttl > time.time()
+
+    def put(self, url: str, entry: dict):
+        entry = {**entry, "url": url, "fetched_at": time.time()}
+        path = self._path(url)
+        data = json.dumps(entry, ensure_ascii=False)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_atomic(path, data)
+        except OSError as e:
+            logger.warning(f"保存网页缓存失败: {url}, {e}")
+            return entry
+
+        if path in self._index:
+            self._total_size -= self._index.pop(path)[0]
+        size = len(data.encode("utf-8"))
+        self._index[path] = (size, time.time())
+        self._total_size += size
+        self._evict()
+        return entry
+
+    @staticmethod
+    def _remove_file(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"删除网页缓存文件失败: {path}, {e}")
+
+    def _remove_entry(self, path: str):
+        self._total_size -= self._index.pop(path)[0]
+        self._remove_file(path)
+
+    def _evict(self):
+        while self._index and (self._total_size > self._max_size or len(self._index) > self._max_entries):
+            self._remove_entry(next(iter(self._index)))
+
+    def sweep(self) -> int:
+        """
+        清理超过保留时间的缓存项，返回清理的缓存项数量
+        """
+        count = len(self._index)
+        if self._max_age:
+            expire_time = time.time() - self._max_age
+            while self._index:
+                path = next(iter(self._index))
+                if self._index[path][1] > expire_time:
+                    break
+                self._remove_entry(path)
+        self._evict()
+
+        removed = count - len(self._index)
+        if removed:
+            logger.debug(f"清理网页缓存: {removed} 项, 当前 {len(self._index)} 项, {self._total_size / 1024 / 1024:.2f}MB")
+        return removed
+
+    async def _run_sweeper(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.warning(f"清理网页缓存时出错: {e}")
+
+    def start_sweeper(self, interval: float = 3600):
+        """
+        启动后台定时清理任务
+        """
+        if self._sweeper_task is None or self._sweeper_task.done():
+            self._sweeper_task = asyncio.get_event_loop().create_task(self._run_sweeper(interval))
+
+    def stop_sweeper(self):
+        if self._sweeper_task is not None:
+            self._sweeper_task.cancel()
+            self._sweeper_task = None
+
+
+class WebFetcher:
+    """
+    visit action 的网页获取
+
+    使用共享的HTTP连接池并发获取多个URL，将HTML转换为纯文本后返回，
+    结果保存到磁盘缓存中，跨会话复用；同一URL同时发起的多次请求只会请求一次。
+    """
+    def __init__(self, cache_dir: str, ttl: float = 24 * 3600, timeout: float = 20, max_concurrency: int = 8,
+                 max_bytes: int = 2 * 1024 * 1024, max_tokens: int = 6000, session: aiohttp.ClientSession = None,
+                 user_agent: str = DEFAULT_USER_AGENT, policy: UrlPolicy = None, cache_max_entries: int = 5000,
+                 cache_max_size_mb: int = 100, cache_max_age_hours: float = 7 * 24):
+        self._cache = PageCache(cache_dir, ttl, cache_max_entries, cache_max_size_mb, cache_max_age_hours)
+        self._timeout = timeout
+        self._max_concurrency = max(1, max_concurrency)
+        self._semaphore = asyncio.Semaphore(self._max_concurrency)
+
+        # 单个页面最大下载大小(字节)
+        self._max_bytes = max_bytes
+
+        # 返回给模型的单个页面最大token数量
+        self._max_tokens = max(64, max_tokens)
+
+        self._user_agent = user_agent
+        
+        # 允许访问的URL，每次请求和重定向前检查
+        self._policy = policy or UrlPolicy()
+
+        # 外部传入的会话(如测试时使用的本地服务)由调用方负责关闭
+        self._session = session
+        self._owns_session = session is None
+
+        # 正在获取中的URL -> Future
+        self._inflight: dict = {}
+
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.stale = 0
+        self.blocked = 0
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self._max_concurrency, limit_per_host=4, ttl_dns_cache=300, resolver=_PolicyResolver(self._policy)
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+            self._owns_session = True
+        return self._session
+
+    async def _read_body(self, response: aiohttp.ClientResponse) -> bytes:
+        chunks = []
+        size = 0
+        async for chunk in response.content.iter_chunked(64 * 1024):
+            chunks.append(chunk)
+            size += len(chunk)
+            if self._max_bytes and size >= self._max_bytes:
+                logger.debug(f"网页内容超出大小限制，只读取前 {self._max_bytes} 字节: {response.url}")
+                break
+        return b"".join(chunks)
+
+    async def _download(self, url: str, cached: dict) -> dict:
+        headers = {}
+        if cached:
+            if cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
+
+        async with self._semaphore:
+            headers["User-Agent"] = self._user_agent
+            timeout = aiohttp.ClientTimeout(total=self._timeout)
+            current_url = url
+            # 手动跟随重定向，每次跳转前检查目标地址
+            for _ in range(MAX_REDIRECTS + 1):
+                await self._policy.check(current_url)
+                async with self._get_session().get(current_url, headers=headers, timeout=timeout, allow_redirects=False) as response:
+                    location = response.headers.get("Location")
+                    if response.status in REDIRECT_STATUS and location:
+                        current_url = urljoin(current_url, location)
+                        continue
+                    return await self._handle_response(url, response, cached)
+            raise RuntimeError(f"重定向次数超过 {MAX_REDIRECTS} 次")
+
+    async def _handle_response(self, url: str, response: aiohttp.ClientResponse, cached: dict) -> dict:
+        if response.status == 304 and cached:
+            self.revalidated += 1
+            return self._cache.put(url, cached)
+
+        if response.status >= 400:
+            raise RuntimeError(f"HTTP {response.status}")
+
+        content_type = response.headers.get("Content-Type", "").lower()
+        if content_type and not any(kind in content_type for kind in ("text/", "html", "json", "xml")):
+            raise RuntimeError(f"不支持的内容类型: {content_type}")
+
+        body = await self._read_body(response)
+        try:
+            encoding = response.get_encoding()
+        except Exception:
+            encoding = "utf-8"
+        text = body.decode(encoding, errors="replace")
+
+        if "html" in content_type or (not content_type and "<html" in text[:1024].lower()):
+            title, text = html_to_text(text)
+        else:
+            title = ""
+
+        self.misses += 1
+        return self._cache.put(url, {
+            "title": title,
+            "content": text,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        })
+
+    async def _refresh(self, url: str, cached: dict) -> dict:
+        """
+        下载或重新验证网页，已有缓存时重新验证失败返回过期的缓存
+        """
+        try:
+            return await self._download(url, cached)
+        except UrlBlockedError:
+            self.blocked += 1
+            raise
+        except Exception as e:
+            if not cached:
+                raise
+            self.stale += 1
+            logger.warning(f"重新验证网页缓存失败，使用过期的缓存: {url}, {e!r}")
+            return {**cached, "stale": True}
+
+    async def _fetch_entry(self, url: str) -> dict:
+        cached = self._cache.get(url)
+        if cached and self._cache.is_fresh(cached):
+            self.hits += 1
+            return cached
+
+        inflight = self._inflight.get(url)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+
+        task = asyncio.ensure_future(self._refresh(url, cached))
+        self._inflight[url] = task
+        try:
+            return await asyncio.shield(task)
+        finally:
+            self._inflight.pop(url, None)
+
+    async def fetch(self, url: str) -> dict:
+        """
+        获取网页内容，返回 {"url", "title", "content"}，内容为过期缓存时包含 "stale"，失败时返回 {"url", "error"}
+        """
+        try:
+            entry = await self._fetch_entry(url)
+        except UrlBlockedError as e:
+            logger.warning(f"拒绝访问网页: {url}, {e}")
+            return {"url": url, "error": f"不允许访问该网址: {e}"}
+        except asyncio.TimeoutError:
+            logger.warning(f"获取网页超时: {url}")
+            return {"url": url, "error": f"获取网页超时({self._timeout}s)"}
+        except Exception as e:
+            logger.warning(f"获取网页失败: {url}, {e}")
+            return {"url": url, "error": f"获取网页失败: {e}"}
+
+        result = {
+            "url": url,
+            "title": entry.get("title", ""),
+            "content": elide_text(entry.get("content", ""), self._max_tokens),
+        }
+        if entry.get("stale"):
+            result["stale"] = True
+        return result
+
+    async def fetch_many(self, urls: list) -> list:
+        """
+        并发获取多个网页，结果顺序与 urls 相同
+        """
+        return await asyncio.gather(*[self.fetch(url) for url in urls])
+
+    @property
+    def cache(self) -> PageCache:
+        return self._cache
+
+    async def close(self):
+        self._cache.stop_sweeper()
+        if self._owns_session and self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
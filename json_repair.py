@@ -0,0 +1,222 @@
+import json
+import re
+
+from .enums import DeepResearchWorkStage
+from .exceptions import ActionParseError
+
+
+_TRAILING_COMMA_RE = re.compile(r"\s*(//[^\n]*\n\s*)*[}\]]")
+_WORD_RE = re.compile(r"[A-Za-z_]+")
+
+# 字符串外的 Python 字面量 -> JSON
+_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+# action -> 必须包含的字段及类型，key 为元组时表示其中任意一个字段即可，类型也为元组时与字段一一对应
+ACTION_SCHEMAS = {
+    "ask": {"question": str},
+    "answer": {"answer": str},
+    "set_research_topic": {"research_topic": str},
+    "get_research_topic": {},
+    "set_todo_list": {"todo_list": list},
+    "get_todo_list": {},
+    "set_stage": {"stage": str},
+    "set_todo_status": {("updates", "id"): (list, str)},
+    "finished": {"result": str},
+    "tool_use": {"tool_use": list},
+    "search": {"search_request": list},
+    "write_file": {"content": str},
+    "visit": {("urls", "url"): (list, str)},
+}
+
+
+def strip_code_fence(text: str) -> str:
+    """
+    去除包裹整个回复的Markdown代码块标记，回复内容中的代码块保持不变
+    """
+    text = text.strip()
+    if not text.startswith("```"):
+        return text
+    first_line_end = text.find("\n")
+    text = "" if first_line_end < 0 else text[first_line_end + 1:]
+    if text.rstrip().endswith("```"):
+        text = text.rstrip()[:-3]
+    return text
+
+
+def extract_first_object(text: str) -> str:
+    """
+    提取文本中第一个括号匹配的 {...}，没有完整对象时返回从第一个 { 开始的内容
+    """
+    start = text.find("{")
+    if start < 0:
+        return text
+
+    depth = 0
+    quote = None
+    escape = False
+    for index in range(start, len(text)):
+        char = text[index]
+        if quote:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == quote:
+                quote = None
+        elif char in "\"'":
+            quote = char
+        elif char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                return text[start:index + 1]
+    return text[start:]
+
+
+def repair_json(text: str) -> str:
+    """
+    修复常见的JSON格式问题：注释、末尾多余的逗号、单引号字符串、字符串中未转义的换行、Python字面量
+    """
+    output = []
+    quote = None
+    escape = False
+    index = 0
+    length = len(text)
+    while index < length:
+        char = text[index]
+
+        if quote:
+            if escape:
+                escape = False
+                if char == "'":
+                    # JSON 中没有 \' 转义
+                    output[-1] = char
+                else:
+                    output.append(char)
+            elif char == "\\":
+                escape = True
+                output.append(char)
+            elif char == quote:
+                quote = None
+                output.append('"')
+            elif char == '"':
+                # 单引号字符串中的双引号
+                output.append('\\"')
+            elif char == "\n":
+                output.append("\\n")
+            elif char == "\r":
+                output.append("\\r")
+            elif char == "\t":
+                output.append("\\t")
+            else:
+                output.append(char)
+            index += 1
+            continue
+
+        if char in "\"'":
+            quote = char
+            output.append('"')
+        elif text.startswith("//", index):
+            # 行注释
+            end = text.find("\n", index)
+            index = length if end < 0 else end
+            continue
+        elif text.startswith("/*", index):
+            end = text.find("*/", index + 2)
+            index = length if end < 0 else end + 2
+            continue
+        elif char == ",":
+            # 末尾多余的逗号
+            if _TRAILING_COMMA_RE.match(text, index + 1) is None:
+                output.append(char)
+        else:
+            match = _WORD_RE.match(text, index)
+            if match is not None:
+                word = match.group(0)
+                output.append(_LITERALS.get(word, word))
+                index += len(word)
+                continue
+            output.append(char)
+        index += 1
+
+    return "".join(output)
+
+
+def parse_json_object(text: str) -> dict:
+    """
+    尽可能将模型输出解析为JSON对象，无法解析时抛出 ActionParseError
+    """
+    text = text.strip()
+    try:
+        result = json.loads(text)
+        if isinstance(result, dict):
+            return result
+    except ValueError:
+        pass
+
+    candidate = extract_first_object(strip_code_fence(text))
+    error = None
+    for attempt in (candidate, repair_json(candidate)):
+        try:
+            result = json.loads(attempt)
+        except ValueError as e:
+            error = e
+            continue
+        if isinstance(result, dict):
+            return result
+        error = ValueError("回复内容不是JSON对象")
+
+    raise ActionParseError(f"无法解析为JSON: {error}", text)
+
+
+def validate_tool_call(tool_call) -> str:
+    """
+    检查 tool_use 中单个调用的格式，正确时返回None，否则返回错误原因
+    """
+    if not isinstance(tool_call, dict):
+        return f"工具调用必须是包含 tool_name 和 args 的对象，收到: {json.dumps(tool_call, ensure_ascii=False)}"
+    if not isinstance(tool_call.get("tool_name"), str) or not tool_call["tool_name"]:
+        return "工具调用缺少 tool_name 或 tool_name 不是字符串"
+    if tool_call.get("args") is not None and not isinstance(tool_call.get("args"), dict):
+        return "工具调用的 args 必须是对象"
+    return None
+
+
+def validate_action(response_json: dict):
+    """
+    检查action及其必须字段，不符合要求时抛出 ActionParseError
+    """
+    action = response_json.get("action")
+    if action not in ACTION_SCHEMAS:
+        raise ActionParseError(f"未知的action: {action}，可用的action: {', '.join(ACTION_SCHEMAS)}")
+
+    for field, field_type in ACTION_SCHEMAS[action].items():
+        fields = field if isinstance(field, tuple) else (field,)
+        if isinstance(field, tuple) and isinstance(field_type, tuple) and len(field) == len(field_type):
+            field_types = field_type
+        else:
+            field_types = (field_type,) * len(fields)
+        if not any(isinstance(response_json.get(name), name_type) for name, name_type in zip(fields, field_types)):
+            raise ActionParseError(f"action {action} 缺少字段或字段类型错误: {' 或 '.join(fields)}")
+
+    if action == "tool_use":
+        for index, tool_call in enumerate(response_json["tool_use"], start=1):
+            error = validate_tool_call(tool_call)
+            if error is not None:
+                raise ActionParseError(f"tool_use 第{index}项格式错误: {error}")
+
+    if action == "set_stage":
+        try:
+            DeepResearchWorkStage.get_stage(response_json["stage"])
+        except ValueError as e:
+            raise ActionParseError(str(e))
+
+
+def parse_action(text: str) -> dict:
+    """
+    解析并检查模型输出的action
+    """
+    response_json = parse_json_object(text)
+    validate_action(response_json)
+    return response_json
@@ -0,0 +1,346 @@
+import io
+import os
+import re
+import threading
+
+from astrbot.api import logger
+
+from .renderer import IMAGE_EXTENSIONS, format_candidates
+
+try:
+    from PIL import Image, ImageDraw, ImageFont
+except ImportError:
+    Image = None
+
+
+# 常见系统中支持中文的字体
+FONT_CANDIDATES = [
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/google-noto-cjk/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/truetype/wqy/wqy-microhei.ttc",
+    "/usr/share/fonts/wqy-microhei/wqy-microhei.ttc",
+    "/usr/share/fonts/truetype/wqy/wqy-zenhei.ttc",
+    "C:/Windows/Fonts/msyh.ttc",
+    "C:/Windows/Fonts/simhei.ttf",
+    "/System/Library/Fonts/PingFang.ttc",
+    "/System/Library/Fonts/STHeiti Medium.ttc",
+]
+
+MONO_FONT_CANDIDATES = [
+    "/usr/share/fonts/truetype/dejavu/DejaVuSansMono.ttf",
+    "/usr/share/fonts/dejavu/DejaVuSansMono.ttf",
+    "C:/Windows/Fonts/consola.ttf",
+    "/System/Library/Fonts/Menlo.ttc",
+]
+
+# 与 markdown-template.html 保持一致的配色
+COLOR_TEXT = "#333333"
+COLOR_ACCENT = "#3eaf7c"
+COLOR_TITLE_BG = "#39a876"
+COLOR_QUOTE_TEXT = "#666666"
+COLOR_BLOCK_BG = "#f8f8f8"
+COLOR_BORDER = "#ececec"
+
+BODY_FONT_SIZE = 32
+CODE_FONT_SIZE = 24
+TITLE_FONT_SIZE = 64
+HEADING_FONT_SIZES = {1: 48, 2: 44, 3: 38, 4: 34, 5: 32, 6: 32}
+LINE_HEIGHT = 1.75
+
+_HEADING_RE = re.compile(r"^(#{1,6})[ \t]+(.*?)[ \t#]*$")
+_LIST_RE = re.compile(r"^([ \t]*)([-*+]|\d+[.)])[ \t]+(.*)$")
+_QUOTE_RE = re.compile(r"^[ \t]*>[ \t]?(.*)$")
+_HR_RE = re.compile(r"^[ \t]*([-*_])(?:[ \t]*\1){2,}[ \t]*$")
+_FENCE_RE = re.compile(r"^[ \t]*(```|~~~)")
+_INLINE_RE = re.compile(r"\*\*(.+?)\*\*|__(.+?)__|`([^`]+)`|\[([^\]]+)\]\([^)]+\)|\*([^*\s][^*]*?)\*")
+_TOKEN_RE = re.compile(r"[A-Za-z0-9_\-.,:;!?'\"/()@%&+=]+|\s+|.")
+
+
+def find_font(candidates: list) -> str:
+    for path in candidates:
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def parse_inline(text: str) -> list:
+    """
+    解析行内格式，返回 [(文本, 样式)]，样式为 normal / bold / code / link
+    """
+    segments = []
+    position = 0
+    for match in _INLINE_RE.finditer(text):
+        if match.start() > position:
+            segments.append((text[position:match.start()], "normal"))
+        bold, bold_alt, code, link, italic = match.groups()
+        if bold or bold_alt:
+            segments.append((bold or bold_alt, "bold"))
+        elif code:
+            segments.append((code, "code"))
+        elif link:
+            segments.append((link, "link"))
+        else:
+            segments.append((italic, "normal"))
+        position = match.end()
+    if position < len(text):
+        segments.append((text[position:], "normal"))
+    return segments
+
+
+def parse_blocks(text: str) -> list:
+    """
+    将 Markdown 文本解析为块，返回 [(类型, 内容...)]
+    """
+    blocks = []
+    lines = text.splitlines()
+    index = 0
+    while index < len(lines):
+        line = lines[index]
+        index += 1
+
+        if _FENCE_RE.match(line):
+            fence = _FENCE_RE.match(line).group(1)
+            code_lines = []
+            while index < len(lines) and not lines[index].strip().startswith(fence):
+                code_lines.append(lines[index])
+                index += 1
+            index += 1
+            blocks.append(("code", code_lines))
+            continue
+
+        if not line.strip():
+            blocks.append(("blank",))
+            continue
+
+        if _HR_RE.match(line):
+            blocks.append(("hr",))
+            continue
+
+        match = _HEADING_RE.match(line)
+        if match:
+            blocks.append(("heading", len(match.group(1)), match.group(2)))
+            continue
+
+        match = _QUOTE_RE.match(line)
+        if match:
+            blocks.append(("quote", match.group(1)))
+            continue
+
+        match = _LIST_RE.match(line)
+        if match:
+            indent = len(match.group(1).expandtabs(4)) // 2
+            marker = match.group(2)
+            blocks.append(("list", indent, "•" if marker in "-*+" else marker, match.group(3)))
+            continue
+
+        blocks.append(("paragraph", line.strip()))
+    return blocks
+
+
+class LightMarkdownRenderer:
+    """
+    不依赖浏览器的轻量 Markdown 渲染器
+
+    使用 Pillow 直接绘制标题、段落、列表、引用、分割线和代码块，
+    不支持表格、公式和 mermaid 图表，这些内容仍需要浏览器渲染。
+    """
+    def __init__(self, font_path: str = None, mono_font_path: str = None):
+        self._font_path = font_path or find_font(FONT_CANDIDATES)
+        self._mono_font_path = mono_font_path or find_font(MONO_FONT_CANDIDATES) or self._font_path
+        self._fonts = {}
+
+        # 字体对象不保证线程安全，渲染在线程池中进行时逐个执行
+        self._lock = threading.Lock()
+
+        if Image is None:
+            logger.info("未安装 Pillow，轻量Markdown渲染不可用")
+        elif self._font_path is None:
+            logger.info("未找到支持中文的字体，轻量Markdown渲染不可用，可在配置中指定字体文件")
+
+    @property
+    def available(self) -> bool:
+        return Image is not None and self._font_path is not None
+
+    def _font(self, size: int, mono: bool = False):
+        key = (size, mono)
+        font = self._fonts.get(key)
+        if font is None:
+            font = ImageFont.truetype(self._mono_font_path if mono else self._font_path, size)
+            self._fonts[key] = font
+        return font
+
+    def _run_font(self, text: str, style: str, size: int, scale: float):
+        if style == "code":
+            # 等宽字体通常不包含中文字符
+            return self._font(int(CODE_FONT_SIZE * scale), mono=text.isascii())
+        return self._font(int(size * scale))
+
+    def _wrap(self, segments: list, max_width: float, size: int, scale: float) -> list:
+        """
+        按宽度折行，返回行列表，每行为 [(文本, 样式)]
+        """
+        lines = [[]]
+        line_width = 0
+        for text, style in segments:
+            for token in _TOKEN_RE.findall(text):
+                font = self._run_font(token, style, size, scale)
+                token_width = font.getlength(token)
+                if line_width + token_width > max_width and lines[-1]:
+                    if token.isspace():
+                        continue
+                    lines.append([])
+                    line_width = 0
+                if token_width > max_width:
+                    # 超长单词按字符拆分
+                    for char in token:
+                        char_width = font.getlength(char)
+                        if line_width + char_width > max_width and lines[-1]:
+                            lines.append([])
+                            line_width = 0
+                        lines[-1].append((char, style))
+                        line_width += char_width
+                    continue
+                lines[-1].append((token, style))
+                line_width += token_width
+        return lines
+
+    def _layout_runs(self, ops: list, lines: list, x: float, y: float, size: int, scale: float, color: str) -> float:
+        line_height = size * scale * LINE_HEIGHT
+        for line in lines:
+            cursor = x
+            for text, style in line:
+                font = self._run_font(text, style, size, scale)
+                fill = COLOR_ACCENT if style in ("bold", "code", "link") else color
+                # 与正文基线对齐
+                offset = (size - CODE_FONT_SIZE) * scale / 2 if style == "code" else 0
+                ops.append(("text", (cursor, y + offset), text, font, fill, 0))
+                cursor += font.getlength(text)
+            y += line_height
+        return y
+
+    def render(self, text: str, title: str, width: int, scale: float = 1):
+        """
+        渲染 Markdown 文本，返回 Pillow 图片
+        """
+        with self._lock:
+            return self._render(text, title, width, scale)
+
+    def _render(self, text: str, title: str, width: int, scale: float):
+        scale = scale or 1
+        canvas_width = int(width * scale)
+        content_left = width * 0.075 * scale + BODY_FONT_SIZE * scale
+        content_width = canvas_width - content_left * 2
+        paragraph_gap = 22 * scale
+
+        ops = []
+
+        # 标题栏
+        title_font = self._font(int(TITLE_FONT_SIZE * scale))
+        title_height = TITLE_FONT_SIZE * scale * 1.5
+        ops.append(("rect", (0, 0, canvas_width, title_height), COLOR_TITLE_BG, None))
+        ops.append(("text", (16 * scale, (title_height - TITLE_FONT_SIZE * scale) / 2), f"# {title}", title_font, "#ffffff", max(1, int(scale))))
+        y = title_height + 32 * scale + 2 * BODY_FONT_SIZE * scale
+
+        previous = None
+        for block in parse_blocks(text):
+            kind = block[0]
+            if kind == "blank":
+                if previous not in (None, "blank"):
+                    y += paragraph_gap
+            elif kind == "hr":
+                y += 32 * scale
+                ops.append(("rect", (content_left, y, content_left + content_width, y + max(1, scale)), COLOR_ACCENT, None))
+                y += 32 * scale
+            elif kind == "heading":
+                level, content = block[1], block[2]
+                size = HEADING_FONT_SIZES[level]
+                y += (35 * scale) if previous is not None else 0
+                segments = [("#", "bold")] + [(" ", "normal")] + parse_inline(content)
+                y = self._layout_runs(ops, self._wrap(segments, content_width, size, scale), content_left, y, size, scale, COLOR_TEXT)
+                if level <= 2:
+                    ops.append(("rect", (content_left, y, content_left + content_width, y + max(1, scale)), COLOR_BORDER, None))
+                y += 10 * scale
+            elif kind == "list":
+                indent, marker, content = block[1], block[2], block[3]
+                x = content_left + (28 * scale) * (indent + 1)
+                marker_font = self._font(int(BODY_FONT_SIZE * scale))
+                marker_x = x - marker_font.getlength(marker + " ")
+                ops.append(("text", (marker_x, y), marker, marker_font, COLOR_ACCENT, 0))
+                lines = self._wrap(parse_inline(content), content_left + content_width - x, BODY_FONT_SIZE, scale)
+                y = self._layout_runs(ops, lines, x, y, BODY_FONT_SIZE, scale, COLOR_TEXT)
+            elif kind == "quote":
+                x = content_left + 31 * scale
+                lines = self._wrap(parse_inline(block[1]), content_left + content_width - x, BODY_FONT_SIZE, scale)
+                top = y
+                y = self._layout_runs(ops, lines, x, y, BODY_FONT_SIZE, scale, COLOR_QUOTE_TEXT)
+                # 背景和左侧竖线需要先于文字绘制
+                ops.insert(0, ("rect", (content_left, top, content_left + content_width, y), COLOR_BLOCK_BG, None))
+                ops.insert(1, ("rect", (content_left, top, content_left + 8 * scale, y), COLOR_ACCENT, None))
+            elif kind == "code":
+                code_size = CODE_FONT_SIZE
+                padding = 15 * scale
+                top = y
+                y += padding
+                inner_width = content_width - padding * 2
+                for code_line in block[1] or [""]:
+                    lines = self._wrap([(code_line.expandtabs(4), "code")], inner_width, code_size, scale) if code_line else [[]]
+                    for line in lines:
+                        text_line = "".join(part for part, _ in line)
+                        ops.append(("text", (content_left + padding, y), text_line, self._run_font(text_line, "code", code_size, scale), COLOR_TEXT, 0))
+                        y += code_size * scale * LINE_HEIGHT
+                y += padding
+                ops.insert(0, ("rect", (content_left, top, content_left + content_width, y), COLOR_BLOCK_BG, COLOR_ACCENT))
+                y += paragraph_gap
+            else:
+                lines = self._wrap(parse_inline(block[1]), content_width, BODY_FONT_SIZE, scale)
+                y = self._layout_runs(ops, lines, content_left, y, BODY_FONT_SIZE, scale, COLOR_TEXT)
+            previous = kind
+
+        canvas_height = int(y + 2 * BODY_FONT_SIZE * scale)
+        image = Image.new("RGB", (canvas_width, canvas_height), "#ffffff")
+        draw = ImageDraw.Draw(image)
+        for op in ops:
+            if op[0] == "rect":
+                _, box, fill, outline = op
+                draw.rectangle(box, fill=fill, outline=outline, width=max(1, int(2 * scale)) if outline else 0)
+            else:
+                _, position, content, font, fill, stroke = op
+                draw.text(position, content, font=font, fill=fill, stroke_width=stroke, stroke_fill=fill)
+        return image
+
+
+def encode_image(image, image_format: str = "png", quality: int = 85, max_height: int = 0, max_bytes: int = 0,
+                 device_scale_factor: float = 1) -> list:
+    """
+    将 Pillow 图片编码为一张或多张图片，返回 [(图片内容, 文件扩展名)]
+
+    切分和大小限制规则与浏览器渲染的 capture_page_images 一致，max_height 为图片像素
+    """
+    segment_height = image.height
+    if max_height and max_height > 0:
+        segment_height = max(1, int(max_height))
+
+    images = []
+    for top in range(0, image.height, segment_height):
+        segment = image.crop((0, top, image.width, min(image.height, top + segment_height)))
+
+        smallest = None
+        for candidate_format, candidate_quality in format_candidates(image_format, quality, max_bytes > 0):
+            output = io.BytesIO()
+            if candidate_format == "png":
+                segment.save(output, format="PNG")
+            else:
+                segment.save(output, format=candidate_format.upper(), quality=candidate_quality)
+            data = output.getvalue()
+            if not max_bytes or len(data) <= max_bytes:
+                smallest = (data, candidate_format)
+                break
+            if smallest is None or len(data) < len(smallest[0]):
+                smallest = (data, candidate_format)
+        else:
+            logger.warning(f"Markdown图片第{len(images) + 1}部分超出大小限制: {len(smallest[0]) / 1024:.0f}KB > {max_bytes / 1024:.0f}KB")
+
+        data, actual_format = smallest
+        images.append((data, IMAGE_EXTENSIONS[actual_format]))
+    return images
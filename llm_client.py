@@ -0,0 +1,325 @@
+import asyncio
+import random
+import time
+from contextlib import aclosing, nullcontext
+
+from astrbot.api import logger
+
+from .enums import LLMPriority
+from .exceptions import LLMCallError
+from .llm_scheduler import LLMScheduler
+
+
+# 不需要重试的上游错误状态码(请求本身有问题，换用备用Provider)
+NON_RETRYABLE_STATUS = {400, 401, 403, 404, 422}
+
+# 鉴权或配置错误的状态码，不重试，计入熔断
+AUTH_ERROR_STATUS = {401, 403}
+
+
+def provider_id(provider) -> str:
+    try:
+        return provider.meta().id
+    except Exception:
+        return str(id(provider))
+
+
+def classify_error(error: Exception) -> str:
+    """
+    判断错误类型: timeout, rate_limit, auth, fatal, error
+    """
+    if isinstance(error, asyncio.TimeoutError):
+        return "timeout"
+    status = getattr(error, "status_code", None) or getattr(error, "status", None)
+    message = str(error).lower()
+    if status == 429 or "429" in message or "rate limit" in message or "too many requests" in message:
+        return "rate_limit"
+    if status in AUTH_ERROR_STATUS:
+        return "auth"
+    if status in NON_RETRYABLE_STATUS:
+        return "fatal"
+    return "error"
+
+
+class CircuitBreaker:
+    """
+    单个Provider的熔断器
+
+    连续失败达到阈值后熔断，熔断期间直接跳过该Provider；
+    冷却时间结束后允许一次试探请求，成功则恢复，失败则继续熔断。
+    """
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 60):
+        self._failure_threshold = max(1, failure_threshold)
+        self._reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self._reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def release_probe(self):
+        """
+        获得试探机会后没有实际调用，归还试探机会
+        """
+        self._probing = False
+
+    def record_success(self):
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    def record_failure(self):
+        self._failures += 1
+        if self._probing or self._failures >= self._failure_threshold:
+            self._opened_at = time.monotonic()
+        self._probing = False
+
+
+class ResilientLLMCaller:
+    """
+    带超时、重试和熔断的模型调用
+
+    单次调用超时后按指数退避(带随机抖动)重试，限流时退避时间加倍；
+    重试用尽或Provider已熔断时依次使用备用Provider，全部失败时抛出 LLMCallError。
+    提供 scheduler 时，每次调用先从调度器获取名额；失败后的退避等待期间归还名额，等待结束后重新排队获取再发起下一次尝试。
+    总时限从首次获取名额后开始计算，之后的退避等待和重新排队的时间都计入总时限。
+    """
+    def __init__(self, fallback_providers=None, timeout: float = 120, deadline: float = 300, max_retries: int = 2,
+                 base_delay: float = 1, max_delay: float = 20, failure_threshold: int = 5, reset_timeout: float = 60,
+                 scheduler: LLMScheduler = None):
+        # 获取备用Provider列表的函数，每次调用时获取，配置变化后立即生效
+        self._fallback_providers = fallback_providers or (lambda: [])
+
+        # 单次请求超时时间和包括重试在内的总时限(秒)
+        self._timeout = timeout if timeout and timeout > 0 else None
+        self._deadline = deadline if deadline and deadline > 0 else None
+
+        self._max_retries = max(0, max_retries)
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+
+        # provider_id -> 熔断器
+        self._breakers: dict = {}
+
+        # 全局模型调用调度，为None时不限制
+        self._scheduler = scheduler
+
+    def breaker(self, provider) -> CircuitBreaker:
+        key = provider_id(provider)
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            breaker = CircuitBreaker(self._failure_threshold, self._reset_timeout)
+            self._breakers[key] = breaker
+        return breaker
+
+    def _chain(self, provider) -> list:
+        chain = [provider] if provider is not None else []
+        for fallback in self._fallback_providers():
+            if fallback is not None and all(fallback is not item for item in chain):
+                chain.append(fallback)
+        return chain
+
+    def _backoff(self, attempt: int, kind: str) -> float:
+        delay = min(self._max_delay, self._base_delay * (2 ** attempt))
+        if kind == "rate_limit":
+            delay = min(self._max_delay, delay * 2)
+        # full jitter，避免多个会话同时重试
+        return random.uniform(delay / 2, delay)
+
+    def _attempts(self, started_at: float):
+        """
+        依次生成每次尝试的序号，超过总时限时停止
+        """
+        for attempt in range(self._max_retries + 1):
+            if self._deadline and time.monotonic() - started_at >= self._deadline:
+                return
+            yield attempt
+
+    async def _wait_retry(self, provider, attempt: int, kind: str, started_at: float, lease=None,
+                          call_info: dict = None) -> bool:
+        """
+        等待重试，没有剩余重试次数或超过总时限时返回False
+
+        提供调度名额 lease 时，等待期间归还名额，不占用全局并发，等待结束后重新排队获取
+        """
+        if kind in ("fatal", "auth") or attempt >= self._max_retries:
+            return False
+        delay = self._backoff(attempt, kind)
+        if self._deadline and time.monotonic() - started_at + delay >= self._deadline:
+            return False
+        logger.info(f"模型调用失败({kind})，{delay:.1f}s 后重试: {provider_id(provider)}")
+        if lease is None:
+            await asyncio.sleep(delay)
+            return True
+        async with lease.released():
+            await asyncio.sleep(delay)
+        if call_info is not None:
+            call_info["queue_wait"] = lease.wait_time
+        return True
+
+    @staticmethod
+    def _record_failure(breaker: CircuitBreaker, kind: str):
+        if kind == "fatal":
+            # 请求本身的错误不能说明上游是否正常，不计入熔断，只归还试探机会
+            breaker.release_probe()
+        else:
+            # 鉴权或配置错误(401/403)在修正配置前会一直失败，与其他错误一样计入熔断
+            breaker.record_failure()
+
+    def _slot(self, priority: LLMPriority, user_id: str, session_id: str):
+        if self._scheduler is None:
+            return nullcontext()
+        return self._scheduler.slot(priority, user_id, session_id)
+
+    async def text_chat(self, provider, call_info: dict = None, priority: LLMPriority = LLMPriority.BACKGROUND,
+                        user_id: str = None, session_id: str = None, **kwargs):
+        """
+        调用 provider.text_chat，返回 LLMResponse
+
+        提供 call_info 时，写入调度器排队耗时，成功后写入实际使用的Provider和尝试次数 {"queue_wait", "provider_id", "attempts"}；
+        priority、user_id 和 session_id 用于调度器排队
+        """
+        queued_at = time.monotonic()
+        async with self._slot(priority, user_id, session_id) as lease:
+            if call_info is not None:
+                call_info["queue_wait"] = time.monotonic() - queued_at
+            return await self._text_chat(provider, call_info, lease, **kwargs)
+
+    async def _text_chat(self, provider, call_info: dict = None, lease=None, **kwargs):
+        started_at = time.monotonic()
+        last_error, last_kind, last_provider, attempts = None, "error", None, 0
+
+        for candidate in self._chain(provider):
+            breaker = self.breaker(candidate)
+            probing = breaker.state == "half_open"
+            if not breaker.allow():
+                logger.warning(f"Provider 已熔断，跳过: {provider_id(candidate)}")
+                last_kind, last_provider = "circuit_open", provider_id(candidate)
+                continue
+
+            try:
+                candidate_attempts = 0
+                for attempt in self._attempts(started_at):
+                    attempts += 1
+                    candidate_attempts += 1
+                    try:
+                        timeout = self._timeout
+                        if self._deadline:
+                            remaining = self._deadline - (time.monotonic() - started_at)
+                            timeout = min(timeout, remaining) if timeout else remaining
+                        response = await asyncio.wait_for(candidate.text_chat(**kwargs), timeout=timeout)
+                        breaker.record_success()
+                        if call_info is not None:
+                            call_info.update(provider_id=provider_id(candidate), attempts=attempts)
+                        return response
+                    except Exception as e:
+                        last_error, last_kind, last_provider = e, classify_error(e), provider_id(candidate)
+                        logger.warning(f"模型调用失败({last_kind}): {last_provider}, {e!r}")
+                        if not await self._wait_retry(candidate, attempt, last_kind, started_at, lease, call_info):
+                            break
+
+                # 超过总时限后没有实际调用的Provider不计入熔断
+                if candidate_attempts:
+                    self._record_failure(breaker, last_kind)
+            finally:
+                # 被取消等没有记录结果的情况下归还试探机会，避免熔断器一直处于试探中
+                if probing:
+                    breaker.release_probe()
+
+        raise LLMCallError(f"模型调用失败({last_kind}): {last_error}", last_kind, last_provider, attempts)
+
+    async def text_chat_stream(self, provider, call_info: dict = None, priority: LLMPriority = LLMPriority.BACKGROUND,
+                               user_id: str = None, session_id: str = None, **kwargs):
+        """
+        调用 provider.text_chat_stream，逐个返回 LLMResponse，其他参数同 text_chat
+
+        在收到第一块内容前失败时重试或使用备用Provider，已经输出内容后失败时直接抛出 LLMCallError；
+        Provider 不支持流式输出时抛出 NotImplementedError
+        """
+        queued_at = time.monotonic()
+        async with self._slot(priority, user_id, session_id) as lease:
+            if call_info is not None:
+                call_info["queue_wait"] = time.monotonic() - queued_at
+            async with aclosing(self._text_chat_stream(provider, call_info, lease, **kwargs)) as stream:
+                async for response in stream:
+                    yield response
+
+    async def _text_chat_stream(self, provider, call_info: dict = None, lease=None, **kwargs):
+        started_at = time.monotonic()
+        last_error, last_kind, last_provider, attempts = None, "error", None, 0
+
+        for candidate in self._chain(provider):
+            if getattr(candidate, "text_chat_stream", None) is None:
+                continue
+            breaker = self.breaker(candidate)
+            probing = breaker.state == "half_open"
+            if not breaker.allow():
+                logger.warning(f"Provider 已熔断，跳过: {provider_id(candidate)}")
+                last_kind, last_provider = "circuit_open", provider_id(candidate)
+                continue
+
+            try:
+                candidate_attempts = 0
+                for attempt in self._attempts(started_at):
+                    attempts += 1
+                    candidate_attempts += 1
+                    started = False
+                    stream = candidate.text_chat_stream(**kwargs)
+                    try:
+                        while True:
+                            try:
+                                # 两块内容之间的间隔超过单次超时时间视为超时
+                                response = await asyncio.wait_for(stream.__anext__(), timeout=self._timeout)
+                            except StopAsyncIteration:
+                                break
+                            if not started and call_info is not None:
+                                call_info.update(provider_id=provider_id(candidate), attempts=attempts)
+                            started = True
+                            yield response
+                        breaker.record_success()
+                        return
+                    except NotImplementedError:
+                        raise
+                    except Exception as e:
+                        last_error, last_kind, last_provider = e, classify_error(e), provider_id(candidate)
+                        logger.warning(f"模型流式调用失败({last_kind}): {last_provider}, {e!r}")
+                        if started:
+                            breaker.record_failure()
+                            raise LLMCallError(f"模型流式输出中断({last_kind}): {e}", last_kind, last_provider, attempts)
+                        if not await self._wait_retry(candidate, attempt, last_kind, started_at, lease, call_info):
+                            break
+                    finally:
+                        await stream.aclose()
+
+                # 超过总时限后没有实际调用的Provider不计入熔断
+                if candidate_attempts:
+                    self._record_failure(breaker, last_kind)
+            finally:
+                # 不支持流式输出、被取消或调用方提前停止读取时没有记录结果，归还试探机会
+                if probing:
+                    breaker.release_probe()
+
+        if last_error is None and last_kind != "circuit_open":
+            raise NotImplementedError("没有支持流式输出的Provider")
+        raise LLMCallError(f"模型调用失败({last_kind}): {last_error}", last_kind, last_provider, attempts)
+
+    def stats(self) -> dict:
+        return {key: breaker.state for key, breaker in self._breakers.items()}
@@ -0,0 +1,221 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+from astrbot.api import logger
+
+from .enums import LLMPriority
+from .metrics import Metrics
+
+
+class _Waiter:
+    __slots__ = ("future", "priority", "user_id", "session_id", "enqueued_at")
+
+    def __init__(self, future: asyncio.Future, priority: LLMPriority, user_id: str, session_id: str):
+        self.future = future
+        self.priority = priority
+        self.user_id = user_id
+        self.session_id = session_id
+        self.enqueued_at = time.monotonic()
+
+
+class _Lease:
+    """
+    已获取的调用名额，可在等待期间暂时归还
+    """
+    def __init__(self, scheduler: "LLMScheduler", priority: LLMPriority, user_id: str, session_id: str, wait_time: float):
+        self._scheduler = scheduler
+        self._priority = priority
+        self._user_id = user_id
+        self._session_id = session_id
+        self.held = True
+
+        # 累计排队耗时(秒)，包括归还后重新获取名额的等待
+        self.wait_time = wait_time
+
+    @asynccontextmanager
+    async def released(self):
+        """
+        暂时归还名额，退出时重新排队获取；块内抛出异常时不再获取
+        """
+        self._scheduler._release()
+        self.held = False
+        yield
+        queued_at = time.monotonic()
+        await self._scheduler._acquire(self._priority, self._user_id, self._session_id)
+        self.held = True
+        self.wait_time += time.monotonic() - queued_at
+
+
+class LLMScheduler:
+    """
+    插件内模型调用的调度器
+
+    限制同时进行的模型调用数量，超出时排队等待。按优先级(用户等待的回复 > 话题总结 > 深度研究后台调用)调度，
+    同一优先级内在用户之间轮流调度，同一用户的多个会话之间也轮流调度，个别用户或会话不会占满全部名额。
+    低优先级的调用等待超过 aging 秒后提前调度，不会一直被高优先级的调用阻塞。
+    """
+    def __init__(self, max_concurrency: int = 4, aging: float = 30, metrics: Metrics = None):
+        self._max_concurrency = max(1, max_concurrency)
+
+        # 低优先级调用提前调度的等待时间(秒)，0为严格按优先级调度
+        self._aging = max(0, aging)
+
+        self._metrics = metrics or Metrics(enabled=False)
+
+        # 优先级 -> 用户 -> 会话 -> 等待队列，用户和会话按轮转顺序排列
+        self._queues = {priority: OrderedDict() for priority in LLMPriority}
+        self._waiting = {priority: 0 for priority in LLMPriority}
+
+        self._running = 0
+
+        # 统计数据
+        self._submitted = 0
+        self._aged = 0
+        self._wait_times = deque(maxlen=500)
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(self._waiting.values())
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    def stats(self) -> dict:
+        """
+        获取调度器统计数据，等待时间单位为秒
+        """
+        wait_times = sorted(self._wait_times)
+        users = set()
+        for queue in self._queues.values():
+            users.update(queue)
+        stats = {
+            "max_concurrency": self._max_concurrency,
+            "running": self._running,
+            "queue_depth": self.queue_depth,
+            "users_waiting": len(users),
+            "submitted": self._submitted,
+            "aged": self._aged,
+            "wait_avg": sum(wait_times) / len(wait_times) if wait_times else 0.0,
+            "wait_p95": wait_times[int(len(wait_times) * 0.95)] if wait_times else 0.0,
+            "wait_max": wait_times[-1] if wait_times else 0.0,
+        }
+        for priority, waiting in self._waiting.items():
+            stats[f"waiting_{priority.name.lower()}"] = waiting
+        return stats
+
+    @asynccontextmanager
+    async def slot(self, priority: LLMPriority = LLMPriority.BACKGROUND, user_id: str = None, session_id: str = None):
+        """
+        获取一个调用名额，退出时归还，返回的 _Lease 可在重试等待期间暂时归还名额
+        """
+        user_id, session_id = user_id or "", session_id or ""
+        self._submitted += 1
+        self._metrics.inc("llm_calls_total", priority=priority.name.lower())
+        queued_at = time.monotonic()
+        await self._acquire(priority, user_id, session_id)
+        lease = _Lease(self, priority, user_id, session_id, time.monotonic() - queued_at)
+        try:
+            yield lease
+        finally:
+            if lease.held:
+                self._release()
+
+    async def _acquire(self, priority: LLMPriority, user_id: str, session_id: str):
+        if self._running < self._max_concurrency and not self.queue_depth:
+            self._running += 1
+            self._record_wait(priority, 0.0)
+            return
+
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), priority, user_id, session_id)
+        sessions = self._queues[priority].setdefault(user_id, OrderedDict())
+        sessions.setdefault(session_id, deque()).append(waiter)
+        self._waiting[priority] += 1
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # 已经分配到名额后被取消，归还名额
+                self._release()
+            else:
+                self._remove(waiter)
+            raise
+
+        wait_time = time.monotonic() - waiter.enqueued_at
+        self._record_wait(priority, wait_time)
+        logger.debug(f"模型调用开始({priority.name})，排队耗时 {wait_time:.3f}s (运行中: {self._running}, 等待中: {self.queue_depth})")
+
+    def _release(self):
+        self._running -= 1
+        while self._running < self._max_concurrency:
+            waiter = self._pop_next()
+            if waiter is None:
+                return
+            if waiter.future.done():
+                # 已取消等待，还没来得及从队列中移除
+                continue
+            self._running += 1
+            waiter.future.set_result(None)
+
+    def _record_wait(self, priority: LLMPriority, wait_time: float):
+        self._wait_times.append(wait_time)
+        self._metrics.observe("llm_queue_wait_seconds", wait_time, priority=priority.name.lower())
+
+    def _pop_next(self) -> _Waiter:
+        """
+        取出下一个调用: 优先级最高的非空队列，低优先级队列中等待超过 aging 的调用优先
+        """
+        priorities = [priority for priority in LLMPriority if self._waiting[priority]]
+        if not priorities:
+            return None
+
+        selected = priorities[0]
+        if self._aging:
+            now = time.monotonic()
+            for priority in priorities[1:]:
+                if now - self._peek(priority).enqueued_at >= self._aging:
+                    selected = priority
+                    self._aged += 1
+                    break
+        return self._pop(selected)
+
+    def _peek(self, priority: LLMPriority) -> _Waiter:
+        sessions = next(iter(self._queues[priority].values()))
+        return next(iter(sessions.values()))[0]
+
+    def _pop(self, priority: LLMPriority) -> _Waiter:
+        users = self._queues[priority]
+        user_id, sessions = next(iter(users.items()))
+        session_id, queue = next(iter(sessions.items()))
+        waiter = queue.popleft()
+
+        # 取出后将该会话和用户移到轮转顺序的末尾
+        if queue:
+            sessions.move_to_end(session_id)
+        else:
+            del sessions[session_id]
+        if sessions:
+            users.move_to_end(user_id)
+        else:
+            del users[user_id]
+
+        self._waiting[priority] -= 1
+        return waiter
+
+    def _remove(self, waiter: _Waiter):
+        """
+        移除取消等待的调用
+        """
+        users = self._queues[waiter.priority]
+        sessions = users.get(waiter.user_id)
+        queue = sessions.get(waiter.session_id) if sessions is not None else None
+        if queue is None or waiter not in queue:
+            return
+        queue.remove(waiter)
+        if not queue:
+            del sessions[waiter.session_id]
+        if not sessions:
+            del users[waiter.user_id]
+        self._waiting[waiter.priority] -= 1
@@ -1,3 +1,4 @@
+import asyncio
 import hashlib
 import json
 import os
@@ -10,17 +11,34 @@ from astrbot.api.event import filter, AstrMessageEvent, MessageChain
 from astrbot.api.star import Context, register, Star
 from astrbot.api import logger, AstrBotConfig, llm_tool
 from astrbot.api.message_components import ComponentType
-from playwright.async_api import async_playwright
 from jinja2 import Template
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
 from astrbot.core.utils.session_waiter import (
     session_waiter,
     SessionController,
 )
 
-from data.plugins.knbot_enhance.enums import DeepResearchWorkStage
+from data.plugins.knbot_enhance.enums import DeepResearchWorkStage, LLMPriority, RenderMode
 
 from .prompt import *
 from .agent import DeepResearchAgent
+from .compaction import ContextCompactor
+from .session_store import DeepResearchSessionStore
+from .session_registry import DeepResearchSessionRegistry
+from .tool_executor import ToolExecutor, tool_call_name
+from .fetcher import UrlPolicy, WebFetcher
+from .streaming import StreamForwarder
+from .exceptions import DeepResearchError, LLMCallError
+from .llm_client import ResilientLLMCaller
+from .llm_scheduler import LLMScheduler
+from .renderer import BrowserPool, RenderScheduler, capture_page_images
+from .assets import AssetBundle
+from .render_cache import RenderCache
+from .summary_cache import SummaryCache, heuristic_title
+from .markdown_analyzer import decide_render_mode, requires_browser
+from .light_renderer import LightMarkdownRenderer, encode_image
+from .metrics import Metrics, BYTES_BUCKETS
+from .trajectory import TrajectoryRecorder
 
 @register("knbot_enhance", "Kalinote", "[自用]KNBot 功能增强插件", "1.0.4", "https://github.com/kalinote/knbot_enhance")
 class KNBotEnhance(Star):
@@ -32,9 +50,15 @@ class KNBotEnhance(Star):
         self.config = config
         logger.debug(f"当前配置项: {self.config}")
         
+        # 运行指标
+        self.metrics = Metrics(enabled=self.config.get("metrics", {}).get("enable", True))
+        
         # 载入markdown css样式
         self.markdown_css_content = ""
         self.markdown_html_template = ""
+        self.markdown_template_version = ""
+        self.browser_pool = None
+        self.browser_preload_task: asyncio.Task = None
         if self.config.get("markdown_image_generate").get("enable"):
             html_path = os.path.join(os.getcwd(), os.path.join("data", "plugins", "knbot_enhance", "resource"), "markdown-template.html")
             if not os.path.exists(html_path):
@@ -42,33 +66,220 @@ class KNBotEnhance(Star):
             else:
                 try:
                     with open(html_path, 'r', encoding='utf-8') as f:
-                        self.markdown_html_template = Template(f.read())
+                        template_content = f.read()
+                    self.markdown_html_template = Template(template_content)
+                    # 模板内容变化后旧的缓存自动失效
+                    self.markdown_template_version = hashlib.md5(template_content.encode("utf-8")).hexdigest()
                     logger.debug(f"载入模板文件: {html_path}")
                 except Exception as e:
                     logger.warning(f"读取Markdown渲染文件失败: {e}; 相关功能已禁用")
                     self.config["markdown_image_generate"]["enable"] = False
                     self.config.save()
                     
-        self.datas = {
-            "deepresearch": {}
-        }
+        # 模板资源包，渲染时从内存提供 KaTeX、highlight.js、mermaid 等资源
+        image_config = self.config.get("markdown_image_generate")
+        self.asset_bundle = AssetBundle(
+            asset_dirs=[os.path.join(os.getcwd(), "data", "plugins", "knbot_enhance", "resource", "vendor")],
+            cache_dir=os.path.join(os.getcwd(), "data", "plugin_data", "knbot_enhance", "assets"),
+            allow_download=image_config.get("assets_download", True),
+            allow_external=image_config.get("allow_external_resources", False),
+        )
+                    
+        # 常驻浏览器池
+        if self.config.get("markdown_image_generate").get("enable"):
+            self.browser_pool = self._create_browser_pool()
+            if image_config.get("browser_preload", True):
+                try:
+                    self.browser_preload_task = asyncio.get_event_loop().create_task(self.browser_pool.start())
+                except RuntimeError as e:
+                    logger.warning(f"预热浏览器失败，将在首次渲染时启动: {e}")
+                    
+        # 渲染调度器
+        self.render_scheduler = RenderScheduler(
+            max_concurrency=image_config.get("max_concurrent_renders", 2),
+            max_queue=image_config.get("max_render_queue", 16),
+            overload_policy=image_config.get("overload_policy", "plain_text"),
+        )
+                    
+        # 轻量渲染器，用于不需要浏览器的简单 Markdown
+        self.light_renderer = LightMarkdownRenderer(font_path=image_config.get("light_font_path") or None)
+                    
+        # 渲染结果缓存
+        temp_dir = os.path.join(os.getcwd(), "data", "temp")
+        self.render_cache = RenderCache(
+            os.path.join(temp_dir, "knbot_markdown"),
+            max_size_mb=image_config.get("cache_max_size_mb", 200),
+            max_entries=image_config.get("cache_max_entries", 2000),
+            max_age_hours=image_config.get("cache_max_age_hours", 72),
+        )
+        try:
+            # 旧版本遗留文件的清理在后台任务中进行
+            self.render_cache.start_sweeper(image_config.get("cache_sweep_interval", 600), legacy_dir=temp_dir)
+        except RuntimeError as e:
+            logger.warning(f"启动Markdown渲染缓存清理任务失败: {e}")
+                    
+        # 话题总结缓存
+        self.summary_cache = SummaryCache(
+            os.path.join(os.getcwd(), "data", "plugin_data", "knbot_enhance", "summary_cache.json"),
+            ttl=image_config.get("summary_cache_ttl_hours", 168) * 3600,
+            max_entries=image_config.get("summary_cache_max_entries", 1000),
+        )
+                    
+        # 带超时、重试和熔断的模型调用，所有调用经过同一个调度器排队
+        llm_config = self.config.get("llm_call", {})
+        self.llm_scheduler = LLMScheduler(
+            max_concurrency=llm_config.get("max_concurrency", 4),
+            aging=llm_config.get("priority_aging", 30),
+            metrics=self.metrics,
+        )
+        self.llm_caller = ResilientLLMCaller(
+            fallback_providers=self._get_fallback_providers,
+            timeout=llm_config.get("timeout", 120),
+            deadline=llm_config.get("deadline", 300),
+            max_retries=llm_config.get("max_retries", 2),
+            base_delay=llm_config.get("retry_base_delay", 1),
+            max_delay=llm_config.get("retry_max_delay", 20),
+            failure_threshold=llm_config.get("circuit_breaker_threshold", 5),
+            reset_timeout=llm_config.get("circuit_breaker_reset", 60),
+            scheduler=self.llm_scheduler,
+        )
+        
+        # 深度研究会话持久化存储
+        deepresearch_config = self.config.get("deepresearch", {})
+        self.deepresearch_store = DeepResearchSessionStore(
+            os.path.join(os.getcwd(), "data", "plugin_data", "knbot_enhance", "deepresearch.db"),
+            retention_days=deepresearch_config.get("session_retention_days", 30),
+        )
+        try:
+            self.deepresearch_store.start_pruner()
+        except RuntimeError as e:
+            logger.warning(f"启动深度研究会话清理任务失败: {e}")
+        
+        # 内存中的深度研究会话
+        self.deepresearch_sessions = DeepResearchSessionRegistry(
+            self._load_deepresearch_agent,
+            max_sessions=deepresearch_config.get("max_live_sessions", 32),
+            idle_ttl=deepresearch_config.get("session_idle_minutes", 30) * 60,
+            max_session_bytes=deepresearch_config.get("max_session_memory_mb", 8) * 1024 * 1024,
+            max_total_bytes=deepresearch_config.get("max_total_memory_mb", 128) * 1024 * 1024,
+        )
+        try:
+            self.deepresearch_sessions.start_sweeper()
+        except RuntimeError as e:
+            logger.warning(f"启动深度研究会话清理任务失败: {e}")
+        
+        # 深度研究会话轨迹录制
+        self.trajectory_recorder = None
+        if deepresearch_config.get("record_trajectories", False):
+            self.trajectory_recorder = TrajectoryRecorder(
+                os.path.join(os.getcwd(), "data", "plugin_data", "knbot_enhance", "trajectories")
+            )
+        
+        # 深度研究工具调用
+        self.tool_executor = ToolExecutor(
+            self.context.get_llm_tool_manager(),
+            max_concurrency=deepresearch_config.get("max_concurrent_tools", 4),
+            timeout=deepresearch_config.get("tool_timeout", 60),
+            max_result_tokens=deepresearch_config.get("tool_result_max_tokens", 4000),
+            search_tool=deepresearch_config.get("search_tool", "web_search"),
+            search_query_arg=deepresearch_config.get("search_query_arg", "query"),
+        )
+        
+        # visit action 网页获取
+        self.web_fetcher = WebFetcher(
+            os.path.join(os.getcwd(), "data", "plugin_data", "knbot_enhance", "pages"),
+            ttl=deepresearch_config.get("visit_cache_ttl_hours", 24) * 3600,
+            timeout=deepresearch_config.get("visit_timeout", 20),
+            max_concurrency=deepresearch_config.get("visit_max_concurrency", 8),
+            max_tokens=deepresearch_config.get("visit_max_tokens", 6000),
+            policy=UrlPolicy(
+                allow_private=deepresearch_config.get("visit_allow_private_network", False),
+                allowed_hosts=deepresearch_config.get("visit_allowed_hosts", []),
+            ),
+            cache_max_entries=deepresearch_config.get("visit_cache_max_entries", 5000),
+            cache_max_size_mb=deepresearch_config.get("visit_cache_max_size_mb", 100),
+            cache_max_age_hours=deepresearch_config.get("visit_cache_max_age_hours", 168),
+        )
+        try:
+            self.web_fetcher.cache.start_sweeper()
+        except RuntimeError as e:
+            logger.warning(f"启动网页缓存清理任务失败: {e}")
+        
+    def _create_browser_pool(self) -> BrowserPool:
+        image_config = self.config.get("markdown_image_generate")
+        return BrowserPool(
+            pool_size=image_config.get("browser_pool_size", 2),
+            asset_bundle=self.asset_bundle,
+            device_scale_factor=image_config.get("device_scale_factor", 1),
+            metrics=self.metrics,
+        )
+        
+    async def terminate(self):
+        """
+        插件卸载时释放资源
+        """
+        self.render_cache.stop_sweeper()
+        if self.browser_preload_task is not None and not self.browser_preload_task.done():
+            self.browser_preload_task.cancel()
+            try:
+                await self.browser_preload_task
+            except asyncio.CancelledError:
+                pass
+        if self.browser_pool:
+            await self.browser_pool.close()
+        self.deepresearch_sessions.stop_sweeper()
+        self.deepresearch_store.close()
+        await self.web_fetcher.close()
         
     
     @filter.on_decorating_result(desc="将过长的文本内容转换为Markdown图片")
     async def long_message_handler(self, event: AstrMessageEvent):
         result = event.get_result()
         chain = result.chain
-        if self.config.get("markdown_image_generate").get("enable"):
-            for index, item in enumerate(chain):
-                # TODO 这里可以进一步优化，而不只是简单通过字数来判断
-                if item.type == ComponentType.Plain.value and len(item.text) > self.config.get("markdown_image_generate").get("trigger_count"):
-                    logger.info(f"将文本内容转换为Markdown图片: {item.text[:10]}...")
-                    await event.send(MessageChain().message(f"[系统] 正在渲染Markdown，请稍候..."))
-                    image_path = await self._text_to_markdown_image(item.text, self.config.get("markdown_image_generate").get("generate_topic_summary"))
-                    if not image_path:
-                        continue
-                    
-                    chain[index] = Comp.Image.fromFileSystem(image_path)
+        image_config = self.config.get("markdown_image_generate")
+        if image_config.get("enable"):
+            render_indexes = [
+                index for index, item in enumerate(chain)
+                if item.type == ComponentType.Plain.value and self._get_render_mode(item.text) != RenderMode.PLAIN
+            ]
+            if not render_indexes:
+                return
+
+            logger.info(f"将 {len(render_indexes)} 段文本内容转换为Markdown图片: {chain[render_indexes[0]].text[:10]}...")
+            # 每条消息只发送一次提示
+            await event.send(MessageChain().message(f"[系统] 正在渲染Markdown，请稍候..."))
+
+            generate_topic_summary = image_config.get("generate_topic_summary")
+            self.metrics.inc("render_segments_total", len(render_indexes))
+            with self.metrics.timer("long_message_seconds"):
+                if image_config.get("batch_render", True):
+                    # 所有段落并行渲染，并发数量由渲染调度器和浏览器页面池限制
+                    image_results = await asyncio.gather(*[
+                        self._text_to_markdown_image(chain[index].text, generate_topic_summary)
+                        for index in render_indexes
+                    ])
+                else:
+                    image_results = []
+                    for index in render_indexes:
+                        image_results.append(await self._text_to_markdown_image(chain[index].text, generate_topic_summary))
+
+            # 从后往前替换，避免切分出的多张图片影响前面的索引
+            for index, image_paths in reversed(list(zip(render_indexes, image_results))):
+                if not image_paths:
+                    continue
+                
+                chain[index:index + 1] = [Comp.Image.fromFileSystem(image_path) for image_path in image_paths]
+
+    def _get_render_mode(self, text: str) -> RenderMode:
+        """
+        判断文本的渲染方式
+        """
+        image_config = self.config.get("markdown_image_generate")
+        trigger_count = image_config.get("trigger_count")
+        if image_config.get("trigger_mode", "smart") == "length":
+            return RenderMode.BROWSER if len(text) > trigger_count else RenderMode.PLAIN
+        
+        return decide_render_mode(text, trigger_count, image_config.get("plain_text_max_count", 1000))
 
     @llm_tool(name="tell_user")
     async def tell_user(self, event: AstrMessageEvent, message: str):
@@ -114,9 +325,9 @@ class KNBotEnhance(Star):
             message (string): 包含格式化内容的思考步骤或结论(Markdown格式)
             title (string): 可选的标题，简短描述这部分内容的主题（如"问题分析"、"计算过程"等）
         """
-        image_path = await self._text_to_markdown_image(message, self.config.get("markdown_image_generate").get("generate_topic_summary"), f"[想法] {title}")
-        if image_path:
-            yield event.image_result(image_path)
+        image_paths = await self._text_to_markdown_image(message, self.config.get("markdown_image_generate").get("generate_topic_summary"), f"[想法] {title}")
+        if image_paths:
+            yield event.chain_result([Comp.Image.fromFileSystem(image_path) for image_path in image_paths])
         else:
             logger.warning(f"AI试图向用户发送一条Markdown消息，但生成Markdown图片失败，消息原文为: \n{message}")
             yield "处理Markdown格式失败，请简化内容并使用tell_user工具重试"
@@ -131,34 +342,264 @@ class KNBotEnhance(Star):
         tools = func_tools_mgr.get_func_desc_openai_style()
         
         deepresearch_session_id = str(uuid.uuid4())
-        yield event.plain_result(f"深度研究会话ID: {deepresearch_session_id}, 保存该id以用于继续研究")
-        deepresearch_agent = DeepResearchAgent(deepresearch_session_id, self.context.get_using_provider(), tools)
-        self.datas["deepresearch"][deepresearch_session_id] = deepresearch_agent
+        yield event.plain_result(f"深度研究会话ID: {deepresearch_session_id}, 使用 /deepresearch_resume {deepresearch_session_id} 继续研究")
+        deepresearch_agent = self._create_deepresearch_agent(deepresearch_session_id, tools)
+        deepresearch_agent.owner_id = event.get_sender_id()
         
         # 设置阶段为ASK
         deepresearch_agent.stage = DeepResearchWorkStage.ASK
         
-        response_json = await deepresearch_agent.call_llm(research_topic)
+        async for result in self._run_deepresearch(event, deepresearch_agent, research_topic):
+            yield result
+            
+    @filter.command("deepresearch_resume")
+    async def deepresearch_resume(self, event: AstrMessageEvent, session_id: str):
+        """
+        继续之前的深度研究
+        """
+        deepresearch_agent = self.deepresearch_sessions.get(session_id)
+        if deepresearch_agent is None:
+            yield event.plain_result(f"[系统] 未找到深度研究会话: {session_id}")
+            return
+        
+        sender_id = event.get_sender_id()
+        if deepresearch_agent.owner_id and deepresearch_agent.owner_id != sender_id and not event.is_admin():
+            yield event.plain_result(f"[系统] 只有发起研究的用户可以恢复深度研究会话: {session_id}")
+            return
+        
+        if self.deepresearch_sessions.is_active(session_id):
+            yield event.plain_result(f"[系统] 深度研究会话正在进行中，无法重复恢复: {session_id}")
+            return
+        
+        budget_reason = self._deepresearch_budget_exceeded(deepresearch_agent)
+        if budget_reason:
+            yield event.plain_result(f"[系统] 深度研究会话已达到{budget_reason}，无法继续研究\n{deepresearch_agent.usage.summary()}")
+            return
+        
+        if not deepresearch_agent.owner_id:
+            # 旧版本创建的会话没有记录发起用户，由第一个恢复的用户接管
+            deepresearch_agent.owner_id = sender_id
+        
+        # 检查后立即标记为执行中，发送消息期间其他恢复请求不会通过检查
+        with self.deepresearch_sessions.active(deepresearch_agent):
+            yield event.plain_result(f"[系统] 已恢复深度研究会话: {session_id}, 当前阶段: {deepresearch_agent.stage}")
+            async for result in self._run_deepresearch(event, deepresearch_agent, f"研究会话已恢复，当前系统stage为: {deepresearch_agent.stage}, 请根据对话历史继续下一步操作", system_message=True):
+                yield result
+            
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("deepresearch_sessions")
+    async def deepresearch_sessions_stats(self, event: AstrMessageEvent):
+        """
+        查看内存中的深度研究会话
+        """
+        stats = self.deepresearch_sessions.stats()
+        lines = [
+            f"内存中的会话: {stats['count']}/{stats['max_sessions']}, "
+            f"内存占用: {stats['memory'] / 1024 / 1024:.2f}MB/{stats['max_total_bytes'] / 1024 / 1024:.0f}MB, "
+            f"载入: {stats['loads']}, 淘汰: {stats['evictions']}"
+        ]
+        for session in stats["sessions"]:
+            history = ", ".join(f"{name}: {count}" for name, count in session["history"].items())
+            lines.append(
+                f"{session['session_id']} [{session['stage']}{', 执行中' if session['active'] else ''}] "
+                f"{session['memory'] / 1024:.1f}KB, 空闲 {session['idle']:.0f}s, 历史消息 {history}, "
+                f"token {session['tokens']}, {session['turns']} 轮"
+            )
+        yield event.plain_result("\n".join(lines))
+            
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("knbot_stats")
+    async def knbot_stats(self, event: AstrMessageEvent, output_format: str = "json"):
+        """
+        查看插件运行指标，output_format 为 json 或 prometheus
+        """
+        components = self._collect_component_stats()
+        if output_format == "prometheus":
+            yield event.plain_result(self.metrics.to_prometheus(components))
+        else:
+            yield event.plain_result(self.metrics.to_json(components))
+            
+    def _collect_component_stats(self) -> dict:
+        """
+        收集各组件自身的统计数据
+        """
+        registry_stats = self.deepresearch_sessions.stats()
+        breakers = self.llm_caller.stats()
+        components = {
+            "render_scheduler": self.render_scheduler.stats(),
+            "render_cache": {
+                "entries": len(self.render_cache),
+                "size_bytes": self.render_cache.total_size,
+                "hits": self.render_cache.hits,
+                "misses": self.render_cache.misses,
+            },
+            "summary_cache": {
+                "hits": self.summary_cache.hits,
+                "misses": self.summary_cache.misses,
+                "coalesced": self.summary_cache.coalesced,
+            },
+            "web_fetcher": {
+                "entries": len(self.web_fetcher.cache),
+                "size_bytes": self.web_fetcher.cache.total_size,
+                "hits": self.web_fetcher.hits,
+                "revalidated": self.web_fetcher.revalidated,
+                "misses": self.web_fetcher.misses,
+                "stale": self.web_fetcher.stale,
+                "blocked": self.web_fetcher.blocked,
+            },
+            "deepresearch_sessions": {
+                key: registry_stats[key] for key in ("count", "memory", "loads", "evictions")
+            },
+            "llm": {
+                "breakers": breakers,
+                "open_breakers": sum(1 for state in breakers.values() if state != "closed"),
+            },
+            "llm_scheduler": self.llm_scheduler.stats(),
+        }
+        if self.browser_pool is not None:
+            components["browser_pool"] = self.browser_pool.stats()
+        return components
+            
+    def _load_deepresearch_agent(self, session_id: str) -> DeepResearchAgent:
+        """
+        从持久化存储中载入深度研究会话，会话不存在时返回None
+        """
+        # 完整对话历史不参与对话，需要时再从存储中读取
+        state = self.deepresearch_store.load(session_id, include_original=False)
+        if state is None:
+            return None
+        
+        tools = self.context.get_llm_tool_manager().get_func_desc_openai_style()
+        deepresearch_agent = self._create_deepresearch_agent(session_id, tools)
+        deepresearch_agent.load_state(state)
+        if deepresearch_agent.stage is None:
+            deepresearch_agent.stage = DeepResearchWorkStage.ASK
+        logger.info(f"从存储中载入深度研究会话: {session_id}, 当前阶段: {deepresearch_agent.stage}")
+        return deepresearch_agent
+        
+    def _get_fallback_providers(self) -> list:
+        """
+        按配置顺序获取备用Provider
+        """
+        fallback_ids = self.config.get("llm_call", {}).get("fallback_providers", [])
+        if not fallback_ids:
+            return []
+        
+        providers = {}
+        for provider in self.context.get_all_providers():
+            try:
+                providers[provider.meta().id] = provider
+            except Exception:
+                continue
+        return [providers[provider_id] for provider_id in fallback_ids if provider_id in providers]
+        
+    def _create_deepresearch_agent(self, session_id: str, tools: list) -> DeepResearchAgent:
+        return DeepResearchAgent(
+            session_id,
+            self.context.get_using_provider(),
+            tools,
+            compactor=self._create_context_compactor(),
+            store=self.deepresearch_store,
+            max_parse_retries=self.config.get("deepresearch", {}).get("max_parse_retries", 2),
+            llm_caller=self.llm_caller,
+            recorder=self.trajectory_recorder,
+        )
+        
+    def _create_stream_forwarder(self, event: AstrMessageEvent) -> StreamForwarder:
+        """
+        开启流式输出时，创建将生成中的内容转发到聊天的转发器
+        """
+        deepresearch_config = self.config.get("deepresearch", {})
+        if not deepresearch_config.get("stream_response", False):
+            return None
+        
+        async def send(text: str):
+            await event.send(MessageChain().message(text))
+        
+        return StreamForwarder(send, chunk_chars=deepresearch_config.get("stream_chunk_chars", 300))
+        
+    async def _run_deepresearch(self, event: AstrMessageEvent, deepresearch_agent: DeepResearchAgent, content: str,
+                                system_message: bool = False):
+        """
+        发送消息并执行深度研究，执行期间会话不会被移出内存
+        """
+        forwarder = self._create_stream_forwarder(event)
+        deepresearch_agent.user_id = event.get_sender_id()
+        with self.deepresearch_sessions.active(deepresearch_agent):
+            try:
+                response_json = await deepresearch_agent.call_llm(content, system_message=system_message, forwarder=forwarder)
+                async for result in self._deepresearch_loop(event, deepresearch_agent, response_json, forwarder):
+                    yield result
+            except LLMCallError as e:
+                logger.error(f"深度研究已暂停: {e}")
+                yield event.plain_result(f"[系统] 模型服务暂时不可用({e.kind})，研究已暂停，可以稍后使用 /deepresearch_resume {deepresearch_agent.session_id} 继续研究")
+            except DeepResearchError as e:
+                logger.error(f"深度研究已暂停: {e}")
+                yield event.plain_result(f"[系统] 模型回复多次无法解析，研究已暂停，可以使用 /deepresearch_resume {deepresearch_agent.session_id} 继续研究")
+            except Exception as e:
+                logger.exception(f"深度研究执行出错: {e}")
+                yield event.plain_result(f"[系统] 执行研究时出错({e})，研究已暂停，可以使用 /deepresearch_resume {deepresearch_agent.session_id} 继续研究")
+            
+            yield event.plain_result(f"[系统] 本会话累计用量: {deepresearch_agent.usage.summary()}")
+        
+    def _deepresearch_budget_exceeded(self, deepresearch_agent: DeepResearchAgent) -> str:
+        """
+        检查会话是否超出token或轮次预算，超出时返回原因
+        """
+        deepresearch_config = self.config.get("deepresearch", {})
+        return deepresearch_agent.usage.exceeded(
+            max_tokens=deepresearch_config.get("max_session_tokens", 500000),
+            max_turns=deepresearch_config.get("max_session_turns", 100),
+        )
+        
+    async def _deepresearch_loop(self, event: AstrMessageEvent, deepresearch_agent: DeepResearchAgent, response_json: dict,
+                                 forwarder: StreamForwarder = None):
+        """
+        执行深度研究动作循环，forwarder 已经转发的内容不再重复发送
+        """
+        def streamed(field: str) -> bool:
+            return forwarder is not None and forwarder.streamed(field)
+        
+        # 超出预算的原因，超出后只允许模型再回复一次总结
+        budget_reason = None
         
         while True:
             action = response_json.get("action")
+            
+            if budget_reason is None:
+                budget_reason = self._deepresearch_budget_exceeded(deepresearch_agent)
+                if budget_reason and action != "finished":
+                    deepresearch_agent.stage = DeepResearchWorkStage.FINISHED
+                    yield event.plain_result(f"[系统] 研究已达到{budget_reason}，正在总结已完成的工作")
+                    response_json = await deepresearch_agent.call_llm(
+                        f"研究已达到{budget_reason}，当前系统stage已经设置为: {deepresearch_agent.stage}。"
+                        "请不要再进行搜索、访问或调用工具，直接使用finished action总结目前已经完成的工作",
+                        system_message=True, forwarder=forwarder
+                    )
+                    continue
+            elif action != "finished":
+                yield event.plain_result(f"[系统] 研究已达到{budget_reason}，研究已结束")
+                break
+            
             if action == "ask":
                 think = response_json.get("think")
-                yield event.plain_result(f"[想法] {think}")
+                if not streamed("think"):
+                    yield event.plain_result(f"[想法] {think}")
                 question = response_json.get("question")
-                yield event.plain_result(f"{question}")
+                if not streamed("question"):
+                    yield event.plain_result(f"{question}")
                 
                 @session_waiter(timeout=300, record_history_chains=False)
                 async def do_ask(controller: SessionController, event: AstrMessageEvent):
                     next_input_result = event.message_str
                     nonlocal response_json
-                    response_json = await deepresearch_agent.call_llm(next_input_result)
+                    response_json = await deepresearch_agent.call_llm(next_input_result, forwarder=forwarder)
                     controller.stop()
                     
                 try:
                     await do_ask(event)
                 except TimeoutError as _:
-                    yield event.plain_result("[ask] 等待用户回答超时，如果需要恢复研究，请使用 session id 继续研究")
+                    yield event.plain_result("[ask] 等待用户回答超时，如果需要恢复研究，请使用 /deepresearch_resume 命令继续研究")
                     break
                 except Exception as e:
                     logger.error(f"执行ask动作时出错: {e}")
@@ -167,34 +608,37 @@ class KNBotEnhance(Star):
             elif action == "set_stage":
                 deepresearch_agent.stage = DeepResearchWorkStage.get_stage(response_json.get("stage"))
                 yield event.plain_result(f"[系统] 当前阶段已设置为: {deepresearch_agent.stage}")
-                response_json = await deepresearch_agent.call_llm(f"当前系统stage已经设置为: {deepresearch_agent.stage}, 请继续下一步操作", system_message=True)
+                response_json = await deepresearch_agent.call_llm(f"当前系统stage已经设置为: {deepresearch_agent.stage}, 请继续下一步操作", system_message=True, forwarder=forwarder)
                 
             elif action == "answer":
                 think = response_json.get("think")
                 answer = response_json.get("answer")
-                yield event.plain_result(f"[想法] {think}")
+                if not streamed("think"):
+                    yield event.plain_result(f"[想法] {think}")
                 
                 format_answer = ""
-                format_answer += answer
+                if not streamed("answer"):
+                    format_answer += answer
                 if response_json.get("reference"):
                     reference_index = 1
                     for item in response_json.get("reference"):
                         format_answer += f"\n\n# 参考来源：\n{reference_index}. {item.get('title')}\n{item.get('content')}\n{item.get('url')}\n\n"
                         reference_index += 1
                 
-                yield event.plain_result(f"{format_answer}")
+                if format_answer:
+                    yield event.plain_result(f"{format_answer}")
                 
                 @session_waiter(timeout=300, record_history_chains=False)
                 async def do_answer(controller: SessionController, event: AstrMessageEvent):
                     next_input_result = event.message_str
                     nonlocal response_json
-                    response_json = await deepresearch_agent.call_llm(next_input_result)
+                    response_json = await deepresearch_agent.call_llm(next_input_result, forwarder=forwarder)
                     controller.stop()
                     
                 try:
                     await do_answer(event)
                 except TimeoutError as _:
-                    yield event.plain_result("[answer] 等待用户回答超时，如果需要恢复研究，请使用 session id 继续研究")
+                    yield event.plain_result("[answer] 等待用户回答超时，如果需要恢复研究，请使用 /deepresearch_resume 命令继续研究")
                     break
                 except Exception as e:
                     logger.error(f"执行answer动作时出错: {e}")
@@ -204,26 +648,88 @@ class KNBotEnhance(Star):
                 research_topic_detail = response_json.get("research_topic")
                 deepresearch_agent.research_topic = research_topic_detail
                 yield event.plain_result(f"[系统] 当前研究主题已设置为:\n{research_topic_detail}")
-                response_json = await deepresearch_agent.call_llm(f"研究主题已设置，请继续下一步操作", system_message=True)
+                response_json = await deepresearch_agent.call_llm(f"研究主题已设置，请继续下一步操作", system_message=True, forwarder=forwarder)
                     
             elif action == "set_todo_list":
-                todo_list = response_json.get("todo_list")
-                for step in todo_list:
-                    deepresearch_agent.add_todo_list(step)
-                yield event.plain_result("[系统] 已设置Todo list:\n" + "\n".join([f"{i+1}. {item}" for i, item in enumerate(todo_list)]))
-                response_json = await deepresearch_agent.call_llm(f"Todo List已设置，请继续下一步操作", system_message=True)
+                todo_list = deepresearch_agent.set_todo_list(response_json.get("todo_list") or [])
+                yield event.plain_result("[系统] 已设置Todo list:\n" + "\n".join([f"{i+1}. {item['step']}" for i, item in enumerate(todo_list)]))
+                response_json = await deepresearch_agent.call_llm(
+                    f"Todo List已设置，当前Todo list:\n{json.dumps(deepresearch_agent.todo_list, ensure_ascii=False)}\n请继续下一步操作",
+                    system_message=True, forwarder=forwarder
+                )
                     
             elif action == "set_todo_status":
-                todo_id = response_json.get("id")
-                todo_status = response_json.get("status")
-                todo_reason = response_json.get("reason")
-                result = deepresearch_agent.set_todo_status(todo_id, todo_status, todo_reason)
-                if result:
-                    yield event.plain_result(f"[系统] 已设置Todo项状态: {todo_id} -> {todo_status}")
-                    response_json = await deepresearch_agent.call_llm(f"状态已设置，请继续下一步操作", system_message=True)
-                else:
-                    yield event.plain_result(f"[系统] 尝试设置Todo项状态，但设置失败: 未找到Todo项: {todo_id}")
-                    response_json = await deepresearch_agent.call_llm(f"设置状态失败: 未找到Todo项: {todo_id}，请确认id是否正确", system_message=True)
+                updates = response_json.get("updates")
+                if not isinstance(updates, list):
+                    updates = [response_json]
+                result = deepresearch_agent.set_todo_statuses([update for update in updates if isinstance(update, dict)])
+                
+                messages = []
+                if result["updated"]:
+                    updated = ", ".join(f"{todo['id']} -> {todo['status']}" for todo in result["updated"])
+                    yield event.plain_result(f"[系统] 已设置Todo项状态: {updated}")
+                    messages.append(f"已设置状态: {updated}")
+                if result["not_found"]:
+                    not_found = ", ".join(str(todo_id) for todo_id in result["not_found"])
+                    yield event.plain_result(f"[系统] 尝试设置Todo项状态，但设置失败: 未找到Todo项: {not_found}")
+                    messages.append(f"设置状态失败: 未找到Todo项: {not_found}，请确认id是否正确")
+                if result["invalid"]:
+                    invalid = ", ".join(str(todo_id) for todo_id in result["invalid"])
+                    messages.append(f"设置状态失败: Todo项 {invalid} 的状态无效，状态只能是队列中、进行中、已完成、执行失败")
+                if not messages:
+                    messages.append("没有需要设置的Todo项")
+                    
+                messages.append(f"当前Todo list:\n{json.dumps(deepresearch_agent.todo_list, ensure_ascii=False)}\n请继续下一步操作")
+                response_json = await deepresearch_agent.call_llm("\n".join(messages), system_message=True, forwarder=forwarder)
+                
+            elif action == "get_todo_list":
+                # 直接从会话状态返回，不需要调用工具
+                response_json = await deepresearch_agent.call_llm(json.dumps(deepresearch_agent.todo_list, ensure_ascii=False), system_message=True, forwarder=forwarder)
+                
+            elif action == "get_research_topic":
+                research_topic = deepresearch_agent.research_topic or "尚未设置研究主题"
+                response_json = await deepresearch_agent.call_llm(research_topic, system_message=True, forwarder=forwarder)
+                    
+            elif action == "tool_use":
+                think = response_json.get("think")
+                if not streamed("think"):
+                    yield event.plain_result(f"[想法] {think}")
+                tool_calls = response_json.get("tool_use") or []
+                yield event.plain_result("[系统] 正在调用工具: " + ", ".join(tool_call_name(tool_call) for tool_call in tool_calls))
+                results = await self.tool_executor.run_tool_use(event, tool_calls)
+                response_json = await deepresearch_agent.call_llm(json.dumps(results, ensure_ascii=False), system_message=True, forwarder=forwarder)
+                
+            elif action == "search":
+                think = response_json.get("think")
+                if not streamed("think"):
+                    yield event.plain_result(f"[想法] {think}")
+                keywords = response_json.get("search_request") or []
+                yield event.plain_result("[系统] 正在搜索: " + ", ".join(str(keyword) for keyword in keywords))
+                results = await self.tool_executor.run_search(event, keywords)
+                response_json = await deepresearch_agent.call_llm(json.dumps(results, ensure_ascii=False), system_message=True, forwarder=forwarder)
+                
+            elif action == "visit":
+                think = response_json.get("think")
+                if not streamed("think"):
+                    yield event.plain_result(f"[想法] {think}")
+                urls = response_json.get("urls")
+                if isinstance(urls, str):
+                    urls = [urls]
+                elif not isinstance(urls, list):
+                    urls = [response_json.get("url")]
+                urls = [url for url in urls if isinstance(url, str) and url]
+                yield event.plain_result("[系统] 正在访问: " + ", ".join(urls))
+                results = await self.web_fetcher.fetch_many(urls)
+                response_json = await deepresearch_agent.call_llm(json.dumps(results, ensure_ascii=False), system_message=True, forwarder=forwarder)
+                    
+            elif action == "finished":
+                think = response_json.get("think")
+                if not streamed("think"):
+                    yield event.plain_result(f"[想法] {think}")
+                yield event.plain_result(response_json.get("result"))
+                if deepresearch_agent.stage != DeepResearchWorkStage.FINISHED:
+                    deepresearch_agent.stage = DeepResearchWorkStage.FINISHED
+                break
                     
             else:
                 logger.error(f"未知动作: {action}")
@@ -232,19 +738,67 @@ class KNBotEnhance(Star):
         
         yield event.plain_result("[调试] deepresearch 结束")
             
+    def _create_context_compactor(self) -> ContextCompactor:
+        deepresearch_config = self.config.get("deepresearch", {})
+        return ContextCompactor(
+            stage_budgets={
+                DeepResearchWorkStage.ASK: deepresearch_config.get("ask_context_tokens", 8000),
+                DeepResearchWorkStage.PLANNING: deepresearch_config.get("planning_context_tokens", 12000),
+                DeepResearchWorkStage.EXECUTE: deepresearch_config.get("execute_context_tokens", 24000),
+                DeepResearchWorkStage.FINISHED: deepresearch_config.get("finished_context_tokens", 16000),
+            },
+            keep_recent=deepresearch_config.get("context_keep_recent", 8),
+            max_message_tokens=deepresearch_config.get("context_max_message_tokens", 2000),
+        )
+
     async def _generate_topic_summary(self, text: str) -> str:
         """
         生成会话总结
         """
-        response = await self.context.get_using_provider().text_chat(
+        return await self.summary_cache.get_or_generate(text, self._call_topic_summary_llm)
+
+    async def _call_topic_summary_llm(self, text: str) -> str:
+        response = await self.llm_caller.text_chat(
+            self.context.get_using_provider(),
+            priority=LLMPriority.SUMMARY,
             prompt=text,
             system_prompt=SUMMARY_PROMPT,
         )
-        return response.completion_text
+        return response.completion_text.strip()
 
-    async def _text_to_markdown_image(self, text: str, generate_topic_summary: bool = False, title: str = None) -> str:
+    async def _wait_topic_summary(self, text: str, summary_task: asyncio.Task) -> tuple:
+        """
+        等待话题总结，超过时限或生成失败时使用本地提取的标题
+
+        返回 (标题, 是否使用了本地提取的标题)
+        """
+        timeout = self.config.get("markdown_image_generate", {}).get("topic_summary_timeout", 5)
+        try:
+            # shield 保证超时后总结仍在后台完成并写入缓存
+            summary = await asyncio.wait_for(asyncio.shield(summary_task), timeout=timeout if timeout and timeout > 0 else None)
+            if summary:
+                return summary, False
+        except asyncio.TimeoutError:
+            logger.info(f"生成话题总结超过 {timeout}s，使用本地提取的标题")
+        except Exception as e:
+            logger.warning(f"生成话题总结失败: {e}")
+        return heuristic_title(text), True
+
+    @staticmethod
+    def _image_output_options(image_config: dict) -> dict:
+        return {
+            "image_format": image_config.get("image_format", "png"),
+            "quality": image_config.get("image_quality", 85),
+            "max_height": image_config.get("max_image_height", 0),
+            "max_bytes": image_config.get("max_image_size_kb", 0) * 1024,
+            "device_scale_factor": image_config.get("device_scale_factor", 1),
+        }
+
+    async def _text_to_markdown_image(self, text: str, generate_topic_summary: bool = False, title: str = None) -> List[str]:
         """
         将 Markdown 文本转换为带有样式的图片（使用模板文件）
+
+        返回图片路径列表，页面过长时会切分为多张图片
         """
         try:
             image_config = self.config.get("markdown_image_generate", {})
@@ -252,38 +806,144 @@ class KNBotEnhance(Star):
             if not width:
                 width = 1600
 
-            # 生成完整 HTML
-            json_encoded_text = json.dumps(text)
-            full_html = self.markdown_html_template.render(
-                json_text="const markdownInput = " + json_encoded_text + ";",
-                topic_summary= title if title else await self._generate_topic_summary(text) if generate_topic_summary else "KNBot Enhance"
+            # 查找渲染缓存，需要生成总结时以固定标记代替标题，避免命中缓存前调用LLM
+            if title:
+                title_key = title
+            elif generate_topic_summary:
+                title_key = "\x00topic_summary"
+            else:
+                title_key = "KNBot Enhance"
+            output_options = self._image_output_options(image_config)
+            use_light = self._use_light_renderer(text)
+            cache_key = RenderCache.make_key(
+                text, width, self.markdown_template_version, title_key,
+                json.dumps({**output_options, "renderer": "light" if use_light else "browser"}, sort_keys=True),
             )
+            renderer = "light" if use_light else "browser"
+            cached_paths = self.render_cache.get(cache_key)
+            if cached_paths:
+                logger.debug(f"命中Markdown渲染缓存: {cached_paths}")
+                self.metrics.inc("render_cache_requests_total", result="hit")
+                return cached_paths
+            self.metrics.inc("render_cache_requests_total", result="miss")
 
-            # 文件保存路径
-            output_dir = os.path.join(os.getcwd(), "data", "temp")
-            os.makedirs(output_dir, exist_ok=True)
-            file_name = f"{hashlib.md5(full_html.encode('utf-8')).hexdigest()}.png"
-            output_path = os.path.join(output_dir, file_name)
-            
-            with open(f"{output_path}.txt", "w", encoding="utf-8") as f:
-                f.write(text)
-            with open(f"{output_path}.html", "w", encoding="utf-8") as f:
-                f.write(full_html)
-
-            # 使用 Playwright 截图
-            async with async_playwright() as p:
-                browser = await p.chromium.launch()
-                page = await browser.new_page()
-                try:
-                    await page.set_viewport_size({"width": width, "height": 800})
-                    await page.set_content(full_html, wait_until="networkidle")
-
-                    # 截图
-                    await page.screenshot(path=output_path, full_page=True, type="png")
-                finally:
-                    await page.close()
-                    await browser.close()
-            return output_path
+            render_func = self._render_markdown_image_light if use_light else self._render_markdown_image
+            with self.metrics.timer("render_seconds", renderer=renderer):
+                # 在排队渲染前等待话题总结，避免等待期间占用渲染名额和浏览器页面
+                topic_summary, cacheable = await self._resolve_topic_summary(text, title, generate_topic_summary)
+                # 通过调度器排队渲染，相同内容的请求合并，过载时返回None保留原文本
+                image_paths = await self.render_scheduler.submit(
+                    cache_key,
+                    lambda: render_func(text, cache_key, width, topic_summary, cacheable, output_options),
+                )
+            if image_paths is None:
+                self.metrics.inc("render_rejected_total")
+            return image_paths
         except Exception as e:
             logger.error(f"生成Markdown图片时出错: {e}")
+            self.metrics.inc("render_errors_total")
             return None
+
+    def _use_light_renderer(self, text: str) -> bool:
+        """
+        是否使用轻量渲染器，auto 模式下只有包含表格、公式、图表或代码块时才使用浏览器
+        """
+        renderer = self.config.get("markdown_image_generate", {}).get("renderer", "auto")
+        if renderer == "browser" or not self.light_renderer.available:
+            return False
+        if renderer == "light":
+            return True
+        return not requires_browser(text)
+
+    async def _resolve_topic_summary(self, text: str, title: str, generate_topic_summary: bool) -> tuple:
+        """
+        获取图片标题，返回 (标题, 渲染结果是否写入缓存)
+
+        话题总结超时或失败时使用本地提取的标题，渲染结果不写入缓存，
+        总结在后台生成完毕后再次请求时重新渲染
+        """
+        if title:
+            return title, True
+        if generate_topic_summary:
+            summary_task = asyncio.ensure_future(self._generate_topic_summary(text))
+            with self.metrics.timer("render_phase_seconds", phase="topic_summary"):
+                topic_summary, fallback = await self._wait_topic_summary(text, summary_task)
+            return topic_summary, not fallback
+        return "KNBot Enhance", True
+
+    def _save_rendered_images(self, cache_key: str, images: list, cacheable: bool = True) -> List[str]:
+        """
+        写入渲染结果并登记到缓存，cacheable 为 False 时(渲染效果不完整)只写入临时文件，不登记到缓存
+        """
+        with self.metrics.timer("render_phase_seconds", phase="save"):
+            output_paths = [
+                self.render_cache.write_image(cache_key, index, len(images), extension, data, transient=not cacheable)
+                for index, (data, extension) in enumerate(images)
+            ]
+            if cacheable:
+                self.render_cache.put(cache_key, output_paths)
+            else:
+                self.metrics.inc("render_uncached_total")
+        for data, extension in images:
+            self.metrics.observe("render_output_bytes", len(data), buckets=BYTES_BUCKETS, format=extension)
+        return output_paths
+
+    async def _render_markdown_image_light(self, text: str, cache_key: str, width: int, topic_summary: str, cacheable: bool, output_options: dict) -> List[str]:
+        """
+        使用轻量渲染器渲染 Markdown 图片并写入缓存
+        """
+        def render() -> list:
+            image = self.light_renderer.render(text, topic_summary, width, output_options["device_scale_factor"])
+            return encode_image(image, **output_options)
+
+        with self.metrics.timer("render_phase_seconds", phase="light_render"):
+            images = await asyncio.to_thread(render)
+        return self._save_rendered_images(cache_key, images, cacheable)
+
+    async def _render_markdown_image(self, text: str, cache_key: str, width: int, topic_summary: str, cacheable: bool, output_options: dict) -> List[str]:
+        """
+        使用浏览器渲染 Markdown 图片并写入缓存
+        """
+        image_config = self.config.get("markdown_image_generate", {})
+
+        # 使用常驻浏览器池中的页面截图
+        if self.browser_pool is None:
+            self.browser_pool = self._create_browser_pool()
+        async with self.browser_pool.page() as page:
+            await page.set_viewport_size({"width": width, "height": 800})
+
+            # 生成完整 HTML
+            with self.metrics.timer("render_phase_seconds", phase="template"):
+                json_encoded_text = json.dumps(text)
+                full_html = self.markdown_html_template.render(
+                    json_text="const markdownInput = " + json_encoded_text + ";",
+                    topic_summary=topic_summary
+                )
+
+            # 调试用的原文本和HTML文件
+            if image_config.get("save_debug_files", False):
+                self.render_cache.write_side_file(cache_key, "txt", text)
+                self.render_cache.write_side_file(cache_key, "html", full_html)
+
+            # 资源仍在后台下载时页面缺少部分资源，渲染结果不写入缓存，下载完成后再次请求时重新渲染
+            cacheable = cacheable and self.asset_bundle.complete
+
+            # 资源由资源包从内存提供，无需等待网络空闲，由页面自身标记渲染完成
+            with self.metrics.timer("render_phase_seconds", phase="set_content"):
+                await page.set_content(full_html, wait_until="load")
+            try:
+                with self.metrics.timer("render_phase_seconds", phase="wait_render"):
+                    await page.wait_for_function(
+                        "window.knbotRenderDone === true",
+                        timeout=image_config.get("render_timeout", 15) * 1000,
+                    )
+            except PlaywrightTimeoutError:
+                logger.warning("等待Markdown渲染完成超时，将直接截图")
+                self.metrics.inc("render_timeouts_total")
+                cacheable = False
+
+            # 截图
+            with self.metrics.timer("render_phase_seconds", phase="screenshot"):
+                images = await capture_page_images(page, width, **output_options)
+
+        return self._save_rendered_images(cache_key, images, cacheable)
@@ -0,0 +1,77 @@
+import re
+
+from .enums import RenderMode
+
+
+# 表格分隔行，如 |---|:---:| 或 |-|-|
+_TABLE_SEPARATOR_RE = re.compile(r"^[ \t]*\|?[ \t]*:?-+:?[ \t]*(?:\|[ \t]*:?-+:?[ \t]*)+\|?[ \t]*$", re.M)
+# 代码块起始行，捕获语言标记
+_CODE_FENCE_RE = re.compile(r"^[ \t]*(?:```|~~~)[ \t]*([\w+-]*)", re.M)
+_MERMAID_FENCE_RE = re.compile(r"^[ \t]*(?:```|~~~)[ \t]*mermaid", re.M | re.I)
+# 块级公式 $$...$$ 以及 \[...\]
+_BLOCK_MATH_RE = re.compile(r"\$\$.+?\$\$|\\\[.+?\\\]", re.S)
+# 行内公式 $...$，排除 "$5 和 $10" 这类金额
+_INLINE_MATH_RE = re.compile(r"(?<![\\$\w])\$(?=\S)[^$\n]+?(?<=\S)\$(?![\w$])")
+_HEADING_RE = re.compile(r"^#{1,6}[ \t]", re.M)
+_LIST_RE = re.compile(r"^[ \t]*(?:[-*+]|\d+[.)])[ \t]", re.M)
+_QUOTE_RE = re.compile(r"^[ \t]*>", re.M)
+_EMPHASIS_RE = re.compile(r"\*\*[^*\n]+\*\*|__[^_\n]+__|`[^`\n]+`|\[[^\]\n]+\]\([^)\n]+\)")
+
+
+def _has_rich_content(text: str) -> bool:
+    """
+    是否包含表格、公式或 mermaid 图表
+
+    先用子串判断排除不可能匹配的规则，再使用正则确认，找到第一个匹配即返回
+    """
+    return bool(
+        ("|" in text and "-" in text and _TABLE_SEPARATOR_RE.search(text))
+        or (("$" in text or "\\[" in text) and (_BLOCK_MATH_RE.search(text) or _INLINE_MATH_RE.search(text)))
+        or (("```" in text or "~~~" in text) and _MERMAID_FENCE_RE.search(text))
+    )
+
+
+def _has_code_block(text: str) -> bool:
+    return bool(("```" in text or "~~~" in text) and _CODE_FENCE_RE.search(text))
+
+
+def requires_browser(text: str) -> bool:
+    """
+    是否需要浏览器才能正确渲染(表格、公式、mermaid 图表及需要高亮的代码块)
+    """
+    return _has_rich_content(text) or _has_code_block(text)
+
+
+def decide_render_mode(text: str, trigger_count: int, plain_text_max_count: int = 1000) -> RenderMode:
+    """
+    根据文本长度和 Markdown 结构决定渲染方式
+
+    - 包含表格、公式或 mermaid 图表: 以纯文本显示效果很差，无论长短都使用浏览器渲染
+    - 超过触发字数且包含代码块: 需要代码高亮，使用浏览器渲染
+    - 超过触发字数且包含标题、列表等简单格式: 轻量渲染
+    - 没有任何格式的纯文本: 超过 plain_text_max_count 时轻量渲染，否则直接发送
+    """
+    if not text or len(text) < 8:
+        return RenderMode.PLAIN
+
+    if _has_rich_content(text):
+        return RenderMode.BROWSER
+
+    if len(text) <= trigger_count:
+        return RenderMode.PLAIN
+
+    if _has_code_block(text):
+        return RenderMode.BROWSER
+
+    if (
+        ("#" in text and _HEADING_RE.search(text))
+        or _LIST_RE.search(text)
+        or (">" in text and _QUOTE_RE.search(text))
+        or _EMPHASIS_RE.search(text)
+    ):
+        return RenderMode.LIGHT
+
+    if len(text) > plain_text_max_count:
+        return RenderMode.LIGHT
+
+    return RenderMode.PLAIN
@@ -0,0 +1,225 @@
+import bisect
+import json
+import time
+
+
+# 耗时直方图的桶上限(秒)
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# 大小直方图的桶上限(字节)
+BYTES_BUCKETS = (16 * 1024, 64 * 1024, 256 * 1024, 512 * 1024, 1024 * 1024, 2 * 1024 * 1024, 5 * 1024 * 1024, 10 * 1024 * 1024)
+
+
+class Histogram:
+    """
+    固定分桶的直方图，记录各桶的数量、总和及最大值
+    """
+    def __init__(self, buckets: tuple = TIME_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        # 最后一个桶为 +Inf
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        """
+        按桶估算分位数，返回所在桶的上限，落在 +Inf 桶时返回最大值
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        total = 0
+        for index, count in enumerate(self.counts):
+            total += count
+            if total >= rank:
+                return self.buckets[index] if index < len(self.buckets) else self.max
+        return self.max
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "avg": self.sum / self.count if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "max": self.max,
+        }
+
+
+class _Timer:
+    def __init__(self, metrics: "Metrics", name: str, labels: tuple):
+        self._metrics = metrics
+        self._name = name
+        self._labels = labels
+        self._start = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._metrics._observe(self._name, self._labels, time.perf_counter() - self._start, TIME_BUCKETS)
+        return False
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: tuple, extra: dict = None) -> str:
+    items = list(labels) + list((extra or {}).items())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape_label(value)}"' for key, value in items) + "}"
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+class Metrics:
+    """
+    插件运行指标
+
+    记录计数器和直方图，支持标签，可导出为JSON或Prometheus文本格式。
+    未启用时所有记录方法直接返回，timer 返回共享的空计时器，几乎没有额外开销。
+    """
+    def __init__(self, enabled: bool = True, prefix: str = "knbot"):
+        self.enabled = enabled
+        self._prefix = prefix
+
+        # (名称, 标签) -> 数值
+        self._counters: dict = {}
+
+        # (名称, 标签) -> Histogram
+        self._histograms: dict = {}
+
+        self._started_at = time.time()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """
+        计数器增加
+        """
+        if not self.enabled:
+            return
+        key = (name, _label_key(labels))
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, buckets: tuple = TIME_BUCKETS, **labels):
+        """
+        记录一次观测值，直方图的分桶在首次记录时确定
+        """
+        if not self.enabled:
+            return
+        self._observe(name, _label_key(labels), value, buckets)
+
+    def _observe(self, name: str, labels: tuple, value: float, buckets: tuple):
+        key = (name, labels)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = Histogram(buckets)
+        histogram.observe(value)
+
+    def timer(self, name: str, **labels):
+        """
+        记录代码块耗时(秒)的上下文管理器
+        """
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name, _label_key(labels))
+
+    def reset(self):
+        self._counters.clear()
+        self._histograms.clear()
+        self._started_at = time.time()
+
+    def snapshot(self) -> dict:
+        """
+        获取所有指标，返回 {"uptime", "counters": {名称: [{"labels", "value"}]}, "histograms": {名称: [{"labels", ...}]}}
+        """
+        counters = {}
+        for (name, labels), value in sorted(self._counters.items()):
+            counters.setdefault(name, []).append({"labels": dict(labels), "value": value})
+        histograms = {}
+        for (name, labels), histogram in sorted(self._histograms.items(), key=lambda item: item[0]):
+            histograms.setdefault(name, []).append({"labels": dict(labels), **histogram.snapshot()})
+        return {
+            "enabled": self.enabled,
+            "uptime": time.time() - self._started_at,
+            "counters": counters,
+            "histograms": histograms,
+        }
+
+    def to_json(self, extra: dict = None) -> str:
+        """
+        导出为JSON，extra 为其他组件的统计数据
+        """
+        data = self.snapshot()
+        if extra:
+            data["components"] = extra
+        return json.dumps(data, ensure_ascii=False, indent=2, default=str)
+
+    def to_prometheus(self, extra: dict = None) -> str:
+        """
+        导出为Prometheus文本格式，extra 中的数值作为 gauge 导出，名称为 <前缀>_<组件>_<字段>
+        """
+        lines = []
+        typed = set()
+
+        def add_type(metric: str, kind: str):
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} {kind}")
+
+        for (name, labels), value in sorted(self._counters.items()):
+            metric = f"{self._prefix}_{name}"
+            add_type(metric, "counter")
+            lines.append(f"{metric}{_format_labels(labels)} {_format_value(value)}")
+
+        for (name, labels), histogram in sorted(self._histograms.items(), key=lambda item: item[0]):
+            metric = f"{self._prefix}_{name}"
+            add_type(metric, "histogram")
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f"{metric}_bucket{_format_labels(labels, {'le': _format_value(bound)})} {cumulative}")
+            lines.append(f"{metric}_bucket{_format_labels(labels, {'le': '+Inf'})} {histogram.count}")
+            lines.append(f"{metric}_sum{_format_labels(labels)} {_format_value(histogram.sum)}")
+            lines.append(f"{metric}_count{_format_labels(labels)} {histogram.count}")
+
+        for component, stats in (extra or {}).items():
+            for field, value in stats.items():
+                if not isinstance(value, (int, float)):
+                    continue
+                metric = f"{self._prefix}_{component}_{field}"
+                add_type(metric, "gauge")
+                lines.append(f"{metric} {_format_value(value)}")
+
+        return "\n".join(lines) + "\n"
@@ -107,6 +107,23 @@ DEEPRESEARCH_ACTIONS = """
 
 下面是你可以执行的actions，每次**选择一个**执行，禁止同时执行多个action:
 <actions>
+{{actions}}
+</actions>
+
+action结构说明：
+{
+    "action_name": "action的名称",
+    "description": "action的描述",
+    "stage": "允许使用该action的stage的列表",
+    "action_call_format": "你需要严格遵守的回答格式，不同action的回答格式要求可能有所不同",
+    "next_input": "执行该action后得到的返回内容描述或结构或调用失败时的错误信息，不同action的next_input结构可能有所不同"
+}
+
+"""
+
+# 可执行的actions，按 "stage" 字段筛选当前阶段可用的action后填入 {{actions}}
+DEEPRESEARCH_ACTION_ITEMS = [
+"""
 {
     "action_name": "ask",
     "description": "向用户提问。如果你认为用户输入的信息有不明确的地方，可以向用户提问，获取更多信息。在确认信息足够充足前，可以使用该action进行提问，要求用户补充细节，但不要过度提问。",
@@ -118,6 +135,8 @@ DEEPRESEARCH_ACTIONS = """
     },
     "next_input": "用户对你提问的进一步补充"
 }
+""",
+"""
 {
     "action_name": "answer",
     "description": "回答用户的问题，或告知用户你想让用户知道的信息。不要回答不确定内容。**不要主动回答用户没有问到的问题**。内容必须是一个确定的结论。始终在回答最后引导用户进行下一步要求。",
@@ -136,6 +155,8 @@ DEEPRESEARCH_ACTIONS = """
     },
     "next_input": "用户的进一步提问或要求"
 }
+""",
+"""
 {
     "action_name": "set_research_topic",
     "description": "在确定有一个明确的目标后，设置当前任务的研究主题摘要和你对研究目标的详细分析。该内容没有篇幅的限制，越详细越好。",
@@ -146,6 +167,8 @@ DEEPRESEARCH_ACTIONS = """
     },
     "next_input": "返回成功或错误信息"
 }
+""",
+"""
 {
     "action_name": "get_research_topic",
     "description": "获取当前任务的研究主题摘要",
@@ -155,20 +178,25 @@ DEEPRESEARCH_ACTIONS = """
     },
     "next_input": "研究主题的详细内容"
 }
+""",
+"""
 {
     "action_name": "set_todo_list",
-    "description": "在有一个明确的目标后，设置当前任务的详细Todo list, 步骤不要带序号",
+    "description": "在有一个明确的目标后，设置当前任务的详细Todo list, 步骤不要带序号。如果某个步骤需要在其他步骤完成后才能进行，可以使用对象格式并在depends_on中填写所依赖步骤在列表中的序号(从1开始，只能依赖排在前面的步骤)",
     "stage": ["PLANNING"],
     "action_call_format": {
         "action": "set_todo_list",
         "todo_list": [
             "TODO步骤1",
             "TODO步骤2",
+            {"step": "依赖步骤1和步骤2的TODO步骤3", "depends_on": [1, 2]},
             ...
         ]
     },
-    "next_input": "返回成功或错误信息"
+    "next_input": "返回成功或错误信息，以及当前的Todo list(格式同get_todo_list)"
 }
+""",
+"""
 {
     "action_name": "get_todo_list",
     "description": "获取当前任务的Todo list",
@@ -181,11 +209,15 @@ DEEPRESEARCH_ACTIONS = """
             "id": "Todo list的步骤的唯一标识，可以用于修改Todo状态",
             "step": "Todo list的步骤",
             "status": "该步骤的状态，包括队列中、进行中、已完成、执行失败",
-            "reason": "该步骤完成或未完成的原因，如果处于队列中或进行中状态，该项为空"
+            "reason": "该步骤完成或未完成的原因，如果处于队列中或进行中状态，该项为空",
+            "depends_on": "该步骤依赖的Todo项id列表，没有依赖时不包含该项",
+            "blocked_by": "依赖项中尚未完成的Todo项id列表，全部完成时不包含该项"
         }
         ...
     ]
 }
+""",
+"""
 {
     "action_name": "set_stage",
     "description": "设置当前任务的阶段，可以设置为ASK、PLANNING、EXECUTE、FINISHED",
@@ -196,18 +228,27 @@ DEEPRESEARCH_ACTIONS = """
     },
     "next_input": "返回成功或错误信息"
 }
+""",
+"""
 {
     "action_name": "set_todo_status",
-    "description": "设置指定Todo项状态",
+    "description": "设置Todo项状态，可以一次设置多个Todo项的状态",
     "stage": ["PLANNING", "EXECUTE", "FINISHED"],
     "action_call_format": {
         "action": "set_todo_status",
-        "id": "Todo list的步骤的唯一标识，可以用于修改Todo状态",
-        "status": "该步骤的状态，包括队列中、进行中、已完成、执行失败",
-        "reason": "该步骤完成或未完成的原因，如果处于队列中或进行中状态，该项为空"
+        "updates": [
+            {
+                "id": "Todo list的步骤的唯一标识，可以用于修改Todo状态",
+                "status": "该步骤的状态，包括队列中、进行中、已完成、执行失败",
+                "reason": "该步骤完成或未完成的原因，如果处于队列中或进行中状态，该项为空"
+            },
+            ...
+        ]
     },
-    "next_input": "返回成功或错误信息"
+    "next_input": "返回成功或错误信息，以及当前的Todo list(格式同get_todo_list)"
 }
+""",
+"""
 {
     "action_name": "finished",
     "description": "工作结束，向用户展示你的工作成果，并告知用户你已经完成的内容和完成结果。",
@@ -220,6 +261,8 @@ DEEPRESEARCH_ACTIONS = """
     },
     "next_input": "用户的进一步提问或要求"
 }
+""",
+"""
 {
     "action_name": "tool_use",
     "description": "使用工具，可以一次进行多个工具的调用，工具调用结果会一次性返回",
@@ -246,12 +289,14 @@ DEEPRESEARCH_ACTIONS = """
             }
         ]
     },
-    "next_input": { // 工具名称的调用结果，以字典的方式返回(即使只调用了一个工具)，字典的key为工具名称，value为工具的调用结果结构
+    "next_input": { // 工具名称的调用结果，以字典的方式返回(即使只调用了一个工具)，字典的key为工具名称(同一工具多次调用时为 工具名称#序号)，value为工具的调用结果结构或错误信息
         "工具名称1": "工具名称1的调用结果结构",
         "工具名称2": "工具名称2的调用结果结构",
         ...
     }
 }
+""",
+"""
 {
     "action_name": "search",
     "description": "从互联网上搜索信息",
@@ -259,17 +304,18 @@ DEEPRESEARCH_ACTIONS = """
     "action_call_format": {
         "action": "search",
         "think": "简单总结搜索的思考过程，你有怎样的问题需要进行搜索，控制在50字以内",
-        "search_request": ["关键词1", "关键词2", ...]
+        "search_request": ["关键词1", "关键词2", ...] // 多个关键词会同时搜索
     },
     "next_input": [
         {
-            "url": "搜索结果的url",
-            "title": "搜索结果的标题",
-            "content": "搜索结果的内容"
+            "keyword": "搜索关键词",
+            "result": "该关键词的搜索结果，搜索失败时为错误信息"
         }
         ...
     ]
 }
+""",
+"""
 {
     "action_name": "write_file",
     "description": "写入指定文本内容到文件，只能写入文本内容，包括代码、文档或其他需要写入到文件的内容等",
@@ -280,30 +326,29 @@ DEEPRESEARCH_ACTIONS = """
         "content": "需要保存的文件内容，可以是代码或文档等文本内容"
     }
 }
+""",
+"""
 {
     "action_name": "visit", 
-    "description": "获取指定url内容",
+    "description": "获取指定url内容，可以一次获取多个url",
     "stage": ["ASK", "PLANNING", "EXECUTE", "FINISHED"],
     "action_call_format": {
         "action": "visit",
         "think": "简单总结获取指定url内容的思考过程，你为什么想获取这个url的内容，这个内容可能对你有什么帮助，控制在50字以内",
-        "url": "url"
+        "urls": ["url1", "url2", ...]
     },
-    "next_input": "获取指定url内容的返回结果"
-}
-{{actions}}
-</actions>
-
-action结构说明：
-{
-    "action_name": "action的名称",
-    "description": "action的描述",
-    "stage": "允许使用该action的stage的列表",
-    "action_call_format": "你需要严格遵守的回答格式，不同action的回答格式要求可能有所不同",
-    "next_input": "执行该action后得到的返回内容描述或结构或调用失败时的错误信息，不同action的next_input结构可能有所不同"
+    "next_input": [
+        {
+            "url": "url",
+            "title": "网页标题",
+            "content": "网页的正文文本，获取失败时没有该项",
+            "error": "获取失败时的错误信息"
+        }
+        ...
+    ]
 }
-
 """
+]
 
 DEEPRESEARCH_TOOLS = """
 
@@ -0,0 +1,398 @@
+import asyncio
+import hashlib
+import os
+import re
+import time
+import uuid
+from collections import OrderedDict
+
+from astrbot.api import logger
+
+
+# 缓存中的图片扩展名
+IMAGE_SUFFIXES = (".png", ".jpg", ".webp")
+
+# 写入中的临时文件标记
+TEMP_FILE_MARK = ".tmp-"
+
+# 不登记到缓存的渲染结果(如资源不完整时的渲染)所在的子目录，文件发送后由定时清理删除
+TRANSIENT_DIR = "transient"
+
+# 不登记到缓存的渲染文件和已淘汰的缓存文件保留时间(秒)，等待平台适配器发送完成
+TRANSIENT_FILE_AGE = 600
+
+# 旧版本直接保存在 data/temp 下的渲染文件: <md5>.png / <md5>.png.txt / <md5>.png.html
+LEGACY_ARTIFACT_PATTERN = re.compile(r"^([0-9a-f]{32})\.png(\.txt|\.html)?$")
+
+# 旧版本模板渲染后的HTML中包含的脚本
+LEGACY_TEMPLATE_MARKER = b"const markdownInput = "
+
+
+def write_atomic(path: str, data):
+    """
+    原子写入文件，先写入同目录下的临时文件再替换，读取方不会看到写入一半的文件
+    """
+    tmp_path = f"{path}{TEMP_FILE_MARK}{uuid.uuid4().hex[:8]}"
+    mode = "w" if isinstance(data, str) else "wb"
+    encoding = "utf-8" if isinstance(data, str) else None
+    try:
+        with open(tmp_path, mode, encoding=encoding) as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class RenderCache:
+    """
+    Markdown 图片渲染结果缓存及文件生命周期管理
+
+    以 (Markdown文本, 宽度, 模板版本, 标题, 输出选项) 的哈希作为文件名保存渲染结果，
+    文件按 key 的前两位分散到子目录中，一次渲染可能切分为多张图片，
+    文件名为 `<key>.<ext>` 或 `<key>.<序号>.<ext>`。
+    按最近使用时间进行 LRU 淘汰，限制缓存目录的总大小、缓存项数量和保存时长。
+    淘汰的缓存项立即从索引中移除，文件在 TRANSIENT_FILE_AGE 后由定时清理删除，
+    避免刚通过 get 返回、尚未发送的图片被删除。
+    """
+    def __init__(self, cache_dir: str, max_size_mb: int = 200, max_entries: int = 2000, max_age_hours: float = 0):
+        self._cache_dir = cache_dir
+        self._max_size = max(1, max_size_mb) * 1024 * 1024
+        self._max_entries = max(1, max_entries)
+
+        # 缓存项最长保留时间(秒)，0为不限制
+        self._max_age = max(0, max_age_hours) * 3600
+
+        # key -> (图片路径列表, 文件大小(包括附属文件), 最近使用时间)，按最近使用顺序排列
+        self._index: OrderedDict = OrderedDict()
+        self._total_size = 0
+
+        # 等待删除的已淘汰文件: 路径 -> 淘汰时间
+        self._pending_removal: dict = {}
+
+        self.hits = 0
+        self.misses = 0
+
+        self._sweeper_task: asyncio.Task = None
+
+        os.makedirs(self._cache_dir, exist_ok=True)
+        self._load_index()
+
+    @property
+    def cache_dir(self) -> str:
+        return self._cache_dir
+
+    @property
+    def total_size(self) -> int:
+        return self._total_size
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    @staticmethod
+    def make_key(text: str, width: int, template_version: str, title: str, options: str = "") -> str:
+        """
+        生成缓存key
+        """
+        hasher = hashlib.sha256()
+        for part in (text, str(width), template_version, title, options):
+            hasher.update(part.encode("utf-8"))
+            # 分隔符，避免不同字段拼接后产生相同内容
+            hasher.update(b"\x00")
+        return hasher.hexdigest()
+
+    def _shard_dir(self, key: str) -> str:
+        return os.path.join(self._cache_dir, key[:2])
+
+    def image_path(self, key: str, index: int, count: int, extension: str, transient: bool = False) -> str:
+        """
+        获取第 index 张图片的保存路径，transient 为 True 时保存到不登记缓存的临时目录
+        """
+        directory = os.path.join(self._cache_dir, TRANSIENT_DIR) if transient else self._shard_dir(key)
+        if count <= 1:
+            return os.path.join(directory, f"{key}.{extension}")
+        return os.path.join(directory, f"{key}.{index + 1}.{extension}")
+
+    def side_file_path(self, key: str, extension: str) -> str:
+        """
+        获取附属文件(原文本、HTML)的保存路径
+        """
+        return os.path.join(self._shard_dir(key), f"{key}.{extension}")
+
+    def write_image(self, key: str, index: int, count: int, extension: str, data: bytes, transient: bool = False) -> str:
+        """
+        原子写入第 index 张图片，返回图片路径
+
+        transient 为 True 时写入临时目录，不需要调用 put 登记，文件超过 TRANSIENT_FILE_AGE 后由定时清理删除
+        """
+        path = self.image_path(key, index, count, extension, transient)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_atomic(path, data)
+        return path
+
+    def write_side_file(self, key: str, extension: str, content: str):
+        """
+        写入附属调试文件
+        """
+        path = self.side_file_path(key, extension)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_atomic(path, content)
+
+    def _entry_files(self, key: str, image_paths: list) -> list:
+        return list(image_paths) + [self.side_file_path(key, "txt"), self.side_file_path(key, "html")]
+
+    @staticmethod
+    def _files_size(paths: list) -> int:
+        size = 0
+        for path in paths:
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                pass
+        return size
+
+    @staticmethod
+    def _part_order(path: str):
+        parts = os.path.basename(path).split(".")
+        return int(parts[1]) if len(parts) == 3 and parts[1].isdigit() else 0
+
+    def _iter_files(self):
+        """
+        遍历缓存目录中的所有文件，返回 (文件名, 路径)
+        """
+        for shard_name in os.listdir(self._cache_dir):
+            if shard_name == TRANSIENT_DIR:
+                continue
+            shard_dir = os.path.join(self._cache_dir, shard_name)
+            if not os.path.isdir(shard_dir):
+                # 旧版本未分目录保存的文件
+                self._remove_file(shard_dir)
+                continue
+            for file_name in os.listdir(shard_dir):
+                yield file_name, os.path.join(shard_dir, file_name)
+
+    def _load_index(self):
+        groups = {}
+        for file_name, path in self._iter_files():
+            if TEMP_FILE_MARK in file_name:
+                # 上次运行时未完成写入的临时文件
+                self._remove_file(path)
+                continue
+            key = file_name.split(".", 1)[0]
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            group = groups.setdefault(key, {"files": [], "images": [], "size": 0, "mtime": 0})
+            group["files"].append(path)
+            group["size"] += stat.st_size
+            if file_name.endswith(IMAGE_SUFFIXES):
+                group["images"].append(path)
+                group["mtime"] = max(group["mtime"], stat.st_mtime)
+
+        for key, group in sorted(groups.items(), key=lambda item: item[1]["mtime"]):
+            if not group["images"]:
+                # 没有图片的残留附属文件
+                for path in group["files"]:
+                    self._remove_file(path)
+                continue
+            self._index[key] = (sorted(group["images"], key=self._part_order), group["size"], group["mtime"])
+            self._total_size += group["size"]
+
+        logger.debug(f"载入Markdown渲染缓存: {len(self._index)} 项, {self._total_size / 1024 / 1024:.2f}MB")
+        self._evict()
+
+    def get(self, key: str) -> list:
+        """
+        查找缓存，命中时返回图片路径列表，否则返回None
+        """
+        entry = self._index.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        image_paths, size, _ = entry
+        if not all(os.path.exists(path) for path in image_paths):
+            # 文件已被外部删除
+            self._index.pop(key)
+            self._total_size -= size
+            self.misses += 1
+            return None
+
+        now = time.time()
+        self._index[key] = (image_paths, size, now)
+        self._index.move_to_end(key)
+        try:
+            # 更新修改时间，使重启后仍能保持 LRU 顺序
+            for path in image_paths:
+                os.utime(path, (now, now))
+        except OSError:
+            pass
+
+        self.hits += 1
+        return list(image_paths)
+
+    def put(self, key: str, image_paths: list):
+        """
+        登记已写入缓存目录的渲染结果
+        """
+        if key in self._index:
+            self._total_size -= self._index.pop(key)[1]
+
+        # 重新渲染后覆盖写入的文件不再删除
+        for path in self._entry_files(key, image_paths):
+            self._pending_removal.pop(path, None)
+
+        size = self._files_size(self._entry_files(key, image_paths))
+        self._index[key] = (list(image_paths), size, time.time())
+        self._total_size += size
+        self._evict()
+
+    @staticmethod
+    def _remove_file(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"删除Markdown渲染缓存文件失败: {path}, {e}")
+
+    def _remove_entry(self, key: str):
+        image_paths, size, _ = self._index.pop(key)
+        self._total_size -= size
+        now = time.time()
+        for path in self._entry_files(key, image_paths):
+            self._pending_removal.setdefault(path, now)
+
+    def _remove_pending(self, expire_time: float):
+        for path, removed_at in list(self._pending_removal.items()):
+            if removed_at < expire_time:
+                del self._pending_removal[path]
+                self._remove_file(path)
+
+    def _evict(self):
+        # 始终保留最近写入的一项，避免刚渲染完成的图片被立即删除
+        while len(self._index) > 1 and (self._total_size > self._max_size or len(self._index) > self._max_entries):
+            self._remove_entry(next(iter(self._index)))
+
+    def sweep(self, temp_file_age: float = 3600) -> int:
+        """
+        清理过期缓存和遗留的临时文件，返回清理的缓存项数量
+        """
+        removed = 0
+        if self._max_age:
+            expire_time = time.time() - self._max_age
+            while len(self._index) > 1:
+                key = next(iter(self._index))
+                if self._index[key][2] > expire_time:
+                    break
+                self._remove_entry(key)
+                removed += 1
+
+        count = len(self._index)
+        self._evict()
+        removed += count - len(self._index)
+
+        # 清理长时间未完成的临时文件(写入过程中进程退出等情况)
+        expire_time = time.time() - temp_file_age
+        for file_name, path in self._iter_files():
+            if TEMP_FILE_MARK not in file_name:
+                continue
+            try:
+                if os.path.getmtime(path) < expire_time:
+                    self._remove_file(path)
+            except OSError:
+                pass
+
+        # 删除已经发送完成的已淘汰文件和不缓存渲染文件
+        expire_time = time.time() - TRANSIENT_FILE_AGE
+        self._remove_pending(expire_time)
+        transient_dir = os.path.join(self._cache_dir, TRANSIENT_DIR)
+        if os.path.isdir(transient_dir):
+            for file_name in os.listdir(transient_dir):
+                path = os.path.join(transient_dir, file_name)
+                try:
+                    if os.path.getmtime(path) < expire_time:
+                        self._remove_file(path)
+                except OSError:
+                    pass
+
+        if removed:
+            logger.debug(f"清理Markdown渲染缓存: {removed} 项, 当前 {len(self._index)} 项, {self._total_size / 1024 / 1024:.2f}MB")
+        return removed
+
+    async def _run_sweeper(self, interval: float, legacy_dir: str = None):
+        if legacy_dir:
+            try:
+                # data/temp 中的文件可能很多，在线程中清理，不阻塞插件加载
+                removed = await asyncio.to_thread(cleanup_legacy_artifacts, legacy_dir)
+                if removed:
+                    logger.info(f"已清理旧版本遗留的Markdown渲染文件: {removed} 个")
+            except Exception as e:
+                logger.warning(f"清理旧版本遗留的Markdown渲染文件时出错: {e}")
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                # 在事件循环中执行，避免与渲染过程并发修改索引
+                self.sweep()
+            except Exception as e:
+                logger.warning(f"清理Markdown渲染缓存时出错: {e}")
+
+    def start_sweeper(self, interval: float = 600, legacy_dir: str = None):
+        """
+        启动后台定时清理任务，提供 legacy_dir 时先在后台清理该目录中旧版本遗留的渲染文件
+        """
+        if self._sweeper_task is None or self._sweeper_task.done():
+            self._sweeper_task = asyncio.get_event_loop().create_task(self._run_sweeper(interval, legacy_dir))
+
+    def stop_sweeper(self):
+        if self._sweeper_task is not None:
+            self._sweeper_task.cancel()
+            self._sweeper_task = None
+
+
+def _is_legacy_artifact(html_path: str, digest: str) -> bool:
+    """
+    旧版本以完整HTML的MD5命名图片，同时保存 .png.html，内容的MD5与文件名一致且包含模板中的脚本时才认为是本插件生成的
+    """
+    try:
+        with open(html_path, "rb") as f:
+            html = f.read()
+    except OSError:
+        return False
+    if LEGACY_TEMPLATE_MARKER not in html:
+        return False
+    # Windows 下以文本模式写入时换行符被转换为 \r\n
+    return digest in (hashlib.md5(html).hexdigest(), hashlib.md5(html.replace(b"\r\n", b"\n")).hexdigest())
+
+
+def cleanup_legacy_artifacts(temp_dir: str) -> int:
+    """
+    清理旧版本直接写入 data/temp 的渲染文件，返回删除的文件数量
+
+    data/temp 由所有插件共用，只删除能通过 .png.html 确认由本插件生成的文件
+    """
+    if not os.path.isdir(temp_dir):
+        return 0
+
+    digests = set()
+    for file_name in os.listdir(temp_dir):
+        match = LEGACY_ARTIFACT_PATTERN.match(file_name)
+        if match and match.group(2) == ".html":
+            digests.add(match.group(1))
+
+    removed = 0
+    for digest in digests:
+        image_path = os.path.join(temp_dir, f"{digest}.png")
+        if not _is_legacy_artifact(f"{image_path}.html", digest):
+            continue
+        for path in (image_path, f"{image_path}.txt", f"{image_path}.html"):
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+    return removed
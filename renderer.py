@@ -0,0 +1,424 @@
+import asyncio
+import io
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+from playwright.async_api import async_playwright, Browser, BrowserContext, Page, Playwright
+from astrbot.api import logger
+
+from .assets import AssetBundle
+from .metrics import Metrics
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+# 图片格式 -> 文件扩展名
+IMAGE_EXTENSIONS = {
+    "png": "png",
+    "jpeg": "jpg",
+    "webp": "webp",
+}
+
+# 超出大小限制时依次尝试的有损压缩质量
+FALLBACK_QUALITIES = (70, 50, 35)
+
+
+class BrowserPool:
+    """
+    常驻 Chromium 浏览器及可复用页面池
+
+    浏览器在首次使用(或预热)时启动，之后一直保持运行；页面用完后归还到池中复用，
+    浏览器崩溃或断开连接后会在下一次获取页面时自动重新启动。
+    """
+    def __init__(self, pool_size: int = 2, max_page_uses: int = 50, asset_bundle: AssetBundle = None, device_scale_factor: float = 1,
+                 metrics: Metrics = None):
+        # 最大同时使用的页面数量
+        self._pool_size = max(1, pool_size)
+
+        # 单个页面最多复用次数，超过后关闭重建，避免页面内存持续增长
+        self._max_page_uses = max(1, max_page_uses)
+
+        # 模板资源包，页面的资源请求由资源包从内存返回
+        self._asset_bundle = asset_bundle
+
+        # 页面缩放比例，大于1时截图更清晰，但图片尺寸和体积也更大
+        self._device_scale_factor = device_scale_factor or 1
+
+        self._playwright: Playwright = None
+        self._browser: Browser = None
+
+        # 空闲页面 [(page, 已使用次数)]
+        self._idle_pages: list = []
+
+        self._semaphore = asyncio.Semaphore(self._pool_size)
+        self._launch_lock = asyncio.Lock()
+        self._closed = False
+
+        # 浏览器启动次数，用于观察崩溃重启情况
+        self._launch_count = 0
+
+        self._metrics = metrics or Metrics(enabled=False)
+
+    @property
+    def pool_size(self) -> int:
+        return self._pool_size
+
+    @property
+    def device_scale_factor(self) -> float:
+        return self._device_scale_factor
+
+    @property
+    def launch_count(self) -> int:
+        return self._launch_count
+
+    @property
+    def is_running(self) -> bool:
+        return self._browser is not None and self._browser.is_connected()
+
+    def stats(self) -> dict:
+        return {
+            "pool_size": self._pool_size,
+            "running": self.is_running,
+            "idle_pages": len(self._idle_pages),
+            "launch_count": self._launch_count,
+        }
+
+    async def start(self):
+        """
+        预热浏览器
+        """
+        try:
+            await self._ensure_browser()
+        except Exception as e:
+            logger.error(f"预热 Chromium 浏览器失败: {e}")
+
+    async def _ensure_browser(self) -> Browser:
+        if self._closed:
+            raise RuntimeError("浏览器池已关闭")
+
+        if self.is_running:
+            return self._browser
+
+        async with self._launch_lock:
+            if self.is_running:
+                return self._browser
+
+            # 清理已经失效的浏览器及页面
+            await self._close_browser()
+
+            if self._playwright is None:
+                self._playwright = await async_playwright().start()
+                if self._asset_bundle is not None:
+                    # 缺失的资源在后台下载，不阻塞首次渲染
+                    self._asset_bundle.prepare(self._playwright)
+
+            with self._metrics.timer("render_phase_seconds", phase="browser_launch"):
+                self._browser = await self._playwright.chromium.launch()
+            self._browser.on("disconnected", self._on_disconnected)
+            self._launch_count += 1
+            logger.info(f"Chromium 浏览器已启动 (第{self._launch_count}次)")
+            return self._browser
+
+    def _on_disconnected(self, browser: Browser):
+        if browser is not self._browser:
+            return
+
+        if not self._closed:
+            logger.warning("Chromium 浏览器连接已断开，将在下一次渲染时重新启动")
+        self._browser = None
+        self._idle_pages.clear()
+
+    async def _new_page(self) -> Page:
+        browser = await self._ensure_browser()
+        context: BrowserContext = await browser.new_context(device_scale_factor=self._device_scale_factor)
+        if self._asset_bundle is not None:
+            await context.route("**/*", self._asset_bundle.handle_route)
+        return await context.new_page()
+
+    async def _is_healthy(self, page: Page) -> bool:
+        if page.is_closed() or not self.is_running:
+            return False
+
+        try:
+            await asyncio.wait_for(page.evaluate("1"), timeout=2)
+            return True
+        except Exception:
+            return False
+
+    async def _acquire_page(self) -> tuple:
+        while self._idle_pages:
+            page, uses = self._idle_pages.pop()
+            if await self._is_healthy(page):
+                return page, uses
+            await self._discard_page(page)
+
+        return await self._new_page(), 0
+
+    async def _release_page(self, page: Page, uses: int, healthy: bool):
+        if healthy and not self._closed and uses < self._max_page_uses and not page.is_closed() and self.is_running:
+            self._idle_pages.append((page, uses))
+        else:
+            await self._discard_page(page)
+
+    async def _discard_page(self, page: Page):
+        try:
+            await page.context.close()
+        except Exception:
+            pass
+
+    @asynccontextmanager
+    async def page(self):
+        """
+        从池中获取一个页面，使用结束后自动归还
+        """
+        async with self._semaphore:
+            with self._metrics.timer("render_phase_seconds", phase="page_acquire"):
+                page, uses = await self._acquire_page()
+            healthy = True
+            try:
+                yield page
+            except Exception:
+                # 出错的页面不再复用
+                healthy = False
+                raise
+            finally:
+                await self._release_page(page, uses + 1, healthy)
+                if self._asset_bundle is not None:
+                    self._asset_bundle.schedule_download_missing(self._playwright)
+
+    async def _close_browser(self):
+        idle_pages, self._idle_pages = self._idle_pages, []
+        for page, _ in idle_pages:
+            await self._discard_page(page)
+
+        browser, self._browser = self._browser, None
+        if browser is not None:
+            try:
+                await browser.close()
+            except Exception:
+                pass
+
+    async def close(self):
+        """
+        关闭浏览器池，在插件卸载时调用
+        """
+        self._closed = True
+        async with self._launch_lock:
+            await self._close_browser()
+            if self._asset_bundle is not None:
+                await self._asset_bundle.close()
+            if self._playwright is not None:
+                try:
+                    await self._playwright.stop()
+                except Exception as e:
+                    logger.warning(f"停止 Playwright 时出错: {e}")
+                self._playwright = None
+        logger.info("Chromium 浏览器池已关闭")
+
+
+class RenderScheduler:
+    """
+    Markdown 渲染调度器
+
+    限制同时进行的渲染数量和等待队列长度，相同内容的渲染请求合并为一次渲染，
+    队列已满时按照过载策略处理。
+    """
+    def __init__(self, max_concurrency: int = 2, max_queue: int = 16, overload_policy: str = "plain_text"):
+        self._max_concurrency = max(1, max_concurrency)
+        self._max_queue = max(0, max_queue)
+
+        # 过载策略: plain_text 放弃渲染并保留原文本; wait 继续排队等待
+        self._overload_policy = overload_policy
+
+        self._semaphore = asyncio.Semaphore(self._max_concurrency)
+
+        # 正在进行中的渲染 key -> Future
+        self._inflight: dict = {}
+
+        self._waiting = 0
+        self._running = 0
+
+        # 统计数据
+        self._submitted = 0
+        self._coalesced = 0
+        self._rejected = 0
+        self._failed = 0
+        self._wait_times = deque(maxlen=500)
+
+    @property
+    def queue_depth(self) -> int:
+        return self._waiting
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    def stats(self) -> dict:
+        """
+        获取调度器统计数据，等待时间单位为秒
+        """
+        wait_times = sorted(self._wait_times)
+        return {
+            "max_concurrency": self._max_concurrency,
+            "max_queue": self._max_queue,
+            "running": self._running,
+            "queue_depth": self._waiting,
+            "submitted": self._submitted,
+            "coalesced": self._coalesced,
+            "rejected": self._rejected,
+            "failed": self._failed,
+            "wait_avg": sum(wait_times) / len(wait_times) if wait_times else 0.0,
+            "wait_p95": wait_times[int(len(wait_times) * 0.95)] if wait_times else 0.0,
+            "wait_max": wait_times[-1] if wait_times else 0.0,
+        }
+
+    async def submit(self, key: str, render_func):
+        """
+        提交渲染任务，render_func 为无参数的协程函数
+
+        返回渲染结果，因过载被拒绝时返回None。渲染在调度器持有的后台任务中执行，
+        某个请求被取消时不会影响合并到同一渲染的其他请求，渲染完成后结果仍会写入缓存。
+        """
+        self._submitted += 1
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            # 合并相同内容的渲染请求
+            self._coalesced += 1
+            return await asyncio.shield(inflight)
+
+        if self._overload_policy != "wait" and self._semaphore.locked() and self._waiting >= self._max_queue:
+            self._rejected += 1
+            logger.warning(f"Markdown渲染队列已满(运行中: {self._running}, 等待中: {self._waiting})，放弃渲染")
+            return None
+
+        task = asyncio.ensure_future(self._run(key, render_func))
+        self._inflight[key] = task
+        task.add_done_callback(self._on_done)
+        return await asyncio.shield(task)
+
+    def _on_done(self, task: asyncio.Task):
+        # 标记异常已被获取，所有请求都已取消时不产生警告
+        if not task.cancelled():
+            task.exception()
+
+    async def _run(self, key: str, render_func):
+        try:
+            enqueue_time = time.monotonic()
+            self._waiting += 1
+            try:
+                await self._semaphore.acquire()
+            finally:
+                self._waiting -= 1
+
+            wait_time = time.monotonic() - enqueue_time
+            self._wait_times.append(wait_time)
+            logger.debug(f"Markdown渲染开始，排队耗时 {wait_time:.3f}s (运行中: {self._running + 1}, 等待中: {self._waiting})")
+
+            self._running += 1
+            try:
+                return await render_func()
+            except Exception:
+                self._failed += 1
+                raise
+            finally:
+                self._running -= 1
+                self._semaphore.release()
+        finally:
+            self._inflight.pop(key, None)
+
+
+def _convert_image(png_bytes: bytes, image_format: str, quality: int) -> bytes:
+    image = Image.open(io.BytesIO(png_bytes))
+    if image_format == "jpeg" and image.mode != "RGB":
+        image = image.convert("RGB")
+
+    output = io.BytesIO()
+    image.save(output, format=image_format.upper(), quality=quality)
+    return output.getvalue()
+
+
+async def _encode_clip(page: Page, clip: dict, image_format: str, quality: int, png_cache: dict) -> tuple:
+    """
+    截取页面指定区域并编码为指定格式，返回 (图片内容, 实际使用的格式)
+    """
+    if image_format == "webp" and Image is None:
+        logger.warning("未安装 Pillow，无法输出WebP格式，改为使用JPEG格式")
+        image_format = "jpeg"
+
+    if image_format == "png" or Image is not None:
+        # 同一区域只截图一次，其他格式由PNG转换得到
+        if "png" not in png_cache:
+            png_cache["png"] = await page.screenshot(clip=clip, full_page=True, type="png")
+        if image_format == "png":
+            return png_cache["png"], image_format
+        data = await asyncio.to_thread(_convert_image, png_cache["png"], image_format, quality)
+        return data, image_format
+
+    return await page.screenshot(clip=clip, full_page=True, type="jpeg", quality=quality), image_format
+
+
+def format_candidates(image_format: str, quality: int, limited: bool) -> list:
+    """
+    按优先顺序排列需要尝试的 (格式, 质量)
+    """
+    if image_format == "auto":
+        candidates = [("png", None), ("webp", quality), ("jpeg", quality)]
+        if Image is None:
+            # 未安装 Pillow 时跳过WebP
+            candidates.remove(("webp", quality))
+        lossy_format = "jpeg"
+    elif image_format == "png":
+        return [("png", None)]
+    else:
+        candidates = [(image_format, quality)]
+        lossy_format = image_format
+
+    if limited:
+        candidates += [(lossy_format, q) for q in FALLBACK_QUALITIES if q < quality]
+    return candidates
+
+
+async def capture_page_images(page: Page, width: int, image_format: str = "png", quality: int = 85,
+                              max_height: int = 0, max_bytes: int = 0, device_scale_factor: float = 1) -> list:
+    """
+    截取整个页面，返回 [(图片内容, 文件扩展名)]
+
+    页面高度超过 max_height (图片像素) 时切分为多张图片；设置 max_bytes 时，
+    按优先顺序尝试各个格式和压缩质量，使用第一个不超过大小限制的结果。
+    """
+    page_height = await page.evaluate("Math.ceil(document.documentElement.scrollHeight)")
+    page_height = max(1, int(page_height))
+
+    # 换算为页面像素
+    segment_height = page_height
+    if max_height and max_height > 0:
+        segment_height = max(1, int(max_height / (device_scale_factor or 1)))
+
+    images = []
+    segment_count = math.ceil(page_height / segment_height)
+    for index in range(segment_count):
+        top = index * segment_height
+        clip = {"x": 0, "y": top, "width": width, "height": min(segment_height, page_height - top)}
+
+        png_cache = {}
+        smallest = None
+        for candidate_format, candidate_quality in format_candidates(image_format, quality, max_bytes > 0):
+            data, actual_format = await _encode_clip(page, clip, candidate_format, candidate_quality, png_cache)
+            if not max_bytes or len(data) <= max_bytes:
+                smallest = (data, actual_format)
+                break
+            if smallest is None or len(data) < len(smallest[0]):
+                smallest = (data, actual_format)
+        else:
+            logger.warning(f"Markdown图片第{index + 1}部分超出大小限制: {len(smallest[0]) / 1024:.0f}KB > {max_bytes / 1024:.0f}KB")
+
+        data, actual_format = smallest
+        images.append((data, IMAGE_EXTENSIONS[actual_format]))
+
+    return images
@@ -0,0 +1,177 @@
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from astrbot.api import logger
+
+from .agent import DeepResearchAgent
+
+
+class DeepResearchSessionRegistry:
+    """
+    内存中的深度研究会话管理
+
+    按最近使用顺序保存会话，超过会话数量上限、总内存上限或空闲时间过长时，
+    淘汰最久未使用的会话。会话状态已经持久化到存储中，被淘汰后再次访问时通过 loader 重新载入。
+    正在执行的会话不会被淘汰。
+    """
+    def __init__(self, loader, max_sessions: int = 32, idle_ttl: float = 1800,
+                 max_session_bytes: int = 8 * 1024 * 1024, max_total_bytes: int = 128 * 1024 * 1024):
+        # 从存储中载入会话的函数 loader(session_id) -> DeepResearchAgent，会话不存在时返回None
+        self._loader = loader
+
+        self._max_sessions = max(1, max_sessions)
+
+        # 会话最长空闲时间(秒)，0为不限制
+        self._idle_ttl = max(0, idle_ttl)
+
+        # 单个会话和全部会话的内存上限(字节)
+        self._max_session_bytes = max(1, max_session_bytes)
+        self._max_total_bytes = max(1, max_total_bytes)
+
+        # session_id -> (会话, 最近使用时间)，按最近使用顺序排列
+        self._sessions: OrderedDict = OrderedDict()
+
+        # 正在执行的会话 session_id -> 引用计数
+        self._active: dict = {}
+
+        self.loads = 0
+        self.evictions = 0
+
+        self._sweeper_task: asyncio.Task = None
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._sessions
+
+    @property
+    def memory_usage(self) -> int:
+        return sum(agent.memory_usage for agent, _ in self._sessions.values())
+
+    def add(self, agent: DeepResearchAgent):
+        self._sessions[agent.session_id] = (agent, time.time())
+        self._sessions.move_to_end(agent.session_id)
+        self._evict()
+
+    def get(self, session_id: str) -> DeepResearchAgent:
+        """
+        获取会话，不在内存中时通过 loader 载入，会话不存在时返回None
+        """
+        entry = self._sessions.get(session_id)
+        if entry is not None:
+            agent = entry[0]
+            self._sessions[session_id] = (agent, time.time())
+            self._sessions.move_to_end(session_id)
+            return agent
+
+        agent = self._loader(session_id)
+        if agent is None:
+            return None
+
+        self.loads += 1
+        self.add(agent)
+        return agent
+
+    def is_active(self, session_id: str) -> bool:
+        """
+        会话是否正在执行
+        """
+        return session_id in self._active
+
+    @contextmanager
+    def active(self, agent: DeepResearchAgent):
+        """
+        标记会话正在执行，执行期间不会被淘汰，结束后限制会话内存占用
+        """
+        session_id = agent.session_id
+        if session_id not in self._sessions:
+            self.add(agent)
+        self._active[session_id] = self._active.get(session_id, 0) + 1
+        try:
+            yield agent
+        finally:
+            count = self._active.pop(session_id) - 1
+            if count > 0:
+                self._active[session_id] = count
+            else:
+                agent.trim_memory(self._max_session_bytes)
+            if session_id in self._sessions:
+                self._sessions[session_id] = (agent, time.time())
+            self._evict()
+
+    def _remove(self, session_id: str, reason: str):
+        agent, _ = self._sessions.pop(session_id)
+        self.evictions += 1
+        logger.debug(f"深度研究会话移出内存({reason}): {session_id}, {agent.memory_usage / 1024:.1f}KB")
+
+    def _evict(self):
+        now = time.time()
+        total_bytes = self.memory_usage
+        for session_id in list(self._sessions):
+            if session_id in self._active:
+                continue
+
+            agent, last_used = self._sessions[session_id]
+            if self._idle_ttl and now - last_used > self._idle_ttl:
+                reason = "空闲超时"
+            elif len(self._sessions) > self._max_sessions:
+                reason = "会话数量超出上限"
+            elif total_bytes > self._max_total_bytes:
+                reason = "内存超出上限"
+            else:
+                # 单个会话超出内存上限时只丢弃内存中较早的完整对话历史，当前阶段的对话历史仍需保留
+                total_bytes -= agent.trim_memory(self._max_session_bytes)
+                continue
+
+            total_bytes -= agent.memory_usage
+            self._remove(session_id, reason)
+
+    def stats(self) -> dict:
+        """
+        获取会话统计数据
+        """
+        now = time.time()
+        sessions = []
+        for session_id, (agent, last_used) in reversed(self._sessions.items()):
+            sessions.append({
+                "session_id": session_id,
+                "stage": agent.stage.value if agent.stage else None,
+                "active": session_id in self._active,
+                "idle": now - last_used,
+                "memory": agent.memory_usage,
+                "history": agent.history_size,
+                "tokens": agent.usage.total_tokens,
+                "turns": agent.usage.turns,
+            })
+        return {
+            "sessions": sessions,
+            "count": len(self._sessions),
+            "memory": self.memory_usage,
+            "max_sessions": self._max_sessions,
+            "max_total_bytes": self._max_total_bytes,
+            "loads": self.loads,
+            "evictions": self.evictions,
+        }
+
+    async def _run_sweeper(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self._evict()
+            except Exception as e:
+                logger.warning(f"清理深度研究会话时出错: {e}")
+
+    def start_sweeper(self, interval: float = 60):
+        """
+        启动后台定时清理任务
+        """
+        if self._sweeper_task is None or self._sweeper_task.done():
+            self._sweeper_task = asyncio.get_event_loop().create_task(self._run_sweeper(interval))
+
+    def stop_sweeper(self):
+        if self._sweeper_task is not None:
+            self._sweeper_task.cancel()
+            self._sweeper_task = None
@@ -0,0 +1,371 @@
+import asyncio
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from astrbot.api import logger
+
+
+class DeepResearchSessionStore:
+    """
+    深度研究会话持久化存储
+
+    使用 SQLite 保存会话状态，对话历史和Todo项按条追加写入，
+    阶段、研究主题和Todo状态变化时只更新对应的行，不会重写整个会话。
+    写入由后台线程执行，已排队的多次写入合并到同一事务中提交，不阻塞事件循环；
+    读取前等待已排队的写入完成。超过保留时间未更新的会话由定时清理删除。
+    """
+    # 完整对话历史在 history 表中使用的阶段标记
+    ORIGINAL_HISTORY = "original"
+
+    # 单个事务最多合并的写入数量
+    MAX_BATCH = 256
+
+    def __init__(self, db_path: str, retention_days: float = 30):
+        self._db_path = db_path
+
+        # 会话最后更新后的保留时间(秒)，0为不限制
+        self._retention = max(0, retention_days) * 24 * 3600
+
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        # WAL 模式下追加写入不会阻塞读取
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                stage TEXT,
+                research_topic TEXT,
+                owner_id TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS history_session ON history (session_id, stage, id);
+            CREATE TABLE IF NOT EXISTS todos (
+                session_id TEXT NOT NULL,
+                todo_id TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                step TEXT NOT NULL,
+                status TEXT NOT NULL,
+                reason TEXT,
+                depends_on TEXT,
+                PRIMARY KEY (session_id, todo_id)
+            );
+            CREATE TABLE IF NOT EXISTS llm_calls (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                stage TEXT,
+                prompt_tokens INTEGER NOT NULL,
+                completion_tokens INTEGER NOT NULL,
+                latency REAL NOT NULL,
+                retries INTEGER NOT NULL,
+                regeneration INTEGER NOT NULL,
+                estimated INTEGER NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS llm_calls_session ON llm_calls (session_id);
+        """)
+        # 旧版本数据库没有 depends_on 字段
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(todos)")}
+        if "depends_on" not in columns:
+            self._conn.execute("ALTER TABLE todos ADD COLUMN depends_on TEXT")
+        # 旧版本数据库没有 owner_id 字段
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(sessions)")}
+        if "owner_id" not in columns:
+            self._conn.execute("ALTER TABLE sessions ADD COLUMN owner_id TEXT")
+        self._conn.commit()
+
+        # 写入和读取共用同一连接，由锁保证不会同时使用
+        self._lock = threading.Lock()
+
+        # 待写入队列，元素为 (session_id, sql, params, many, 提交时间)，None 表示停止写入线程
+        self._queue: queue.Queue = queue.Queue()
+        self._writer = threading.Thread(target=self._run_writer, name="knbot-deepresearch-store", daemon=True)
+        self._writer.start()
+
+        self._pruner_task: asyncio.Task = None
+
+    def _execute(self, session_id: str, sql: str, params: tuple = (), many: bool = False):
+        """
+        提交一次写入到后台线程，并在同一事务中更新会话的最后修改时间，many 为 True 时 params 为多组参数
+        """
+        self._queue.put((session_id, sql, params, many, time.time()))
+
+    def _run_writer(self):
+        while True:
+            batch = [self._queue.get()]
+            # 合并已经排队的写入
+            while batch[-1] is not None and len(batch) < self.MAX_BATCH:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            writes = [item for item in batch if item is not None]
+            if writes:
+                with self._lock:
+                    self._write_batch(writes)
+            for _ in batch:
+                self._queue.task_done()
+            if batch[-1] is None:
+                return
+
+    def _apply(self, write: tuple):
+        session_id, sql, params, many, updated_at = write
+        if many:
+            self._conn.executemany(sql, params)
+        else:
+            self._conn.execute(sql, params)
+        self._conn.execute("UPDATE sessions SET updated_at = ? WHERE session_id = ?", (updated_at, session_id))
+
+    def _write_batch(self, writes: list):
+        try:
+            for write in writes:
+                self._apply(write)
+            self._conn.commit()
+            return
+        except sqlite3.Error as e:
+            self._conn.rollback()
+            if len(writes) == 1:
+                logger.error(f"写入深度研究会话失败: {e}")
+                return
+
+        # 合并提交失败时逐条提交，只丢弃出错的写入
+        for write in writes:
+            try:
+                self._apply(write)
+                self._conn.commit()
+            except sqlite3.Error as e:
+                self._conn.rollback()
+                logger.error(f"写入深度研究会话失败: {e}")
+
+    def _read(self, sql: str, params: tuple = ()) -> list:
+        """
+        等待已排队的写入完成后读取
+        """
+        self._queue.join()
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def prune(self) -> int:
+        """
+        删除超过保留时间未更新的会话及其对话历史、Todo项和调用记录，返回删除的会话数量
+        """
+        if not self._retention:
+            return 0
+        expire_time = time.time() - self._retention
+        self._queue.join()
+        with self._lock:
+            try:
+                expired = "SELECT session_id FROM sessions WHERE updated_at < ?"
+                for table in ("history", "todos", "llm_calls"):
+                    self._conn.execute(f"DELETE FROM {table} WHERE session_id IN ({expired})", (expire_time,))
+                removed = self._conn.execute("DELETE FROM sessions WHERE updated_at < ?", (expire_time,)).rowcount
+                self._conn.commit()
+            except sqlite3.Error as e:
+                self._conn.rollback()
+                logger.error(f"清理深度研究会话失败: {e}")
+                return 0
+        if removed:
+            logger.info(f"已清理超过保留时间的深度研究会话: {removed} 个")
+        return removed
+
+    async def _run_pruner(self, interval: float):
+        while True:
+            try:
+                await asyncio.to_thread(self.prune)
+            except Exception as e:
+                logger.warning(f"清理深度研究会话时出错: {e}")
+            await asyncio.sleep(interval)
+
+    def start_pruner(self, interval: float = 24 * 3600):
+        """
+        启动后台定时清理任务，启动时立即清理一次
+        """
+        if not self._retention:
+            return
+        if self._pruner_task is None or self._pruner_task.done():
+            self._pruner_task = asyncio.get_event_loop().create_task(self._run_pruner(interval))
+
+    def create_session(self, session_id: str):
+        now = time.time()
+        self._execute(
+            session_id,
+            "INSERT OR IGNORE INTO sessions (session_id, stage, research_topic, created_at, updated_at) VALUES (?, NULL, NULL, ?, ?)",
+            (session_id, now, now)
+        )
+
+    def exists(self, session_id: str) -> bool:
+        return bool(self._read("SELECT 1 FROM sessions WHERE session_id = ?", (session_id,)))
+
+    def append_history(self, session_id: str, stage: str, role: str, content):
+        """
+        追加一条对话历史，stage 为 ORIGINAL_HISTORY 时为完整对话历史
+        """
+        self._execute(
+            session_id,
+            "INSERT INTO history (session_id, stage, role, content) VALUES (?, ?, ?, ?)",
+            (session_id, stage, role, json.dumps(content, ensure_ascii=False))
+        )
+
+    def set_stage(self, session_id: str, stage: str):
+        self._execute(session_id, "UPDATE sessions SET stage = ? WHERE session_id = ?", (stage, session_id))
+
+    def set_research_topic(self, session_id: str, research_topic: str):
+        self._execute(session_id, "UPDATE sessions SET research_topic = ? WHERE session_id = ?", (research_topic, session_id))
+
+    def set_owner(self, session_id: str, owner_id: str):
+        self._execute(session_id, "UPDATE sessions SET owner_id = ? WHERE session_id = ?", (owner_id, session_id))
+
+    def add_todo(self, session_id: str, todo: dict):
+        self._execute(
+            session_id,
+            "INSERT OR REPLACE INTO todos (session_id, todo_id, position, step, status, reason, depends_on) "
+            "VALUES (?, ?, (SELECT COUNT(*) FROM todos WHERE session_id = ?), ?, ?, ?, ?)",
+            (session_id, todo["id"], session_id, todo["step"], todo["status"], todo["reason"],
+             json.dumps(todo.get("depends_on") or []))
+        )
+
+    def set_todo_status(self, session_id: str, todo_id: str, status: str, reason: str):
+        self._execute(
+            session_id,
+            "UPDATE todos SET status = ?, reason = ? WHERE session_id = ? AND todo_id = ?",
+            (status, reason, session_id, todo_id)
+        )
+
+    def set_todo_statuses(self, session_id: str, todos: list):
+        """
+        在同一事务中批量更新Todo项状态
+        """
+        if not todos:
+            return
+        self._execute(
+            session_id,
+            "UPDATE todos SET status = ?, reason = ? WHERE session_id = ? AND todo_id = ?",
+            [(todo["status"], todo["reason"], session_id, todo["id"]) for todo in todos],
+            many=True
+        )
+
+    def append_llm_call(self, session_id: str, record: dict):
+        """
+        追加一条模型调用记录
+        """
+        self._execute(
+            session_id,
+            "INSERT INTO llm_calls (session_id, stage, prompt_tokens, completion_tokens, latency, retries, regeneration, estimated, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (session_id, record["stage"], record["prompt_tokens"], record["completion_tokens"], record["latency"],
+             record["retries"], record["parse_retries"], record["estimated_calls"], time.time())
+        )
+
+    def load_usage(self, session_id: str) -> dict:
+        """
+        读取各阶段的模型调用用量合计 {阶段: 合计}
+        """
+        usage = {}
+        for row in self._read(
+            "SELECT stage, COUNT(*), SUM(prompt_tokens), SUM(completion_tokens), SUM(latency), SUM(retries), "
+            "SUM(regeneration = 0), SUM(regeneration != 0), SUM(estimated) FROM llm_calls WHERE session_id = ? GROUP BY stage",
+            (session_id,)
+        ):
+            stage, calls, prompt_tokens, completion_tokens, latency, retries, turns, parse_retries, estimated = row
+            usage[stage] = {
+                "calls": calls,
+                "turns": turns,
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "latency": latency,
+                "retries": retries,
+                "parse_retries": parse_retries,
+                "estimated_calls": estimated,
+            }
+        return usage
+
+    def load_original_history(self, session_id: str) -> list:
+        """
+        读取完整对话历史
+        """
+        return [
+            {"role": role, "content": json.loads(content)}
+            for role, content in self._read(
+                "SELECT role, content FROM history WHERE session_id = ? AND stage = ? ORDER BY id",
+                (session_id, self.ORIGINAL_HISTORY)
+            )
+        ]
+
+    def load(self, session_id: str, include_original: bool = True) -> dict:
+        """
+        读取会话状态，会话不存在时返回None
+
+        返回 {"stage", "research_topic", "owner_id", "history_org", "history": {阶段: [消息]}, "todo_list", "usage"}，
+        include_original 为 False 时不读取完整对话历史(history_org 为None)，需要时再通过 load_original_history 读取
+        """
+        rows = self._read("SELECT stage, research_topic, owner_id FROM sessions WHERE session_id = ?", (session_id,))
+        if not rows:
+            return None
+        row = rows[0]
+
+        state = {
+            "stage": row[0],
+            "research_topic": row[1],
+            "owner_id": row[2],
+            "history_org": [] if include_original else None,
+            "history": {},
+            "todo_list": [],
+        }
+        if include_original:
+            rows = self._read(
+                "SELECT stage, role, content FROM history WHERE session_id = ? ORDER BY id", (session_id,)
+            )
+        else:
+            rows = self._read(
+                "SELECT stage, role, content FROM history WHERE session_id = ? AND stage != ? ORDER BY id",
+                (session_id, self.ORIGINAL_HISTORY)
+            )
+        for stage, role, content in rows:
+            message = {"role": role, "content": json.loads(content)}
+            if stage == self.ORIGINAL_HISTORY:
+                state["history_org"].append(message)
+            else:
+                state["history"].setdefault(stage, []).append(message)
+
+        for todo_id, step, status, reason, depends_on in self._read(
+            "SELECT todo_id, step, status, reason, depends_on FROM todos WHERE session_id = ? ORDER BY position", (session_id,)
+        ):
+            state["todo_list"].append({
+                "id": todo_id,
+                "step": step,
+                "status": status,
+                "reason": reason or "",
+                "depends_on": json.loads(depends_on) if depends_on else [],
+            })
+
+        state["usage"] = self.load_usage(session_id)
+
+        return state
+
+    def close(self):
+        """
+        写入已排队的内容后关闭数据库
+        """
+        if self._pruner_task is not None:
+            self._pruner_task.cancel()
+            self._pruner_task = None
+        self._queue.put(None)
+        self._writer.join()
+        try:
+            self._conn.close()
+        except sqlite3.Error:
+            pass
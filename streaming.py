@@ -0,0 +1,227 @@
+from astrbot.api import logger
+
+
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+class IncrementalJSONParser:
+    """
+    增量解析流式输出的JSON对象
+
+    逐块输入模型输出的文本，在顶层字符串字段生成过程中返回解析事件：
+    - ("delta", 字段名, 新增文本): 字段值新增的内容
+    - ("done", 字段名, 完整值): 字段值已完整生成
+
+    只解析顶层对象中的字符串字段，嵌套的对象和数组会被跳过，完整结果仍以 json.loads 的解析为准。
+    """
+    def __init__(self):
+        # 顶层对象开始前的内容(如 ```json)会被忽略
+        self._started = False
+        self._depth = 0
+
+        self._in_string = False
+        self._escape = False
+        self._unicode = None
+
+        # 当前字符串是否为顶层对象的key
+        self._expect_key = False
+        self._string = []
+
+        self._key = None
+        self._value_key = None
+
+        self.fields = {}
+
+    def _string_done(self, events: list):
+        text = "".join(self._string)
+        self._string = []
+        if self._depth != 1:
+            return
+
+        if self._value_key is not None:
+            self.fields[self._value_key] = text
+            events.append(("done", self._value_key, text))
+            self._value_key = None
+        elif self._expect_key:
+            self._key = text
+            self._expect_key = False
+
+    def feed(self, chunk: str) -> list:
+        """
+        输入新的文本块，返回解析事件列表
+        """
+        events = []
+        delta = []
+
+        for char in chunk:
+            if not self._started:
+                if char == "{":
+                    self._started = True
+                    self._depth = 1
+                    self._expect_key = True
+                continue
+
+            if self._in_string:
+                if self._unicode is not None:
+                    self._unicode += char
+                    if len(self._unicode) < 4:
+                        continue
+                    try:
+                        char = chr(int(self._unicode, 16))
+                    except ValueError:
+                        char = ""
+                    self._unicode = None
+                elif self._escape:
+                    self._escape = False
+                    if char == "u":
+                        self._unicode = ""
+                        continue
+                    char = _ESCAPES.get(char, char)
+                elif char == "\\":
+                    self._escape = True
+                    continue
+                elif char == '"':
+                    self._in_string = False
+                    if delta:
+                        events.append(("delta", self._value_key, "".join(delta)))
+                        delta = []
+                    self._string_done(events)
+                    continue
+
+                self._string.append(char)
+                if self._value_key is not None:
+                    delta.append(char)
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char in "{[":
+                if self._depth == 1:
+                    # 嵌套的值不转发
+                    self._value_key = None
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+            elif self._depth == 1:
+                if char == ":" and self._key is not None:
+                    # 下一个字符串为该key的值
+                    self._value_key = self._key
+                    self._key = None
+                elif char == ",":
+                    self._expect_key = True
+                    self._value_key = None
+                elif not char.isspace():
+                    # 非字符串的值
+                    self._value_key = None
+
+        if delta:
+            events.append(("delta", self._value_key, "".join(delta)))
+        return events
+
+    @property
+    def action(self) -> str:
+        return self.fields.get("action")
+
+
+class StreamForwarder:
+    """
+    将流式生成中的字段内容转发到聊天中
+
+    确定action后，只转发该action需要展示给用户的字段，内容按段落分块发送，
+    已经转发的字段在生成结束后不需要再次发送。
+    解析失败重新生成时，已经转发过的字段不会再次转发。
+    """
+    # action -> 需要转发的字段及前缀
+    ACTION_FIELDS = {
+        "ask": {"think": "[想法] ", "question": ""},
+        "answer": {"think": "[想法] ", "answer": ""},
+    }
+    DEFAULT_FIELDS = {"think": "[想法] "}
+
+    def __init__(self, send_func, chunk_chars: int = 300):
+        # 发送文本的协程函数 send_func(text)
+        self._send_func = send_func
+
+        # 累计超过该长度后在段落边界发送
+        self._chunk_chars = max(1, chunk_chars)
+
+        self._action = None
+        self._buffers = {}
+        self._started = set()
+        self._streamed = set()
+
+        # 本轮之前的生成中已经开始转发的字段
+        self._forwarded = set()
+
+    def reset(self):
+        """
+        开始新一轮对话
+        """
+        self._action = None
+        self._buffers = {}
+        self._started = set()
+        self._streamed = set()
+        self._forwarded = set()
+
+    def regenerate(self):
+        """
+        解析失败后重新生成，保留已经转发的字段，不重复发送
+        """
+        self._action = None
+        self._buffers = {}
+        self._forwarded |= self._started
+
+    def streamed(self, field: str) -> bool:
+        """
+        字段内容是否已经完整转发
+        """
+        return field in self._streamed
+
+    def _fields(self) -> dict:
+        return self.ACTION_FIELDS.get(self._action, self.DEFAULT_FIELDS)
+
+    async def _send(self, field: str, text: str):
+        if not text.strip():
+            return
+        if field not in self._started:
+            self._started.add(field)
+            text = self._fields()[field] + text
+        try:
+            await self._send_func(text.strip("\n"))
+        except Exception as e:
+            logger.warning(f"转发流式输出失败: {e}")
+
+    async def _flush(self, field: str, final: bool = False):
+        buffer = self._buffers.get(field, "")
+        if final:
+            self._buffers[field] = ""
+            await self._send(field, buffer)
+            return
+
+        if len(buffer) < self._chunk_chars:
+            return
+        # 在最后一个段落边界处切分
+        split = buffer.rfind("\n\n")
+        if split <= 0:
+            split = buffer.rfind("\n")
+        if split <= 0:
+            return
+        self._buffers[field] = buffer[split:].lstrip("\n")
+        await self._send(field, buffer[:split])
+
+    async def handle(self, event: tuple):
+        kind, field, text = event
+        if field == "action" and kind == "done":
+            self._action = text
+            return
+
+        # action 未确定前不转发，也不缓存(action 一般为第一个字段)
+        if self._action is None or field not in self._fields() or field in self._forwarded:
+            return
+
+        if kind == "delta":
+            self._buffers[field] = self._buffers.get(field, "") + text
+            await self._flush(field)
+        else:
+            await self._flush(field, final=True)
+            self._streamed.add(field)
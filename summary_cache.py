@@ -0,0 +1,140 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+
+from astrbot.api import logger
+
+
+class SummaryCache:
+    """
+    话题总结缓存
+
+    以文本哈希为key缓存LLM生成的总结标题，内存中按 LRU + TTL 淘汰，并持久化到磁盘，
+    同一文本同时发起的多次总结请求只会调用一次LLM。
+    """
+    def __init__(self, cache_path: str, ttl: float = 7 * 24 * 3600, max_entries: int = 1000):
+        self._cache_path = cache_path
+        self._ttl = ttl
+        self._max_entries = max(1, max_entries)
+
+        # key -> (总结内容, 过期时间)
+        self._entries: OrderedDict = OrderedDict()
+
+        # 正在生成中的总结 key -> Future
+        self._inflight: dict = {}
+
+        self.hits = 0
+        self.misses = 0
+        # 等待同一文本正在进行的总结的请求
+        self.coalesced = 0
+
+        self._load()
+
+    @staticmethod
+    def make_key(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _load(self):
+        if not os.path.exists(self._cache_path):
+            return
+
+        try:
+            with open(self._cache_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.warning(f"读取话题总结缓存失败: {e}")
+            return
+
+        now = time.time()
+        for key, (summary, expires_at) in sorted(data.items(), key=lambda item: item[1][1]):
+            if expires_at > now:
+                self._entries[key] = (summary, expires_at)
+        self._evict()
+        logger.debug(f"载入话题总结缓存: {len(self._entries)} 项")
+
+    def _save(self):
+        try:
+            os.makedirs(os.path.dirname(self._cache_path), exist_ok=True)
+            tmp_path = f"{self._cache_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._entries, f, ensure_ascii=False)
+            os.replace(tmp_path, self._cache_path)
+        except Exception as e:
+            logger.warning(f"保存话题总结缓存失败: {e}")
+
+    def _evict(self):
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key: str) -> str:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        summary, expires_at = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return summary
+
+    def put(self, key: str, summary: str):
+        self._entries[key] = (summary, time.time() + self._ttl)
+        self._entries.move_to_end(key)
+        self._evict()
+        self._save()
+
+    async def get_or_generate(self, text: str, generate_func) -> str:
+        """
+        获取文本总结，未命中时调用 generate_func(text) 生成，同一文本的并发请求共享一次生成
+        """
+        key = self.make_key(text)
+        summary = self.get(key)
+        if summary is not None:
+            self.hits += 1
+            return summary
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(inflight)
+
+        self.misses += 1
+        task = asyncio.ensure_future(generate_func(text))
+        self._inflight[key] = task
+        try:
+            summary = await asyncio.shield(task)
+        finally:
+            self._inflight.pop(key, None)
+
+        if summary:
+            self.put(key, summary)
+        return summary
+
+
+def heuristic_title(text: str, max_length: int = 10, default: str = "KNBot Enhance") -> str:
+    """
+    不调用LLM，从文本中快速提取标题：优先使用第一个Markdown标题，否则使用第一行非空文本
+    """
+    first_line = ""
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith(("```", "$$", "|", "---")):
+            continue
+        if line.startswith("#"):
+            first_line = line
+            break
+        if not first_line:
+            first_line = line
+
+    # 去除Markdown符号和标点
+    title = re.sub(r"[#>*_`~\[\]()!|$\-+=:：，。、；;,.!?？！“”\"'《》<>]", "", first_line).strip()
+    title = re.sub(r"\s+", " ", title)
+    if not title:
+        return default
+    return title[:max_length]
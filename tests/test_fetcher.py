@@ -0,0 +1,108 @@
+"""
+visit 网页获取测试，使用本地 aiohttp 服务代替真实网页，不需要访问外部网络
+
+在 AstrBot 根目录下运行:
+    python -m unittest data.plugins.knbot_enhance.tests.test_fetcher
+"""
+import os
+import tempfile
+import unittest
+
+from aiohttp import web
+
+from ..fetcher import PageCache, UrlPolicy, WebFetcher
+
+
+PAGE_HTML = "<html><head><title>本地页面</title></head><body><nav>导航</nav><p>正文内容</p></body></html>"
+
+
+class WebFetcherLocalServerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.requests = 0
+
+        async def page(request: web.Request):
+            self.requests += 1
+            return web.Response(text=PAGE_HTML, content_type="text/html", headers={"ETag": '"v1"'})
+
+        async def redirect(request: web.Request):
+            raise web.HTTPFound("http://169.254.169.254/latest/meta-data/")
+
+        app = web.Application()
+        app.router.add_get("/page", page)
+        app.router.add_get("/redirect", redirect)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        self.base_url = f"http://127.0.0.1:{port}"
+
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.fetcher = WebFetcher(self.cache_dir.name, policy=UrlPolicy(allowed_hosts=["127.0.0.1"]))
+
+    async def asyncTearDown(self):
+        await self.fetcher.close()
+        await self.runner.cleanup()
+        self.cache_dir.cleanup()
+
+    async def test_allowed_host_fetch_and_cache(self):
+        result = await self.fetcher.fetch(f"{self.base_url}/page")
+        self.assertNotIn("error", result)
+        self.assertEqual(result["title"], "本地页面")
+        self.assertIn("正文内容", result["content"])
+        self.assertNotIn("导航", result["content"])
+
+        # 缓存有效期内不再请求
+        await self.fetcher.fetch(f"{self.base_url}/page")
+        self.assertEqual(self.requests, 1)
+        self.assertEqual(self.fetcher.hits, 1)
+        self.assertEqual(len(self.fetcher.cache), 1)
+
+    async def test_private_host_blocked_without_allowlist(self):
+        fetcher = WebFetcher(os.path.join(self.cache_dir.name, "blocked"))
+        try:
+            result = await fetcher.fetch(f"{self.base_url}/page")
+        finally:
+            await fetcher.close()
+        self.assertIn("error", result)
+        self.assertEqual(self.requests, 0)
+        self.assertEqual(fetcher.blocked, 1)
+
+    async def test_redirect_to_private_address_blocked(self):
+        result = await self.fetcher.fetch(f"{self.base_url}/redirect")
+        self.assertIn("error", result)
+        self.assertEqual(self.fetcher.blocked, 1)
+
+
+class PageCacheLimitTest(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
+
+    def test_evicts_least_recently_used(self):
+        cache = PageCache(self.cache_dir.name, max_entries=2)
+        for index in range(3):
+            cache.put(f"https://example.com/{index}", {"title": "", "content": str(index)})
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get("https://example.com/0"))
+        self.assertIsNotNone(cache.get("https://example.com/2"))
+
+        # 重新载入后保持相同的缓存项
+        self.assertEqual(len(PageCache(self.cache_dir.name, max_entries=2)), 2)
+
+    def test_sweep_removes_expired_entries(self):
+        cache = PageCache(self.cache_dir.name, max_age_hours=1)
+        cache.put("https://example.com/old", {"title": "", "content": "old"})
+        path = cache._path("https://example.com/old")
+        os.utime(path, (0, 0))
+
+        cache = PageCache(self.cache_dir.name, max_age_hours=1)
+        self.assertEqual(cache.sweep(), 1)
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(cache.total_size, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+"""
+深度研究会话存储测试
+
+在 AstrBot 根目录下运行:
+    python -m unittest data.plugins.knbot_enhance.tests.test_session_store
+"""
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from ..session_store import DeepResearchSessionStore
+
+
+class SessionStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.data_dir.name, "deepresearch.db")
+
+    def tearDown(self):
+        self.data_dir.cleanup()
+
+    def test_queued_writes_visible_to_load(self):
+        store = DeepResearchSessionStore(self.db_path)
+        try:
+            store.create_session("s1")
+            store.set_owner("s1", "user")
+            store.set_stage("s1", "ask")
+            for index in range(300):
+                store.append_history("s1", "ask", "user", f"消息 {index}")
+
+            state = store.load("s1")
+            self.assertEqual(state["owner_id"], "user")
+            self.assertEqual(state["stage"], "ask")
+            self.assertEqual(len(state["history"]["ask"]), 300)
+            self.assertEqual(state["history"]["ask"][-1]["content"], "消息 299")
+        finally:
+            store.close()
+
+    def test_close_flushes_pending_writes(self):
+        store = DeepResearchSessionStore(self.db_path)
+        store.create_session("s1")
+        store.append_history("s1", "ask", "user", "最后一条")
+        store.close()
+
+        store = DeepResearchSessionStore(self.db_path)
+        try:
+            self.assertEqual(store.load("s1")["history"]["ask"][0]["content"], "最后一条")
+        finally:
+            store.close()
+
+    def test_prune_removes_expired_sessions(self):
+        store = DeepResearchSessionStore(self.db_path, retention_days=1)
+        try:
+            for session_id in ("old", "new"):
+                store.create_session(session_id)
+                store.append_history(session_id, "ask", "user", "内容")
+            store.exists("old")
+
+            conn = sqlite3.connect(self.db_path)
+            conn.execute("UPDATE sessions SET updated_at = ? WHERE session_id = 'old'", (time.time() - 2 * 24 * 3600,))
+            conn.commit()
+            conn.close()
+
+            self.assertEqual(store.prune(), 1)
+            self.assertFalse(store.exists("old"))
+            self.assertTrue(store.exists("new"))
+            self.assertEqual(store.load_original_history("old"), [])
+        finally:
+            store.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
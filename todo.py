@@ -0,0 +1,127 @@
+import hashlib
+
+
+# Todo项状态
+TODO_STATUSES = ("队列中", "进行中", "已完成", "执行失败")
+
+
+class TodoStore:
+    """
+    深度研究Todo list
+
+    以ID为key保存Todo项并保持添加顺序，按ID查找和修改状态为O(1)；
+    ID由步骤内容生成，重复的步骤或哈希冲突时生成新的ID，保证唯一。
+    每个Todo项可以依赖其他Todo项，依赖未完成时该项处于阻塞状态。
+    """
+    def __init__(self):
+        # id -> Todo项，按添加顺序排列
+        self._items: dict = {}
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, todo_id: str) -> bool:
+        return todo_id in self._items
+
+    def _new_id(self, step: str) -> str:
+        seed = step
+        index = 1
+        while True:
+            todo_id = hashlib.md5(seed.encode("utf-8")).hexdigest()[:6]
+            if todo_id not in self._items:
+                return todo_id
+            index += 1
+            seed = f"{step}\x00{index}"
+
+    def add(self, step: str, status: str = "队列中", reason: str = "", depends_on: list = None) -> dict:
+        """
+        添加Todo项，depends_on 为依赖的Todo项ID列表，返回新添加的Todo项
+        """
+        todo = {
+            "id": self._new_id(step),
+            "step": step,
+            "status": status,
+            "reason": reason,
+            "depends_on": [todo_id for todo_id in depends_on or [] if todo_id in self._items],
+        }
+        self._items[todo["id"]] = todo
+        return todo
+
+    def get(self, todo_id: str) -> dict:
+        return self._items.get(todo_id)
+
+    def blocked_by(self, todo_id: str) -> list:
+        """
+        获取尚未完成的依赖项ID
+        """
+        todo = self._items.get(todo_id)
+        if todo is None:
+            return []
+        return [
+            dependency for dependency in todo.get("depends_on", [])
+            if dependency in self._items and self._items[dependency]["status"] != "已完成"
+        ]
+
+    def set_status(self, todo_id: str, status: str, reason: str = "") -> bool:
+        if not isinstance(todo_id, str):
+            return False
+        todo = self._items.get(todo_id)
+        if todo is None:
+            return False
+        todo["status"] = status
+        todo["reason"] = reason or ""
+        return True
+
+    def set_statuses(self, updates: list) -> dict:
+        """
+        批量修改Todo项状态，updates 为 [{"id", "status", "reason"}]
+
+        返回 {"updated": [已修改的项], "not_found": [不存在的ID], "invalid": [状态无效的ID]}
+        """
+        result = {"updated": [], "not_found": [], "invalid": []}
+        for update in updates:
+            if not isinstance(update, dict):
+                result["not_found"].append(str(update))
+                continue
+            todo_id = update.get("id")
+            status = update.get("status")
+            # ID来自模型输出，可能是列表、字典等不可哈希的值
+            if not isinstance(todo_id, str):
+                result["not_found"].append(str(todo_id))
+                continue
+            if todo_id not in self._items:
+                result["not_found"].append(todo_id)
+                continue
+            if status not in TODO_STATUSES:
+                result["invalid"].append(todo_id)
+                continue
+            self.set_status(todo_id, status, update.get("reason"))
+            result["updated"].append(self._items[todo_id])
+        return result
+
+    def items(self) -> list:
+        return list(self._items.values())
+
+    def load(self, items: list):
+        """
+        载入已保存的Todo项
+        """
+        self._items = {}
+        for todo in items:
+            todo.setdefault("depends_on", [])
+            self._items[todo["id"]] = todo
+
+    def to_list(self) -> list:
+        """
+        转换为返回给模型的列表，包含未完成的依赖项
+        """
+        result = []
+        for todo in self._items.values():
+            item = {key: todo[key] for key in ("id", "step", "status", "reason")}
+            if todo.get("depends_on"):
+                item["depends_on"] = todo["depends_on"]
+                blocked_by = self.blocked_by(todo["id"])
+                if blocked_by:
+                    item["blocked_by"] = blocked_by
+            result.append(item)
+        return result
@@ -0,0 +1,139 @@
+import asyncio
+import inspect
+import json
+
+from astrbot.api import logger
+from astrbot.api.event import AstrMessageEvent
+
+from .compaction import elide_text
+from .json_repair import validate_tool_call
+
+
+def tool_call_name(tool_call) -> str:
+    """
+    tool_use 中单个调用的工具名称，格式不正确时返回 `无效调用`
+    """
+    if isinstance(tool_call, dict) and isinstance(tool_call.get("tool_name"), str):
+        return tool_call["tool_name"]
+    return "无效调用"
+
+
+class ToolExecutor:
+    """
+    深度研究工具调用
+
+    通过 AstrBot 的函数工具管理器调用工具，同一个action中的多个工具调用并发执行，
+    每个调用单独限制超时时间，单个调用失败不影响其他调用的结果。
+    """
+    def __init__(self, tool_manager, max_concurrency: int = 4, timeout: float = 60, max_result_tokens: int = 4000,
+                 search_tool: str = "web_search", search_query_arg: str = "query"):
+        self._tool_manager = tool_manager
+
+        # 全部会话共用的工具调用并发上限
+        self._semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+        # 单次工具调用超时时间(秒)，0为不限制
+        self._timeout = timeout if timeout and timeout > 0 else None
+
+        # 单个工具调用结果的最大token数量，超出部分省略
+        self._max_result_tokens = max(64, max_result_tokens)
+
+        # search action 使用的搜索工具及关键词参数名
+        self._search_tool = search_tool
+        self._search_query_arg = search_query_arg
+
+    @staticmethod
+    def _result_to_text(result) -> str:
+        if result is None:
+            return ""
+        if isinstance(result, str):
+            return result
+        # MCP 工具调用结果
+        if hasattr(result, "content") and isinstance(result.content, list):
+            return "\n".join(getattr(item, "text", str(item)) for item in result.content)
+        # 插件工具 yield 的消息结果
+        if hasattr(result, "get_plain_text"):
+            return result.get_plain_text()
+        try:
+            return json.dumps(result, ensure_ascii=False)
+        except (TypeError, ValueError):
+            return str(result)
+
+    async def _invoke(self, event: AstrMessageEvent, tool_name: str, args: dict) -> str:
+        tool = self._tool_manager.get_func(tool_name)
+        if tool is None:
+            raise ValueError(f"工具不存在: {tool_name}")
+
+        if getattr(tool, "origin", None) == "mcp":
+            result = await tool.mcp_client.session.call_tool(name=tool_name, arguments=args)
+            return self._result_to_text(result)
+
+        if tool.handler is None:
+            raise ValueError(f"工具没有可调用的处理函数: {tool_name}")
+
+        result = tool.handler(event, **args)
+        if inspect.isasyncgen(result):
+            # 插件工具可能多次 yield 结果
+            outputs = [self._result_to_text(item) async for item in result]
+            return "\n".join(output for output in outputs if output)
+        if inspect.isawaitable(result):
+            result = await result
+        return self._result_to_text(result)
+
+    async def call(self, event: AstrMessageEvent, tool_name: str, args: dict) -> str:
+        """
+        调用单个工具，返回调用结果文本，失败时抛出异常
+        """
+        async with self._semaphore:
+            result = await asyncio.wait_for(self._invoke(event, tool_name, args or {}), timeout=self._timeout)
+        return elide_text(result, self._max_result_tokens)
+
+    async def _call_safely(self, event: AstrMessageEvent, tool_name: str, args: dict):
+        try:
+            return await self.call(event, tool_name, args)
+        except asyncio.TimeoutError:
+            logger.warning(f"工具调用超时: {tool_name}")
+            return {"error": f"工具调用超时({self._timeout}s)"}
+        except Exception as e:
+            logger.warning(f"工具调用失败: {tool_name}, {e}")
+            return {"error": f"工具调用失败: {e}"}
+
+    @staticmethod
+    async def _invalid_call(error: str) -> dict:
+        logger.warning(f"工具调用格式错误: {error}")
+        return {"error": error}
+
+    async def run_tool_use(self, event: AstrMessageEvent, tool_calls: list) -> dict:
+        """
+        并发执行 tool_use action 中的工具调用，返回 {工具名称: 调用结果}
+
+        同一工具被调用多次时，之后的结果以 `工具名称#序号` 为key，格式不正确的调用返回错误原因
+        """
+        keys = []
+        tasks = []
+        for tool_call in tool_calls:
+            tool_name = tool_call_name(tool_call)
+            key = tool_name
+            index = 2
+            while key in keys:
+                key = f"{tool_name}#{index}"
+                index += 1
+            keys.append(key)
+            error = validate_tool_call(tool_call)
+            if error is not None:
+                tasks.append(self._invalid_call(error))
+            else:
+                tasks.append(self._call_safely(event, tool_name, tool_call.get("args")))
+
+        results = await asyncio.gather(*tasks)
+        return dict(zip(keys, results))
+
+    async def run_search(self, event: AstrMessageEvent, keywords: list) -> list:
+        """
+        并发搜索多个关键词，返回 [{"keyword": 关键词, "result": 搜索结果}]
+        """
+        results = await asyncio.gather(*[
+            self._call_safely(event, self._search_tool, {self._search_query_arg: keyword})
+            for keyword in keywords
+        ])
+        return [{"keyword": keyword, "result": result} for keyword, result in zip(keywords, results)]
@@ -0,0 +1,92 @@
+import json
+import os
+import re
+import time
+
+from astrbot.api import logger
+
+from .compaction import estimate_tokens, messages_tokens
+
+
+_SESSION_ID_RE = re.compile(r"[^\w\-]")
+
+
+def request_tokens(prompt: str, contexts: list, system_prompt: str) -> int:
+    """
+    按文本长度估算一次模型调用发送的token数量，录制和回放使用同一种估算方式，便于比较
+    """
+    return estimate_tokens(system_prompt) + messages_tokens(contexts or []) + estimate_tokens(prompt)
+
+
+class TrajectoryRecorder:
+    """
+    深度研究会话轨迹录制
+
+    按调用顺序记录 call_llm 发送给模型的提示词、上下文、系统提示词和模型输出，
+    每个会话保存为 <record_dir>/<session_id>.jsonl，每行一次模型调用，可用于离线回放压测。
+    """
+    def __init__(self, record_dir: str):
+        self._record_dir = record_dir
+        os.makedirs(self._record_dir, exist_ok=True)
+
+        # session_id -> 下一条记录的序号
+        self._seq = {}
+
+    def path(self, session_id: str) -> str:
+        return os.path.join(self._record_dir, f"{_SESSION_ID_RE.sub('_', session_id)}.jsonl")
+
+    def _next_seq(self, session_id: str) -> int:
+        if session_id not in self._seq:
+            # 恢复的会话接着已有的记录继续编号
+            seq = 0
+            try:
+                with open(self.path(session_id), "r", encoding="utf-8") as f:
+                    seq = sum(1 for line in f if line.strip())
+            except FileNotFoundError:
+                pass
+            self._seq[session_id] = seq
+        seq = self._seq[session_id]
+        self._seq[session_id] = seq + 1
+        return seq
+
+    def record(self, session_id: str, stage: str, prompt: str, contexts: list, system_prompt: str, output: str,
+               source: str = "system", regeneration: int = 0, latency: float = 0.0):
+        """
+        记录一次模型调用
+
+        source 为 user 时 prompt 是用户输入(研究主题或 ask/answer 的回复)，回放时作为模拟的用户消息发送
+        """
+        entry = {
+            "session_id": session_id,
+            "seq": self._next_seq(session_id),
+            "time": time.time(),
+            "stage": stage,
+            "source": source,
+            "regeneration": regeneration,
+            "prompt": prompt,
+            "contexts": contexts,
+            "system_prompt": system_prompt,
+            "output": output,
+            "prompt_tokens": request_tokens(prompt, contexts, system_prompt),
+            "completion_tokens": estimate_tokens(output),
+            "latency": round(latency, 4),
+        }
+        try:
+            with open(self.path(session_id), "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"录制深度研究会话轨迹失败: {e}")
+
+
+def load_trajectory(path: str) -> list:
+    """
+    读取录制的会话轨迹，按序号排列
+    """
+    entries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                entries.append(json.loads(line))
+    entries.sort(key=lambda entry: entry["seq"])
+    return entries
@@ -0,0 +1,148 @@
+from collections import deque
+
+
+def _usage_field(usage, *names) -> int:
+    for name in names:
+        value = usage.get(name) if isinstance(usage, dict) else getattr(usage, name, None)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return int(value)
+    return None
+
+
+def response_usage(response) -> tuple:
+    """
+    读取模型回复中上游返回的token用量，返回 (输入token, 输出token)，没有用量信息时返回None
+
+    兼容 OpenAI(prompt_tokens/completion_tokens)、Anthropic(input_tokens/output_tokens)
+    和 Gemini(prompt_token_count/candidates_token_count) 的格式
+    """
+    if response is None:
+        return None
+
+    candidates = [getattr(response, "usage", None)]
+    raw_completion = getattr(response, "raw_completion", None)
+    if isinstance(raw_completion, dict):
+        candidates.append(raw_completion.get("usage") or raw_completion.get("usage_metadata"))
+    elif raw_completion is not None:
+        candidates.append(getattr(raw_completion, "usage", None) or getattr(raw_completion, "usage_metadata", None))
+
+    for usage in candidates:
+        if usage is None:
+            continue
+        prompt_tokens = _usage_field(usage, "prompt_tokens", "input_tokens", "input", "prompt_token_count")
+        completion_tokens = _usage_field(usage, "completion_tokens", "output_tokens", "output", "candidates_token_count")
+        if prompt_tokens is not None or completion_tokens is not None:
+            return prompt_tokens or 0, completion_tokens or 0
+    return None
+
+
+def _empty_totals() -> dict:
+    return {
+        "calls": 0,
+        "turns": 0,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "latency": 0.0,
+        "retries": 0,
+        "parse_retries": 0,
+        "estimated_calls": 0,
+    }
+
+
+class SessionUsage:
+    """
+    深度研究会话的模型调用用量
+
+    每次生成回复记为一次调用(call)，call_llm 第一次生成记为一轮(turn)，
+    因无法解析而重新生成的记为 parse_retries，Provider 超时或出错后的重试记为 retries。
+    上游没有返回token用量时使用估算值，并计入 estimated_calls。
+    """
+    def __init__(self, max_records: int = 100):
+        self.totals = _empty_totals()
+
+        # 阶段 -> 该阶段的用量合计
+        self.stages: dict = {}
+
+        # 最近的调用记录
+        self.records = deque(maxlen=max(1, max_records))
+
+    @property
+    def total_tokens(self) -> int:
+        return self.totals["prompt_tokens"] + self.totals["completion_tokens"]
+
+    @property
+    def turns(self) -> int:
+        return self.totals["turns"]
+
+    def _add(self, totals: dict, record: dict):
+        totals["calls"] += record.get("calls", 1)
+        totals["turns"] += record["turns"]
+        totals["prompt_tokens"] += record["prompt_tokens"]
+        totals["completion_tokens"] += record["completion_tokens"]
+        totals["latency"] += record["latency"]
+        totals["retries"] += record["retries"]
+        totals["parse_retries"] += record["parse_retries"]
+        totals["estimated_calls"] += record["estimated_calls"]
+
+    def record(self, stage: str, prompt_tokens: int, completion_tokens: int, latency: float, attempts: int = 1,
+               regeneration: int = 0, estimated: bool = False) -> dict:
+        """
+        记录一次调用，regeneration 为该轮中重新生成的序号(0为第一次生成)，返回调用记录
+        """
+        record = {
+            "stage": stage,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "latency": latency,
+            "retries": max(0, attempts - 1),
+            "turns": 0 if regeneration else 1,
+            "parse_retries": 1 if regeneration else 0,
+            "estimated_calls": 1 if estimated else 0,
+        }
+        self._add(self.totals, record)
+        self._add(self.stages.setdefault(stage, _empty_totals()), record)
+        self.records.append(record)
+        return record
+
+    def load(self, stages: dict):
+        """
+        载入已保存的各阶段用量合计 {阶段: 合计}
+        """
+        self.totals = _empty_totals()
+        self.stages = {}
+        for stage, totals in stages.items():
+            self.stages[stage] = {**_empty_totals(), **totals}
+            self._add(self.totals, self.stages[stage])
+
+    def exceeded(self, max_tokens: int = 0, max_turns: int = 0) -> str:
+        """
+        检查是否超出预算，超出时返回原因，0为不限制
+        """
+        if max_tokens and self.total_tokens >= max_tokens:
+            return f"token预算上限({self.total_tokens}/{max_tokens})"
+        if max_turns and self.turns >= max_turns:
+            return f"轮次上限({self.turns}/{max_turns})"
+        return None
+
+    def to_dict(self) -> dict:
+        return {"total_tokens": self.total_tokens, **self.totals, "stages": self.stages}
+
+    def summary(self) -> str:
+        """
+        用量摘要文本
+        """
+        totals = self.totals
+        text = (
+            f"模型调用 {totals['calls']} 次({totals['turns']} 轮)，"
+            f"token {self.total_tokens} (输入 {totals['prompt_tokens']}，输出 {totals['completion_tokens']})，"
+            f"耗时 {totals['latency']:.1f}s，重试 {totals['retries']} 次，重新生成 {totals['parse_retries']} 次"
+        )
+        if totals["estimated_calls"]:
+            text += f"，其中 {totals['estimated_calls']} 次调用的token为估算值"
+        stages = "，".join(
+            f"{stage}: {values['prompt_tokens'] + values['completion_tokens']} token/{values['turns']} 轮"
+            for stage, values in self.stages.items()
+        )
+        if stages:
+            text += f"\n各阶段: {stages}"
+        return text